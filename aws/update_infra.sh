@@ -19,6 +19,6 @@ fi
 . $PMBASEDIR/aws/vars.sh
 rm -f $PMBASEDIR/aws/vars.bak
 echo "Setting up PYTHONPATH"
-export PYTHONPATH=$PMBASEDIR/utils:$PMBASEDIR/backend/feeder:$PMBASEDIR/backend/api
+export PYTHONPATH=$PMBASEDIR/utils:$PMBASEDIR/backend/feeder:$PMBASEDIR/backend/api:$PMBASEDIR/backend/indexer
 echo "done"
 
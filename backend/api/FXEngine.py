@@ -0,0 +1,175 @@
+from datetime import date, datetime, timedelta
+import unittest
+import numpy as np
+from numpy import ndarray
+from TimeSeries import TimeSeries
+from exceptions import PMException
+
+_DATEFORMAT='%Y-%m-%d'
+
+class FXEngine:
+    '''
+    Converts amounts between currencies using a single matrix of the USD rates of all currencies.
+    The matrix has one row per currency and one column per calendar day, from the oldest to the most recent rate of all currencies.
+    Days not covered by the time series of a currency are NaN.
+    As with fx_convert, amounts are converted to USD first and then from USD to the target currency.
+    With a loader, the rates of a currency are only loaded, and added to the matrix, when the currency is first used.
+    '''
+    def __init__(self, series:dict=None, loader=None) -> None:
+        '''
+        series: dictionary of (currency, TimeSeries of the USD rate of the currency)
+        loader: function returning the TimeSeries of the USD rate of a currency missing from the engine, or raising a PMException
+        '''
+        self._loader = loader
+        self._columns = {}
+        self._start:date = None
+        self._rates:ndarray = np.full((0, 0), np.nan)
+        # Index of the first and last day covered by each currency
+        self._coverage:ndarray = np.zeros((0, 2), dtype=int)
+        for currency, ts in (series or {}).items(): self.add(currency, ts)
+
+    def add(self, currency:str, ts:TimeSeries):
+        '''
+        Adds the USD rates of currency to the matrix, which is extended to the days covered by ts
+        '''
+        start:date = ts.get_start_date() if self._start is None else min(self._start, ts.get_start_date())
+        end:date = ts.get_start_date() + timedelta(days=ts.size()-1)
+        if self._rates.shape[1] > 0: end = max(end, self._start + timedelta(days=self._rates.shape[1]-1))
+        shift = 0 if self._start is None else (self._start - start).days
+        rates = np.full((len(self._columns) + 1, (end - start).days + 1), np.nan)
+        rates[:-1, shift:shift+self._rates.shape[1]] = self._rates
+        coverage = np.zeros((len(self._columns) + 1, 2), dtype=int)
+        coverage[:-1] = self._coverage + shift
+        first = (ts.get_start_date() - start).days
+        rates[-1, first:first+ts.size()] = ts.get_full_time_series()
+        coverage[-1] = (first, first+ts.size()-1)
+        (self._start, self._rates, self._coverage) = (start, rates, coverage)
+        self._columns[currency] = len(self._columns)
+
+    def _row(self, currency:str)->int:
+        if currency not in self._columns:
+            if self._loader is None: raise PMException("Could not find time series for currency {currency}".format(currency = currency))
+            self.add(currency, self._loader(currency))
+        return self._columns[currency]
+
+    def _check(self, currency:str, first:int, last:int):
+        (covered_first, covered_last) = self._coverage[self._row(currency)]
+        if (first < covered_first) or (last > covered_last):
+            start = np.datetime64(self._start, 'D')
+            raise PMException("Cannot get the {currency} rates from {first} to {last}, the rates range from {first_date} to {last_date}".format(currency=currency,
+                first=(start + first).item().strftime(_DATEFORMAT), last=(start + last).item().strftime(_DATEFORMAT),
+                first_date=(start + covered_first).item().strftime(_DATEFORMAT), last_date=(start + covered_last).item().strftime(_DATEFORMAT)))
+
+    def get_rates(self, currency:str, dates):
+        '''
+        Returns the USD rates of currency at dates.
+        dates can be a date or a numpy datetime64 (a single rate is returned) or a numpy array of datetime64 (an array of rates is returned).
+        '''
+        row = self._row(currency)
+        if isinstance(dates, (ndarray, np.datetime64)):
+            index = (dates.astype('datetime64[D]') - np.datetime64(self._start, 'D')).astype(int)
+            if index.size > 0: self._check(currency, index.min(), index.max())
+            return self._rates[row, index]
+        if isinstance(dates, datetime): dates = dates.date()
+        index = (dates - self._start).days
+        self._check(currency, index, index)
+        return self._rates[row, index]
+
+    def get_range(self, currency:str, start_date:date, days:int)->ndarray:
+        '''
+        Returns a view on the USD rates of currency for the days calendar days starting at start_date.
+        '''
+        row = self._row(currency)
+        if isinstance(start_date, np.datetime64): start_date = start_date.astype('datetime64[D]').item()
+        if isinstance(start_date, datetime): start_date = start_date.date()
+        first = (start_date - self._start).days
+        self._check(currency, first, first+days-1)
+        return self._rates[row, first:first+days]
+
+    def convert(self, values, from_currency:str, to_currency:str, dates):
+        '''
+        Converts values from from_currency to to_currency using the rates at dates.
+        values and dates are either a single value and a date (or numpy datetime64), or two numpy arrays of the same size (values and datetime64 dates).
+        '''
+        if(from_currency != to_currency):
+            values_usd = values
+            if(from_currency != "USD"):
+                values_usd = values / self.get_rates(from_currency, dates)
+            if(to_currency != "USD"):
+                return values_usd * self.get_rates(to_currency, dates)
+            return values_usd
+        return values
+
+    def convert_range(self, values:ndarray, from_currency:str, to_currency:str, start_date:date)->ndarray:
+        '''
+        Converts values, one per calendar day from start_date, from from_currency to to_currency using the rates of their own date.
+        '''
+        if(from_currency != to_currency):
+            values_usd = values
+            if(from_currency != "USD"):
+                values_usd = values / self.get_range(from_currency, start_date, values.size)
+            if(to_currency != "USD"):
+                return values_usd * self.get_range(to_currency, start_date, values.size)
+            return values_usd
+        return values
+
+    def get_currencies(self)->list:
+        return list(self._columns.keys())
+
+
+class UnitTestFXEngine(unittest.TestCase):
+    def create_engine(self)->FXEngine:
+        eur = TimeSeries(np.array([0.5, 0.5, 0.25, 0.25]), date(2022,1,1), date(2022,1,4))
+        chf = TimeSeries(np.array([2.0, 4.0]), date(2022,1,3), date(2022,1,4))
+        return FXEngine({"EUR":eur, "CHF":chf})
+
+    def test_convert(self):
+        engine = self.create_engine()
+        self.assertEqual(engine.convert(10, "EUR", "USD", date(2022,1,1)), 20)
+        self.assertEqual(engine.convert(10, "USD", "EUR", datetime(2022,1,3)), 2.5)
+        self.assertEqual(engine.convert(10, "EUR", "CHF", date(2022,1,4)), 160)
+        self.assertEqual(engine.convert(10, "EUR", "EUR", date(2030,1,1)), 10)
+        dates = np.array(['2022-01-03', '2022-01-04', '2022-01-03'], dtype='datetime64[D]')
+        self.assertTrue(np.array_equal(engine.convert(np.array([1.0, 2.0, 3.0]), "CHF", "EUR", dates), [0.125, 0.125, 0.375]))
+        self.assertTrue(np.array_equal(engine.convert_range(np.array([1.0, 2.0]), "USD", "CHF", date(2022,1,3)), [2.0, 8.0]))
+        self.assertEqual(engine.convert(10, "EUR", "CHF", np.datetime64('2022-01-04')), 160)
+        self.assertEqual(engine.convert(10, "USD", "EUR", np.datetime64('2022-01-03T12:00')), 2.5)
+
+    def test_loader(self):
+        loaded = []
+        def loader(currency:str)->TimeSeries:
+            loaded.append(currency)
+            if currency == "GBP": raise PMException("Could not find time series for currency GBP")
+            return {"EUR":TimeSeries(np.array([0.5, 0.5, 0.25, 0.25]), date(2022,1,1), date(2022,1,4)),
+                    "CHF":TimeSeries(np.array([2.0, 4.0]), date(2022,1,3), date(2022,1,4)),
+                    "JPY":TimeSeries(np.array([100.0, 200.0]), date(2021,12,31), date(2022,1,1))}[currency]
+        engine = FXEngine(loader=loader)
+        self.assertEqual(engine.get_currencies(), [])
+        self.assertEqual(engine.convert(10, "CHF", "USD", date(2022,1,4)), 2.5)
+        self.assertEqual(loaded, ["CHF"])
+        self.assertEqual(engine.convert(10, "EUR", "CHF", date(2022,1,4)), 160)
+        # The rates loaded before are kept when the matrix is extended to the days of a new currency
+        self.assertEqual(engine.convert(1, "JPY", "EUR", date(2022,1,1)), 0.0025)
+        self.assertTrue(np.array_equal(engine.get_range("EUR", date(2022,1,1), 4), [0.5, 0.5, 0.25, 0.25]))
+        self.assertEqual(engine.convert(10, "CHF", "USD", date(2022,1,3)), 5)
+        self.assertEqual(loaded, ["CHF", "EUR", "JPY"])
+        self.assertRaises(PMException, engine.convert, 1, "USD", "GBP", date(2022,1,1))
+        self.assertRaises(PMException, engine.convert, 1, "USD", "JPY", date(2022,1,2))
+
+    def test_coverage(self):
+        engine = self.create_engine()
+        for (currency, d) in [("CHF", date(2022,1,2)), ("EUR", date(2022,1,5)), ("GBP", date(2022,1,2))]:
+            try:
+                engine.convert(1, "USD", currency, d)
+                self.assertTrue(False)
+            except PMException:
+                self.assertTrue(True)
+        try:
+            engine.convert_range(np.ones(3), "CHF", "USD", date(2022,1,2))
+            self.assertTrue(False)
+        except PMException:
+            self.assertTrue(True)
+
+
+if __name__ == '__main__':
+    unittest.main()
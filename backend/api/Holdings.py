@@ -0,0 +1,281 @@
+from datetime import date, datetime, timedelta
+import unittest
+import numpy
+from numpy import ndarray
+from PositionIdentifier import CASH, EQUITY, Currency, PositionIdentifier, Ticker
+from Positions import Positions
+from dateutils import todatetime
+from exceptions import PMException
+
+
+def _todate64(d:date)->numpy.datetime64:
+    if isinstance(d, datetime): d = d.date()
+    return numpy.datetime64(d, 'D')
+
+class Holdings:
+    '''
+    Compact representation of the positions of a portfolio over time.
+    Positions only change on transaction dates, so they are stored once per change date:
+    . dates: sorted numpy array of the change dates
+    . identifiers: the position identifiers (one column per identifier ever held)
+    . quantities: a (change dates x identifiers) numpy matrix of quantities, the only record of the quantities held
+    The positions held on any date d are the ones of the latest change date before or on d, found with a binary search.
+    Positions are never removed from a portfolio (a sold out position keeps a zero quantity), so the identifiers held at a change date are
+    the ones first held on or before it, in the order a replay of the transactions gives: by first date, then by order of appearance on that date.
+    The arrays have spare rows and columns and double their capacity when full, so recording a history does not reallocate them on every change.
+    '''
+    __CAPACITY = 16
+
+    def __init__(self) -> None:
+        self._size = 0
+        self._dates:ndarray = numpy.empty(Holdings.__CAPACITY, dtype='datetime64[D]')
+        self._quantities:ndarray = numpy.zeros((Holdings.__CAPACITY, Holdings.__CAPACITY))
+        self._identifiers:list = []
+        self._columns:dict = {}
+        # For each column, the date the identifier is first held and its order of appearance among the identifiers first held that date
+        self._first:ndarray = numpy.full(Holdings.__CAPACITY, numpy.datetime64('NaT'), dtype='datetime64[D]')
+        self._rank:ndarray = numpy.zeros(Holdings.__CAPACITY, dtype=int)
+        # Columns in the order of the positions, computed on demand
+        self._order:ndarray = None
+
+    def _row(self, d:numpy.datetime64)->int:
+        '''
+        Returns the row of the change date d, inserting it as a copy of the positions in effect before d if needed.
+        '''
+        row = int(numpy.searchsorted(self._dates[:self._size], d))
+        if (row < self._size) and (self._dates[row] == d): return row
+        if self._size == self._dates.size:
+            dates = numpy.empty(2*self._dates.size, dtype=self._dates.dtype)
+            dates[:self._size] = self._dates[:self._size]
+            quantities = numpy.zeros((2*self._dates.size, self._quantities.shape[1]))
+            quantities[:self._size] = self._quantities[:self._size]
+            (self._dates, self._quantities) = (dates, quantities)
+        # Shift the later change dates by one row
+        self._dates[row+1:self._size+1] = self._dates[row:self._size]
+        self._quantities[row+1:self._size+1] = self._quantities[row:self._size]
+        self._dates[row] = d
+        self._quantities[row] = self._quantities[row-1] if row > 0 else 0
+        self._size += 1
+        return row
+
+    def _column(self, pi:PositionIdentifier)->int:
+        column = self._columns.get(pi)
+        if column is not None: return column
+        column = len(self._identifiers)
+        if column == self._first.size:
+            quantities = numpy.zeros((self._quantities.shape[0], 2*column))
+            quantities[:, :column] = self._quantities
+            self._quantities = quantities
+            self._first = numpy.concatenate((self._first, numpy.full(column, numpy.datetime64('NaT'), dtype=self._first.dtype)))
+            self._rank = numpy.concatenate((self._rank, numpy.zeros(column, dtype=int)))
+        self._columns[pi] = column
+        self._identifiers.append(pi)
+        return column
+
+    def _hold(self, column:int, d:numpy.datetime64):
+        '''
+        Records that the identifier of column is held from d, appearing after the identifiers already first held that date.
+        '''
+        if numpy.isnat(self._first[column]) or (self._first[column] > d):
+            self._rank[column] = numpy.count_nonzero(self._first[:len(self._identifiers)] == d)
+            self._first[column] = d
+            self._order = None
+
+    def update(self, posdate:datetime, positions:Positions):
+        '''
+        Records positions as the positions held from posdate until the next change date.
+        '''
+        d = _todate64(posdate)
+        row = self._row(d)
+        columns = [self._column(pi) for pi in positions]
+        self._quantities[row] = 0
+        for (column, pi) in zip(columns, positions):
+            self._hold(column, d)
+            self._quantities[row, column] = positions[pi]
+
+    def add(self, posdate:datetime, pi:PositionIdentifier, quantity):
+        '''
+        Adds quantity to the position pi from posdate: posdate becomes a change date if it is not one already,
+        and the quantity is added to it and to every later change date with a single slice of the quantities matrix.
+        '''
+        d = _todate64(posdate)
+        row = self._row(d)
+        column = self._column(pi)
+        self._hold(column, d)
+        self._quantities[row:self._size, column] += quantity
+
+    def get_quantity(self, posdate:datetime, pi:PositionIdentifier):
+        '''
+        Returns the quantity of pi held at posdate, None if pi is not held at posdate.
+        '''
+        row = self.index(posdate)
+        column = self._columns.get(pi)
+        if (row < 0) or (column is None) or not (self._first[column] <= self._dates[row]): return None
+        return self._quantities[row, column]
+
+    def min_quantity(self, posdate:datetime, pi:PositionIdentifier):
+        '''
+        Returns the minimum quantity of pi held at the change dates after posdate (excluded), None if there is no such change date.
+        '''
+        row = self.index(posdate) + 1
+        if row >= self._size: return None
+        if pi not in self._columns: return 0
+        return self._quantities[row:self._size, self._columns[pi]].min()
+
+    def copy(self):
+        '''
+        Returns a copy of the holdings sharing the (immutable) position identifiers
+        '''
+        toreturn = Holdings()
+        toreturn._size = self._size
+        toreturn._dates = self._dates.copy()
+        toreturn._quantities = self._quantities.copy()
+        toreturn._identifiers = list(self._identifiers)
+        toreturn._columns = dict(self._columns)
+        toreturn._first = self._first.copy()
+        toreturn._rank = self._rank.copy()
+        return toreturn
+
+    def index(self, posdate:datetime)->int:
+        '''
+        Returns the index of the change date in effect at posdate, or -1 if posdate is before the first change date.
+        '''
+        return int(numpy.searchsorted(self._dates[:self._size], _todate64(posdate), side='right')) - 1
+
+    def _held(self, row:int)->list:
+        '''
+        Returns the columns of the identifiers held at the change date indexed by row, in the order of the positions.
+        '''
+        count = len(self._identifiers)
+        if self._order is None:
+            # Identifiers never held (NaT first date) sort last
+            self._order = numpy.lexsort((self._rank[:count], self._first[:count]))
+        return self._order[self._first[self._order] <= self._dates[row]].tolist()
+
+    def get_positions(self, posdate:datetime)->Positions:
+        '''
+        Returns the positions held at posdate, built from the quantities matrix.
+        '''
+        row = self.index(posdate)
+        if row < 0:
+            raise PMException(f"No positions recorded at {posdate}. The first positions are recorded at {self._dates[0] if self._size > 0 else None}.")
+        toreturn = Positions()
+        quantities = self._quantities[row].tolist()
+        for column in self._held(row):
+            toreturn[self._identifiers[column]] = quantities[column]
+        return toreturn
+
+    def get_dates(self)->ndarray:
+        return self._dates[:self._size]
+
+    def get_identifiers(self)->list:
+        return self._identifiers
+
+    def get_holdings(self, row:int):
+        '''
+        Iterates over the (position identifier, quantity) held at the change date indexed by row, in the order of the positions.
+        '''
+        for column in self._held(row):
+            yield (self._identifiers[column], self._quantities[row, column])
+
+    def get_periods(self, start_date:datetime, end_date:datetime)->list:
+        '''
+        Returns the list of (period start, period end, row) tuples covering start_date to end_date (both inclusive).
+        The holdings are constant within each period and given by the change date indexed by row.
+        The periods start at the first change date if start_date is before it.
+        '''
+        start = _todate64(start_date)
+        end = _todate64(end_date)
+        first = max(self.index(start_date), 0)
+        last = self.index(end_date)
+        toreturn = []
+        for row in range(first, last+1):
+            period_start = max(self._dates[row], start)
+            period_end = end if row == self._size-1 else min(self._dates[row+1] - 1, end)
+            toreturn.append((todatetime(period_start.item()), todatetime(period_end.item()), row))
+        return toreturn
+
+    def get_quantities(self, start_date:datetime, end_date:datetime)->ndarray:
+        '''
+        Returns a (days x identifiers) matrix of the quantities held every day from start_date to end_date (both inclusive).
+        Nothing is held before the first change date, so the days before it have zero quantities.
+        Columns are ordered as get_identifiers().
+        '''
+        periods = self.get_periods(start_date, end_date)
+        rows = [row for (_, _, row) in periods]
+        repeats = [(period_end - period_start).days + 1 for (period_start, period_end, _) in periods]
+        quantities = numpy.repeat(self._quantities[rows, :len(self._identifiers)], repeats, axis=0)
+        leading = int((_todate64(end_date) - _todate64(start_date)).astype(int)) + 1 - quantities.shape[0]
+        if leading <= 0: return quantities
+        return numpy.concatenate((numpy.zeros((leading, quantities.shape[1])), quantities))
+
+    def __len__(self):
+        return self._size
+
+
+class UnitTestHoldings(unittest.TestCase):
+    def test_holdings(self):
+        usd = PositionIdentifier(CASH, Currency('USD'))
+        msft = PositionIdentifier(EQUITY, Ticker('MSFT'))
+        p1 = Positions()
+        p1[usd] = 100
+        p2 = Positions()
+        p2[usd] = 50
+        p2[msft] = 10
+        h = Holdings()
+        h.update(datetime(2022,9,5), p2)
+        h.update(datetime(2022,9,1), p1)
+        self.assertEqual(len(h), 2)
+        self.assertEqual(h.index(datetime(2022,8,31)), -1)
+        self.assertEqual(h.get_positions(datetime(2022,9,4)).state(), p1.state())
+        self.assertEqual(h.get_positions(datetime(2022,9,5)).state(), p2.state())
+        self.assertEqual(h.get_positions(datetime(2023,1,1)).state(), p2.state())
+        self.assertEqual(list(h.get_holdings(1)), [(usd, 50), (msft, 10)])
+        q = h.get_quantities(datetime(2022,9,3), datetime(2022,9,6))
+        self.assertEqual(q.shape, (4, 2))
+        self.assertTrue(numpy.array_equal(q[:,0], [100, 100, 50, 50]))
+        self.assertTrue(numpy.array_equal(q[:,1], [0, 0, 10, 10]))
+        # One row per day even before the first change date
+        q = h.get_quantities(datetime(2022,8,30), datetime(2022,9,2))
+        self.assertEqual(q.shape, (4, 2))
+        self.assertTrue(numpy.array_equal(q[:,0], [0, 0, 100, 100]))
+        self.assertTrue(numpy.array_equal(h.get_quantities(datetime(2022,8,1), datetime(2022,8,3)), numpy.zeros((3, 2))))
+        self.assertEqual(h.get_periods(datetime(2022,9,3), datetime(2022,9,6)), [(datetime(2022,9,3), datetime(2022,9,4), 0), (datetime(2022,9,5), datetime(2022,9,6), 1)])
+        self.assertEqual(h.min_quantity(datetime(2022,9,1), msft), 10)
+        self.assertIsNone(h.min_quantity(datetime(2022,9,5), msft))
+        h.add(datetime(2022,9,2), usd, -20)
+        self.assertEqual(len(h), 3)
+        self.assertEqual(list(h.get_holdings(0)), [(usd, 100)])
+        self.assertEqual(list(h.get_holdings(1)), [(usd, 80)])
+        self.assertEqual(list(h.get_holdings(2)), [(usd, 30), (msft, 10)])
+        self.assertEqual(h.get_positions(datetime(2022,9,6))[usd], 30)
+        # A backdated identifier is ordered as a replay would order it
+        eur = PositionIdentifier(CASH, Currency('EUR'))
+        c = h.copy()
+        c.add(datetime(2022,9,3), eur, 5)
+        self.assertEqual(list(c.get_positions(datetime(2022,9,5))), [usd, eur, msft])
+        self.assertIsNone(c.get_quantity(datetime(2022,9,2), eur))
+        self.assertEqual(c.get_quantity(datetime(2022,9,4), eur), 5)
+        self.assertIsNone(h.get_quantity(datetime(2022,9,4), eur))
+
+    def test_growth(self):
+        # More change dates and identifiers than the initial capacity, recorded backwards
+        identifiers = [PositionIdentifier(CASH, Currency(currency)) for currency in ['USD', 'EUR', 'CHF', 'GBP', 'JPY']]
+        tickers = [PositionIdentifier(EQUITY, Ticker('T{i}'.format(i=i))) for i in range(40)]
+        h = Holdings()
+        for day in range(100, 0, -1):
+            p = Positions()
+            for pi in identifiers + tickers[:day // 3]:
+                p[pi] = day
+            h.update(datetime(2022,1,1) + timedelta(days=day), p)
+        self.assertEqual(len(h), 100)
+        self.assertTrue((numpy.diff(h.get_dates()) > numpy.timedelta64(0, 'D')).all())
+        self.assertEqual(len(h.get_identifiers()), 38)
+        positions = h.get_positions(datetime(2022,1,1) + timedelta(days=50))
+        self.assertEqual(list(positions), identifiers + tickers[:16])
+        self.assertEqual(positions[identifiers[0]], 50)
+        self.assertEqual(h.get_quantities(datetime(2022,1,2), datetime(2022,4,11)).shape, (100, 38))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,280 @@
+from datetime import date, timedelta
+import unittest
+import numpy as np
+from numpy import ndarray, number
+from analytics import chain_returns
+from exceptions import PMException
+from pmdata import fx_convert_range
+from TimeSeries import TimeSeries
+
+_DATEFORMAT='%Y-%m-%d'
+
+class _Node:
+    '''
+    Node of the plan of a lazy time series, covering the dates from start_date to end_date.
+    evaluate returns a tuple (values from start to end, True if the values are a temporary array which can be overwritten)
+    '''
+    def __init__(self, start_date:date, end_date:date) -> None:
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def evaluate(self, start_date:date, end_date:date)->tuple:
+        raise NotImplementedError()
+
+class _Leaf(_Node):
+    def __init__(self, ts:TimeSeries) -> None:
+        if (ts.start_date == None) or (ts.end_date == None): raise PMException("Cannot create a lazy time series from a time series without dates")
+        super().__init__(ts.start_date, ts.end_date)
+        self.ts = ts
+
+    def evaluate(self, start_date:date, end_date:date)->tuple:
+        # A view on the elements of the time series
+        return (self.ts.get_range(start_date, end_date), False)
+
+class _Cut(_Node):
+    def __init__(self, node:_Node, start_date:date, end_date:date) -> None:
+        if (start_date < node.start_date) or (end_date > node.end_date) or (start_date > end_date):
+            raise PMException("Cannot cut the time series from {start} to {end}, the time series ranges from {first_date} to {last_date}".format(start=start_date.strftime(_DATEFORMAT),
+            end=end_date.strftime(_DATEFORMAT), first_date=node.start_date.strftime(_DATEFORMAT), last_date=node.end_date.strftime(_DATEFORMAT)))
+        super().__init__(start_date, end_date)
+        self.node = node
+
+    def evaluate(self, start_date:date, end_date:date)->tuple:
+        return self.node.evaluate(start_date, end_date)
+
+class _Operation(_Node):
+    '''
+    Element wise operation between a node and another node (aligned on the dates both cover), a numpy array (one element per date of the node) or a scalar
+    '''
+    def __init__(self, operator, left:_Node, right) -> None:
+        if isinstance(right, _Node):
+            (start_date, end_date) = (max(left.start_date, right.start_date), min(left.end_date, right.end_date))
+            if start_date > end_date: raise PMException("Cannot align the time series from {start1} to {end1} and from {start2} to {end2}, they do not overlap".format(
+                start1=left.start_date.strftime(_DATEFORMAT), end1=left.end_date.strftime(_DATEFORMAT), start2=right.start_date.strftime(_DATEFORMAT), end2=right.end_date.strftime(_DATEFORMAT)))
+        else:
+            (start_date, end_date) = (left.start_date, left.end_date)
+            if isinstance(right, ndarray) and (right.ndim > 0) and (right.size > 1) and (right.shape[0] != (end_date - start_date).days + 1):
+                raise PMException("Cannot compute with an array of size {size} and a time series from {start} to {end}".format(size=right.shape[0],
+                start=start_date.strftime(_DATEFORMAT), end=end_date.strftime(_DATEFORMAT)))
+        super().__init__(start_date, end_date)
+        self.operator = operator
+        self.left = left
+        self.right = right
+
+    def _operand(self, operand, start_date:date, end_date:date)->tuple:
+        if isinstance(operand, _Node): return operand.evaluate(start_date, end_date)
+        if isinstance(operand, ndarray) and (operand.ndim > 0) and (operand.size > 1):
+            first = (start_date - self.start_date).days
+            return (operand[first:first + (end_date - start_date).days + 1], False)
+        return (operand, False)
+
+    def evaluate(self, start_date:date, end_date:date)->tuple:
+        (a, a_owned) = self._operand(self.left, start_date, end_date)
+        (b, b_owned) = self._operand(self.right, start_date, end_date)
+        # The result is written over a temporary operand of the same type, so a chain of operations allocates a single array
+        dtype = np.result_type(a, b)
+        if a_owned and (a.dtype == dtype): return (self.operator(a, b, out=a), True)
+        if b_owned and (b.dtype == dtype) and (np.shape(b) == np.shape(a)): return (self.operator(a, b, out=b), True)
+        return (self.operator(a, b), True)
+
+class _Rebase(_Node):
+    def __init__(self, node:_Node, base_date:date, base_value:number) -> None:
+        if (base_date < node.start_date) or (base_date > node.end_date):
+            raise PMException("Cannot rebase the time series at {base_date}, the time series ranges from {first_date} to {last_date}".format(base_date=base_date.strftime(_DATEFORMAT),
+            first_date=node.start_date.strftime(_DATEFORMAT), last_date=node.end_date.strftime(_DATEFORMAT)))
+        super().__init__(base_date, node.end_date)
+        self.node = node
+        self.base_value = base_value
+
+    def evaluate(self, start_date:date, end_date:date)->tuple:
+        # Chaining the returns needs the values from the base date
+        (values, _) = self.node.evaluate(self.start_date, end_date)
+        return (chain_returns(values, self.base_value)[(start_date - self.start_date).days:], True)
+
+class _FXConversion(_Node):
+    def __init__(self, node:_Node, from_currency:str, to_currency:str, converter) -> None:
+        super().__init__(node.start_date, node.end_date)
+        self.node = node
+        self.from_currency = from_currency
+        self.to_currency = to_currency
+        self.converter = converter
+
+    def evaluate(self, start_date:date, end_date:date)->tuple:
+        (values, owned) = self.node.evaluate(start_date, end_date)
+        converted = self.converter(values, self.from_currency, self.to_currency, start_date)
+        return (converted, owned or (converted is not values))
+
+class _Transform(_Node):
+    '''
+    Applies function (from a TimeSeries to a TimeSeries with the same dates, such as a rolling statistic) to the values of the node.
+    The function looks back in time, so it is computed from the start of the node and its result is cut to the requested dates.
+    '''
+    def __init__(self, node:_Node, function) -> None:
+        super().__init__(node.start_date, node.end_date)
+        self.node = node
+        self.function = function
+
+    def evaluate(self, start_date:date, end_date:date)->tuple:
+        (values, _) = self.node.evaluate(self.start_date, end_date)
+        transformed = self.function(TimeSeries(values, self.start_date, end_date)).get_full_time_series()
+        return (transformed[(start_date - self.start_date).days:], True)
+
+
+class LazyRollingWindow:
+    '''
+    Rolling statistics of a lazy time series, returned by LazyTimeSeries.rolling. See TimeSeries.rolling.
+    '''
+    def __init__(self, node:_Node, window:int) -> None:
+        if window < 1: raise PMException("Incorrect rolling window {window}".format(window=window))
+        self._node = node
+        self.window = window
+
+    def sum(self):
+        return LazyTimeSeries(_Transform(self._node, lambda ts: ts.rolling(self.window).sum()))
+
+    def mean(self):
+        return LazyTimeSeries(_Transform(self._node, lambda ts: ts.rolling(self.window).mean()))
+
+    def std(self, ddof:int=1):
+        return LazyTimeSeries(_Transform(self._node, lambda ts: ts.rolling(self.window).std(ddof)))
+
+    def min(self):
+        return LazyTimeSeries(_Transform(self._node, lambda ts: ts.rolling(self.window).min()))
+
+    def max(self):
+        return LazyTimeSeries(_Transform(self._node, lambda ts: ts.rolling(self.window).max()))
+
+
+class LazyTimeSeries:
+    '''
+    Deferred computation on time series: cuts, element wise operations, rebasing, fx conversions and rolling statistics are recorded in a plan which is only evaluated
+    when the values are requested (get_full_time_series, get or to_timeseries).
+    The evaluation only reads the dates it needs: cuts are pushed down to the underlying time series, which are read through views,
+    and a chain of element wise operations writes all its results in a single array.
+    Operations between two time series are aligned on the dates both cover, as TimeSeries operators do.
+    '''
+    # Let numpy defer to the reflected operators, so ndarray + LazyTimeSeries returns a LazyTimeSeries
+    __array_ufunc__ = None
+
+    def __init__(self, ts) -> None:
+        '''
+        ts: the TimeSeries to compute on
+        '''
+        self._node:_Node = ts if isinstance(ts, _Node) else _Leaf(ts)
+        self.start_date = self._node.start_date
+        self.end_date = self._node.end_date
+
+    def cut2dates(self, start_date:date, end_date:date):
+        return LazyTimeSeries(_Cut(self._node, start_date, end_date))
+
+    def cutndays(self, start_date:date, days:int):
+        return LazyTimeSeries(_Cut(self._node, start_date, start_date + timedelta(days=days-1)))
+
+    def rebase(self, base_date:date=None, base_value:number=100):
+        return LazyTimeSeries(_Rebase(self._node, base_date if base_date != None else self.start_date, base_value))
+
+    def fx_convert(self, from_currency:str, to_currency:str, converter=fx_convert_range):
+        '''
+        Converts the values from from_currency to to_currency using the fx rates of their dates.
+        converter is the vectorized conversion function, pmdata.fx_convert_range by default.
+        '''
+        return LazyTimeSeries(_FXConversion(self._node, from_currency, to_currency, converter))
+
+    def rolling(self, window:int)->LazyRollingWindow:
+        return LazyRollingWindow(self._node, window)
+
+    def returns(self):
+        return LazyTimeSeries(_Transform(self._node, TimeSeries.returns))
+
+    def drawdown(self):
+        return LazyTimeSeries(_Transform(self._node, TimeSeries.drawdown))
+
+    def __operation(self, operator, other):
+        if isinstance(other, TimeSeries): other = _Leaf(other)
+        elif isinstance(other, LazyTimeSeries): other = other._node
+        return LazyTimeSeries(_Operation(operator, self._node, other))
+
+    def __add__(self, other):
+        return self.__operation(np.add, other)
+
+    def __sub__(self, other):
+        return self.__operation(np.subtract, other)
+
+    def __mul__(self, other):
+        return self.__operation(np.multiply, other)
+
+    def __truediv__(self, other):
+        return self.__operation(np.true_divide, other)
+
+    def __radd__(self, other):
+        return self.__operation(np.add, other)
+
+    def __rsub__(self, other):
+        return self.__operation(lambda a, b, **kwargs: np.subtract(b, a, **kwargs), other)
+
+    def __rmul__(self, other):
+        return self.__operation(np.multiply, other)
+
+    def __rtruediv__(self, other):
+        return self.__operation(lambda a, b, **kwargs: np.true_divide(b, a, **kwargs), other)
+
+    def __neg__(self):
+        return self.__operation(np.multiply, -1)
+
+    def get_full_time_series(self)->ndarray:
+        '''
+        Evaluates the plan over all its dates. The result is a view on the underlying time series if there is nothing to compute.
+        '''
+        return self._node.evaluate(self.start_date, self.end_date)[0]
+
+    def get(self, date:date)->number:
+        '''
+        Evaluates the plan for a single date
+        '''
+        if (date < self.start_date) or (date > self.end_date):
+            raise PMException("Cannot return time series element at {date}, the time series ranges from {first_date} to {last_date}".format(date=date.strftime(_DATEFORMAT),
+            first_date=self.start_date.strftime(_DATEFORMAT), last_date=self.end_date.strftime(_DATEFORMAT)))
+        return self._node.evaluate(date, date)[0][0]
+
+    def to_timeseries(self)->TimeSeries:
+        return TimeSeries(self.get_full_time_series(), self.start_date, self.end_date)
+
+
+class UnitTestLazyTimeSeries(unittest.TestCase):
+    def test_lazy(self):
+        ts1 = TimeSeries(np.array([1.0, 2, 4, 8, 16]), date(2022,1,1), date(2022,1,5))
+        ts2 = TimeSeries(np.array([10.0, 20, 30, 40]), date(2022,1,3), date(2022,1,6))
+        # Nothing to compute: the values are a view on the time series
+        cut = LazyTimeSeries(ts1).cut2dates(date(2022,1,2), date(2022,1,3))
+        self.assertTrue(np.shares_memory(cut.get_full_time_series(), ts1.get_full_time_series()))
+        self.assertTrue(np.array_equal(cut.get_full_time_series(), [2, 4]))
+        expression = (LazyTimeSeries(ts1) + ts2) * 2 - 1
+        self.assertEqual((expression.start_date, expression.end_date), (date(2022,1,3), date(2022,1,5)))
+        self.assertTrue(np.array_equal(expression.get_full_time_series(), [27, 55, 91]))
+        self.assertEqual(expression.get(date(2022,1,4)), 55)
+        self.assertEqual(expression.to_timeseries(), ((ts1 + ts2) * 2) - 1)
+        self.assertTrue(np.array_equal((1 / LazyTimeSeries(ts1).cutndays(date(2022,1,1), 2)).get_full_time_series(), [1, 0.5]))
+        self.assertTrue(np.array_equal((np.array([1, 1, 1, 1, 1]) - LazyTimeSeries(ts1)).get_full_time_series(), [0, -1, -3, -7, -15]))
+        # The operands are left untouched
+        self.assertTrue(np.array_equal(ts1.get_full_time_series(), [1, 2, 4, 8, 16]))
+        rebased = LazyTimeSeries(ts1).rebase(date(2022,1,2), 100).cut2dates(date(2022,1,4), date(2022,1,5))
+        self.assertTrue(np.array_equal(rebased.get_full_time_series(), [400, 800]))
+        self.assertTrue(np.array_equal(rebased.get_full_time_series(), ts1.rebase(date(2022,1,2), 100).get_range(date(2022,1,4), date(2022,1,5))))
+        converted = LazyTimeSeries(ts2).fx_convert("USD", "CHF", lambda values, from_currency, to_currency, start_date: values * 2).cut2dates(date(2022,1,5), date(2022,1,6))
+        self.assertTrue(np.array_equal(converted.get_full_time_series(), [60, 80]))
+        # Rolling statistics look back before the cut
+        rolling = LazyTimeSeries(ts1).rolling(2).sum().cut2dates(date(2022,1,2), date(2022,1,3))
+        self.assertTrue(np.array_equal(rolling.get_full_time_series(), [3, 6]))
+        self.assertEqual(rolling.get(date(2022,1,3)), 6)
+        np.testing.assert_array_equal((LazyTimeSeries(ts1) * 2).rolling(3).max().get_full_time_series(), (ts1 * 2).rolling(3).max().get_full_time_series())
+        self.assertTrue(np.array_equal(LazyTimeSeries(ts1).returns().cutndays(date(2022,1,4), 2).get_full_time_series(), [1, 1]))
+        for (f, args) in [(LazyTimeSeries(ts1).rolling, (0,)), (LazyTimeSeries(ts1).cut2dates, (date(2021,12,31), date(2022,1,2))), (LazyTimeSeries(ts1).rebase, (date(2022,1,6),)), (LazyTimeSeries(ts1).get, (date(2022,1,6),)), (LazyTimeSeries(ts1).__add__, (np.ones(3),))]:
+            try:
+                f(*args)
+                self.assertTrue(False)
+            except PMException:
+                self.assertTrue(True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
 import abc
+import bisect
 from datetime import date, datetime, timedelta
 from logging import DEBUG, INFO, Logger
+import tracemalloc
 import unittest
 from numpy import ndarray, number
 import numpy
@@ -10,8 +12,10 @@ from dateutils import strtodatetime, todatetime
 from exceptions import PMException
 from PositionIdentifier import Currency, PositionIdentifier, CASH, EQUITY, Ticker, check_currency
 from Positions import Positions
+from Holdings import Holdings
 from TimeSeries import TimeSeries
-from pmdata import fx_convert
+from analytics import chain_returns
+from pmdata import fx_convert, fx_convert_range
 from pmdata import get_timeseries, get_ticker, get_fx_timeseries
 from config import init_logging
 from copy import deepcopy
@@ -32,16 +36,15 @@ class Portfolio:
     A portfolio is:
     . A collection of instruments
     . Quantities of these instruments
+    The transactions are recorded for each transaction date in self.positions, and the quantities held over time in self.holdings.
     '''
     def __init__(self, name:str="DEFAULT", origin_date:datetime=DEFAULT_ORIGIN) -> None:
         self.positions={}
-        self.positions[origin_date]= {"positions":Positions(), "transactions":[]}
+        self.positions[origin_date]= {"transactions":[]}
+        self.holdings = Holdings()
+        self.holdings.update(origin_date, Positions())
         self.name = name
         self.origin = origin_date
-        idx=pd.date_range(origin_date, date.today(), freq='D')
-        self.constituents_eval_dates = pd.Series(data=numpy.zeros(idx.shape, dtype=bool), index=idx)
-        # The origin is always evaluated
-        self.constituents_eval_dates[self.origin] = True
 
     def copy(self):
         return deepcopy(self)
@@ -51,8 +54,6 @@ class Portfolio:
         Returns a serializable state (a dictionary) containing the portfolio state
         '''
         toreturn:dict={}
-        # Evaluate the portfolio constituents before serialization
-        self._evaluate_constituents()
         toreturn['name']=self.name
         toreturn['positions'] = self._serialize_positions()
         toreturn['origin'] = self.origin
@@ -62,7 +63,7 @@ class Portfolio:
         to_return = []
         dates = sorted(self.positions.keys())
         for date in dates:
-            state={'positions':self._serialize_constituents(self.positions[date]['positions']), 'transactions':self._serialize_transactions(self.positions[date]['transactions']), 'date':date}
+            state={'positions':self._serialize_constituents(self.holdings.get_positions(date)), 'transactions':self._serialize_transactions(self.positions[date]['transactions']), 'date':date}
             to_return.append(state)
         return to_return
 
@@ -87,47 +88,9 @@ class Portfolio:
         '''
         return self.origin
 
-    def _invalidate_constituents_evaluation(self, date:datetime):
-        self.constituents_eval_dates.iloc[(date-self.origin).days:]=False
-
-    def _evaluate_constituents(self):
-        #Find the most recent evaluated date
-        fromdate = self.constituents_eval_dates[self.constituents_eval_dates==True].last_valid_index()
-        if(fromdate != None):
-            self._evaluate_constituents_from(fromdate+timedelta(days=1), self.get_positions(fromdate))
-            self.constituents_eval_dates[fromdate:]=True
-    
-    def _evaluate_constituents_from(self,fromdate:datetime, initial_positions):
-        logger.debug(f"Evaluating constituents from {fromdate}")
-        eval_dates = sorted(self.positions.keys())
-        previous_positions = initial_positions   
-        for eval_date in eval_dates:
-            if(eval_date >= fromdate):
-                logger.debug(f"Evaluating portfolio constituents for {eval_date}")
-                portfolio_positions = self._evaluate_constituents_for(previous_positions, self.positions[eval_date]["transactions"], eval_date)
-                self.positions[eval_date]["positions"]=portfolio_positions
-                previous_positions = portfolio_positions
-
-
-    def _find_latest_evaluation(self, date):
-        eval_dates = sorted(self.positions.keys())
-        toreturn=self.get_start_date()
-
-        for eval_date in eval_dates:
-            if(eval_date > date): return toreturn
-            toreturn = eval_date
-        return toreturn
-
-    def _evaluate_constituents_for(self,previous_positions:Positions, transactions:list, date:datetime):
-        # Compute the new portfolio constituents from the list of transactions
-        # Create a set of positions from the current set
-        # Apply the transactions
-        # Get and return the resulting positions
-        logger.debug(f"Applying {len(transactions)} transactions to portfolio on {date}")
-        p:Positions = previous_positions.copy()
-        for transaction in transactions:
-            p.apply_transaction(transaction)
-        return p
+    def _check_date(self, posdate:datetime):
+        if(self.origin > posdate):
+            raise PMException(f"Cannot return the positions of portfolio {self.get_name()} at {posdate} because this portfolio start date is {self.get_start_date()}.")
 
     def get_positions(self, posdate:datetime=None) -> Positions:
         '''
@@ -135,17 +98,27 @@ class Portfolio:
         If the date is not given, will return the portfolio positions at inception date (origin)
         '''
         if(posdate == None):
-            return self.positions[self.origin]['positions']
+            return self.holdings.get_positions(self.origin)
         else: posdate = todatetime(posdate)
-        # Check if the positions have to be evaluated
-        if(self.constituents_eval_dates.index[0] > posdate):
-            raise PMException(f"Cannot return the positions of portfolio {self.get_name()} at {posdate} because this portfolio start date is {self.get_start_date()}.")
-        if(self.constituents_eval_dates.at[posdate] == False):
-            #Evaluate constituents
-            self._evaluate_constituents()
-        #Find the latest evaluation date
-        eval_date=self._find_latest_evaluation(posdate)
-        return self.positions[eval_date]['positions']
+        self._check_date(posdate)
+        #Find the positions in effect at posdate
+        return self.holdings.get_positions(posdate)
+
+    def _get_holdings(self, start_date:datetime)->Holdings:
+        '''
+        Returns the holdings of the portfolio, checking they can be queried from start_date.
+        '''
+        self._check_date(todatetime(start_date))
+        return self.holdings
+
+    def get_quantities(self, start_date:datetime, end_date:datetime)->tuple:
+        '''
+        Returns the quantities held every day from start_date to end_date (both inclusive) as a tuple of:
+        . a numpy matrix with one row per day and one column per position identifier
+        . the list of position identifiers corresponding to the columns of the matrix
+        '''
+        holdings = self._get_holdings(start_date)
+        return (holdings.get_quantities(start_date, end_date), holdings.get_identifiers())
 
 
     def add(self, currency:str, quantity:number, date:datetime = None, tags:set=None, eval:bool=False):
@@ -212,23 +185,55 @@ class Portfolio:
         '''
         Process a transaction (recomputes the composition of the portfolio) and if eval is true evaluate the value of the transaction
         Returns 0 if eval is false
+        The quantity change of the transaction is added to the holdings from the transaction date on, which therefore
+        never need to be re-evaluated.
         '''
         to_return =0
-        # get the portfolio positions for the given date
         date:datetime = transaction.get_date()
-        positions = self.get_positions(date)
-        # Copy the positions and save the new portfolio at date
-        new_positions = positions.copy()
-        new_positions.apply_transaction(transaction)
+        self._check_date(date)
+        self._check_transaction(self.holdings, transaction)
         if eval : to_return = self._value_position(transaction.get_position_identifier(), transaction.get_quantity(), date)
         # Record the transaction
-        txs:list = self._get_transactions(date)
-        txs.append(transaction)
-        self.positions[date]= {"positions":new_positions, "transactions":txs}
-        # Invalidate the portfolio constituents from date
-        self._invalidate_constituents_evaluation(date+timedelta(days=1))
+        self._record_transaction(self.holdings, transaction)
+        self._get_transactions(date).append(transaction)
         return to_return
 
+    def _check_transaction(self, holdings:Holdings, transaction:Transaction):
+        '''
+        Raises an exception if the transaction cannot be applied to the holdings.
+        Positions are never removed, so a sell needs enough quantity at the transaction date and at every later change date.
+        '''
+        if transaction.get_transaction_type() != SELL: return
+        date:datetime = transaction.get_date()
+        pi = transaction.get_position_identifier()
+        holdings.get_positions(date).check_transaction(transaction)
+        later_min = holdings.min_quantity(date, pi)
+        if (later_min is not None) and (later_min < transaction.get_quantity()):
+            raise PMException(f"Cannot sell {transaction.get_quantity()} {pi.pretty_print()} at {date}. The portfolio would not have enough quantity of this instrument at a later date.")
+
+    def _record_transaction(self, holdings:Holdings, transaction:Transaction):
+        quantity = transaction.get_quantity() if transaction.get_transaction_type() == BUY else -transaction.get_quantity()
+        holdings.add(transaction.get_date(), transaction.get_position_identifier(), quantity)
+
+    def apply_transactions(self, transactions:list):
+        '''
+        Process a batch of transactions at once.
+        The transactions are sorted by date and applied to a copy of the holdings, which replaces the holdings once they are all applied:
+        either all transactions are applied or, if one of them cannot be applied, none of them.
+        '''
+        if len(transactions) == 0: return
+        transactions = sorted(transactions, key=lambda t: t.get_date())
+        self._check_date(transactions[0].get_date())
+        holdings = self.holdings.copy()
+        for transaction in transactions:
+            self._check_transaction(holdings, transaction)
+            self._record_transaction(holdings, transaction)
+        logger.debug(f"Applied {len(transactions)} transactions to portfolio {self.get_name()} from {transactions[0].get_date()}")
+        # Commit
+        self.holdings = holdings
+        for transaction in transactions:
+            self._get_transactions(transaction.get_date()).append(transaction)
+
     def _value_position(self, pi:PositionIdentifier, quantity:number, date:datetime)->number:
         '''
         Value the position
@@ -247,10 +252,11 @@ class Portfolio:
         transaction = Transaction(BUY, ticker, quantity, date)
         return self._process_transaction(transaction, eval)
 
-    def _get_transactions(self, date:datetime):
-        if date in self.positions:
-            return self.positions[date]['transactions']
-        return []
+    def _get_transactions(self, date:datetime)->list:
+        '''
+        Returns the list of the transactions recorded at date, which are appended to it
+        '''
+        return self.positions.setdefault(date, {"transactions":[]})['transactions']
 
     def sell(self, ticker_code:str, quantity:number, date:datetime=None, eval:bool=False):
         '''
@@ -401,10 +407,18 @@ class InstrumentValuator:
     def get_valuation(self, valdate:datetime, target_currency:Currency)->number:
         raise NotImplementedError("get_valuation should have an implementation in derived classes")
 
+    @abc.abstractmethod
+    def get_valuations(self, start_date:datetime, end_date:datetime, position_amount:number, target_currency:Currency)->ndarray:
+        raise NotImplementedError("get_valuations should have an implementation in derived classes")
+
     @staticmethod
     def convert_to_target_currency(value:number, valdate:date, source_currency:str=DEFAULT_CURRENCY, target_currency:str=DEFAULT_CURRENCY)->number:
         return fx_convert(value, source_currency, target_currency, valdate)
 
+    @staticmethod
+    def convert_range_to_target_currency(values:ndarray, start_date:date, source_currency:str=DEFAULT_CURRENCY, target_currency:str=DEFAULT_CURRENCY)->ndarray:
+        return fx_convert_range(values, source_currency, target_currency, start_date)
+
     @staticmethod
     def valuator(portfolio:Portfolio, pi:PositionIdentifier, **valuator_args):
         '''
@@ -435,6 +449,23 @@ class EquityValuator(InstrumentValuator):
         except PMException as e:
             raise PMException(f"Cannot get the valuation of {pi.id.get_full_ticker()} at date {valdate} for data point {valuation_data_point} in currency {target_currency.get_identifier()} due to the underlying error: {str(e)}")
 
+    def get_valuations(self, start_date:datetime, end_date:datetime, position_amount:number, target_currency:Currency)->ndarray:
+        return self.value_positions(self.pi, position_amount, start_date, end_date, self.valuation_data_point, target_currency)
+
+    @staticmethod
+    def value_positions(pi:PositionIdentifier, position_amount:number, start_date:datetime, end_date:datetime, valuation_data_point:str, target_currency:Currency)->ndarray:
+        '''
+        Values a constant position amount for every day from start_date to end_date (both inclusive).
+        Prices are promoted to float64 before being multiplied so that each element is identical to what value_position returns for that day.
+        '''
+        try:
+            start_date = todatetime(start_date)
+            end_date = todatetime(end_date)
+            closing_prices = get_timeseries(full_ticker=pi.id.get_full_ticker(), datapoint_name=valuation_data_point).get_range(start_date.date(), end_date.date())
+            return InstrumentValuator.convert_range_to_target_currency(closing_prices.astype(numpy.float64)*position_amount, start_date.date(), pi.id.currency.get_identifier(), target_currency.get_identifier())
+        except PMException as e:
+            raise PMException(f"Cannot get the valuation of {pi.id.get_full_ticker()} from {start_date} to {end_date} for data point {valuation_data_point} in currency {target_currency.get_identifier()} due to the underlying error: {str(e)}")
+
 class CashValuator(InstrumentValuator):
     def __init__(self, portfolio:Portfolio, pi:PositionIdentifier) -> None:
         InstrumentValuator.__init__(self, portfolio,pi)
@@ -447,6 +478,16 @@ class CashValuator(InstrumentValuator):
         valdate = todatetime(valdate)
         return InstrumentValuator.convert_to_target_currency(position_amount, valdate.date(), pi.id.get_identifier(), target_currency.get_identifier())
 
+    def get_valuations(self, start_date:datetime, end_date:datetime, position_amount:number, target_currency:Currency)->ndarray:
+        return self.value_positions(self.pi, position_amount, start_date, end_date, target_currency)
+
+    @staticmethod
+    def value_positions(pi:PositionIdentifier, position_amount:number, start_date:datetime, end_date:datetime, target_currency:Currency)->ndarray:
+        start_date = todatetime(start_date)
+        end_date = todatetime(end_date)
+        amounts = numpy.full((end_date - start_date).days+1, position_amount, dtype=numpy.float64)
+        return InstrumentValuator.convert_range_to_target_currency(amounts, start_date.date(), pi.id.get_identifier(), target_currency.get_identifier())
+
 class IPorfolioValuator:
   
     @abc.abstractmethod
@@ -465,13 +506,14 @@ class PortfolioGroupValuator(IPorfolioValuator):
         start_date=todatetime(start_date)
         end_date=todatetime(end_date)
         #For each portfolio in the group, value it
+        #Portfolios may be valued on different dates, a portfolio is worth 0 on the dates it is not valued
         ts:TimeSeries|None = None
         for (i,portfolio) in enumerate(self.portfolio_group):
             pv = PortfolioValuator(portfolio)
             if(i==0):
                 ts = pv.get_valuations(start_date, end_date, dp_name,ccy)
             else:
-                ts += pv.get_valuations(start_date, end_date, dp_name,ccy)
+                ts = ts.combine(pv.get_valuations(start_date, end_date, dp_name,ccy), numpy.add, how='outer', fill_value=0)
         return ts
 
     def get_valuation(self, valdate:datetime=None, dpname:str = DEFAULT_VALUATION_DATAPOINT, ccy:str=DEFAULT_CURRENCY)->number:
@@ -488,7 +530,8 @@ class PortfolioValuator(IPorfolioValuator):
     '''
     PortfolioValuator is a key class in the pricing infrastructure. It is used to value a portfolio for any point in time.
     It supports multiple instrument types. Each instrument time is valuated using the InstrumentValuator subclass corresponding to the instrument.
-    get_valuations iterate over a range of dates
+    get_valuations values the portfolio over a range of dates. Positions being constant between two transaction dates, each position is valued
+    for a whole period at once using numpy arrays, rather than day by day.
     get_valuation values the portfolio for a single date
     '''
     def __init__(self, portfolio:Portfolio) -> None:
@@ -509,10 +552,18 @@ class PortfolioValuator(IPorfolioValuator):
             end_date = self.get_end_date(dp_name=dp_name)
         start_date=todatetime(start_date)
         end_date = todatetime(end_date)
-        period:pd.DatetimeIndex = pd.date_range(start_date, end_date, freq='D')
         toreturn:ndarray = numpy.zeros((end_date - start_date).days+1)
-        for i, d in enumerate(period):
-            toreturn[i]=self.get_valuation(start_date+timedelta(days=i), dpname=dp_name, ccy=ccy)
+        target_currency = Currency(ccy)
+        holdings:Holdings = self.portfolio._get_holdings(start_date)
+        for (period_start, period_end, row) in holdings.get_periods(start_date, end_date):
+            first = (period_start - start_date).days
+            last = (period_end - start_date).days
+            if(logger.isEnabledFor(DEBUG)): logger.debug(f"Valuing portfolio {self.portfolio.get_name()} from {period_start} to {period_end}")
+            for (position_identifier, quantity) in holdings.get_holdings(row):
+                try:
+                    toreturn[first:last+1] += InstrumentValuator.valuator(self.portfolio, position_identifier, dpname=dp_name).get_valuations(period_start, period_end, quantity, target_currency)
+                except Exception as e:
+                    raise PMException(f"Could not value position {position_identifier.pretty_print()} in portfolio {self.portfolio.get_name()} from {period_start} to {period_end} in {ccy} due to the underlying error: {str(e)}")
         return TimeSeries(toreturn, start_date=start_date.date(), end_date=end_date.date())
 
     def get_valuation(self, valdate:datetime=None, dpname:str = DEFAULT_VALUATION_DATAPOINT, ccy:str=DEFAULT_CURRENCY)->number:
@@ -585,12 +636,9 @@ class IndexValuator(PortfolioValuator):
         if(end_date == None):
             end_date = self.get_end_date(dp_name=dp_name)
         
-        period:pd.DatetimeIndex = pd.date_range(self.base_date, end_date, freq='D')
-        toreturn:ndarray = numpy.zeros((end_date - self.base_date).days+1)
-        toreturn[0]=self.base_value
-        for i, d in enumerate(period):
-            if(i==0): continue #Skip the first date since it is valued as base_value
-            toreturn[i]=toreturn[i-1] * self.get_valuation(todatetime(self.base_date+timedelta(days=i)), dpname=dp_name, ccy=ccy) / self.get_valuation(todatetime(self.base_date+timedelta(days=i-1)), dpname=dp_name, ccy=ccy)
+        # The portfolio is valued once over the whole period, the index chaining its daily returns
+        valuations:TimeSeries = self.get_valuations(start_date=self.base_date, end_date=end_date, dp_name=dp_name, ccy=ccy)
+        toreturn:ndarray = chain_returns(valuations.get_full_time_series(), self.base_value)
         return TimeSeries(toreturn, start_date=self.base_date, end_date=end_date)
 
 class UnitTestPortfolio(unittest.TestCase):
@@ -723,6 +771,118 @@ class UnitTestPortfolio(unittest.TestCase):
         self.assertEqual(p.get_cash('USD', tags={'BONUS', "YEAR2"}), 74000)
         #Check selling/withdrawing
 
+    def test_quantities(self):
+        p:Portfolio = Portfolio("test", datetime(2022,9,1))
+        p.add("USD", 200, datetime(2022,9,5))
+        p.add("CHF", 150, datetime(2022,9,2))
+        p.withdraw("USD", 50, datetime(2022,9,10))
+        (quantities, identifiers) = p.get_quantities(datetime(2022,9,1), datetime(2022,9,11))
+        self.assertEqual(quantities.shape, (11, 2))
+        usd = identifiers.index(PositionIdentifier(CASH, Currency("USD")))
+        chf = identifiers.index(PositionIdentifier(CASH, Currency("CHF")))
+        self.assertEqual(list(quantities[:,usd]), [0]*4 + [200]*5 + [150]*2)
+        self.assertEqual(list(quantities[:,chf]), [0] + [150]*10)
+
+    def test_apply_transactions(self):
+        p:Portfolio = Portfolio("test", datetime(2022,9,1))
+        p.add("USD", 200, datetime(2022,9,5))
+        p.add("USD", 150, datetime(2022,9,2))
+        p.add("CHF", 150, datetime(2022,9,3))
+        p.withdraw("USD", 250, datetime(2022,9,10))
+        p.add("USD", 100, datetime(2022,9,1))
+        p2:Portfolio = Portfolio("test", datetime(2022,9,1))
+        p2.apply_transactions([Transaction(BUY, PositionIdentifier(CASH, Currency("USD")), 200, datetime(2022,9,5)),
+            Transaction(BUY, PositionIdentifier(CASH, Currency("USD")), 150, datetime(2022,9,2)),
+            Transaction(BUY, PositionIdentifier(CASH, Currency("CHF")), 150, datetime(2022,9,3)),
+            Transaction(SELL, PositionIdentifier(CASH, Currency("USD")), 250, datetime(2022,9,10)),
+            Transaction(BUY, PositionIdentifier(CASH, Currency("USD")), 100, datetime(2022,9,1))])
+        for day in range(1, 15):
+            self.assertEqual(p.get_positions(datetime(2022,9,day)).state(), p2.get_positions(datetime(2022,9,day)).state())
+        self.assertEqual(p2.get_cash("USD", datetime(2022,9,12)), 200)
+
+    def test_backdated_sell(self):
+        p:Portfolio = Portfolio("test", datetime(2022,9,1))
+        p.add("USD", 100, datetime(2022,9,1))
+        p.withdraw("USD", 100, datetime(2022,9,10))
+        try:
+            p.withdraw("USD", 50, datetime(2022,9,5))
+            self.assertTrue(False) # Selling on 5/9 would leave a negative amount on 10/9
+        except PMException:
+            self.assertEqual(p.get_cash("USD", datetime(2022,9,5)), 100)
+            self.assertEqual(p.get_cash("USD", datetime(2022,9,10)), 0)
+
+    def test_backdated_load(self):
+        # Transactions loaded in reverse date order: each one is added to the holdings with one slice update, the later dates are not replayed
+        currencies = ["USD", "EUR", "CHF"]
+        start = datetime(2008,1,1)
+        p:Portfolio = Portfolio("backdated", start)
+        updates = []
+        add = p.holdings.add
+        def counting_add(posdate, pi, quantity):
+            updates.append(posdate)
+            add(posdate, pi, quantity)
+        p.holdings.add = counting_add
+        p.holdings.update = lambda posdate, positions: self.fail("The positions at {posdate} are re-evaluated".format(posdate=posdate))
+        days = range(2999, -1, -1)
+        for day in days:
+            p.add(currencies[day % len(currencies)], 10, start + timedelta(days=day))
+        self.assertEqual(updates, [start + timedelta(days=day) for day in days])
+        # The positions are the ones of a full re-evaluation of the transactions in date order
+        positions = Positions()
+        for day in range(3000):
+            positions.apply_transaction(Transaction(BUY, PositionIdentifier(CASH, Currency(currencies[day % len(currencies)])), 10, start + timedelta(days=day)))
+            self.assertEqual(p.get_positions(start + timedelta(days=day)).state(), positions.state())
+        self.assertEqual(p.get_cash("USD", start + timedelta(days=2999)), 10000)
+
+    def deepcopy_snapshots(self, transactions:list)->dict:
+        # How positions snapshots were built before the holdings matrix: a deep copy of the previous snapshot per transaction date,
+        # and a replay of every later date for a backdated transaction
+        snapshots = {}
+        dates = []
+        for transaction in transactions:
+            date = transaction.get_date()
+            index = bisect.bisect_left(dates, date)
+            positions = deepcopy(snapshots[dates[index-1]]) if index > 0 else Positions._create_from({})
+            positions.apply_transaction(transaction)
+            snapshots[date] = positions
+            for later_date in dates[index:]:
+                positions = deepcopy(snapshots[later_date])
+                positions.apply_transaction(transaction)
+                snapshots[later_date] = positions
+            dates.insert(index, date)
+        return snapshots
+
+    def portfolio_snapshots(self, transactions:list)->Portfolio:
+        p:Portfolio = Portfolio("benchmark", min(transaction.get_date() for transaction in transactions))
+        for transaction in transactions:
+            p._process_transaction(transaction)
+        return p
+
+    def test_snapshots_benchmark(self):
+        # Memory of the holdings of dated transactions on 5 currencies (one change date per day), against deep copied positions snapshots
+        currencies = ["USD", "EUR", "CHF", "GBP", "BTC"]
+        start = datetime(2008,1,1)
+        def transactions(days):
+            return [Transaction(BUY, PositionIdentifier(CASH, Currency(currencies[day % len(currencies)])), 10, start + timedelta(days=day)) for day in days]
+        # Transactions in date order and in reverse date order (backdated), fewer than the 5000 below as tracing is slow
+        for days in [range(1000), range(39, -1, -1)]:
+            memory = {}
+            for build in [self.portfolio_snapshots, self.deepcopy_snapshots]:
+                tracemalloc.start()
+                snapshots = build(transactions(days))
+                memory[build.__name__] = tracemalloc.get_traced_memory()[0]
+                tracemalloc.stop()
+                del snapshots
+            self.assertLess(memory['portfolio_snapshots'], memory['deepcopy_snapshots'])
+        p = self.portfolio_snapshots(transactions(range(5000)))
+        self.assertEqual(len(p.holdings), 5000)
+        self.assertEqual(p.get_cash("USD", start + timedelta(days=4999)), 10000)
+        # Positions share the position identifiers
+        first = list(p.get_positions(start + timedelta(days=10)))
+        last = list(p.get_positions(start + timedelta(days=4999)))
+        for i in range(len(currencies)):
+            self.assertIs(first[i], last[i])
+
 class UnitTestValuations(unittest.TestCase):
 
     def create_sample_portfolio(self, name:str, portfolio_start_date:datetime = None, transaction_date:datetime= None):
@@ -1060,6 +1220,16 @@ class UnitTestValuations(unittest.TestCase):
         index_valuations2 = adjclose_ts.rebase()
         self.assertEqual(index_valuations2, index_valuations)
 
+    def test_get_valuations_consistency(self):
+        p:Portfolio = self.create_sample_portfolio("Consistency", datetime(2021,1,18))
+        p.withdraw('CHF', 1000, datetime(2021,6,1))
+        p.add('EUR', 1000, datetime(2021,9,15))
+        v:PortfolioValuator = PortfolioValuator(p)
+        ts:TimeSeries = v.get_valuations(datetime(2021,4,8), datetime(2021,12,31), ccy="CHF")
+        for i in range(ts.size()):
+            valdate = datetime(2021,4,8)+timedelta(days=i)
+            self.assertEqual(ts.get(valdate.date()), v.get_valuation(valdate, ccy="CHF"))
+
     def test_historical_portfolio_valuation(self):
          PortfolioValuator(portfolio=self.create_sample_portfolio("MyPortfolio", datetime(2021,1,18))).get_valuations(datetime(2021,1,18), ccy="CHF")
 
@@ -1,3 +1,4 @@
+import tracemalloc
 import unittest
 from numpy import number
 from PositionIdentifier import PositionIdentifier
@@ -29,6 +30,7 @@ class Positions:
         Recomputes the composition of the portfolio and if eval is true evaluate the value of the transaction
         Returns 0 if eval is false or the value of the transaction if eval is true
         '''
+        self.check_transaction(transaction)
         quantity = transaction.get_quantity()
         pi = transaction.get_position_identifier()
         if(transaction.get_transaction_type() == BUY):
@@ -38,9 +40,16 @@ class Positions:
                 self[pi] = quantity
             
         if(transaction.get_transaction_type() == SELL):
-            if((pi in self) and (self[pi] >= quantity)):
-                self[pi] = self[pi] - quantity
-            else:
+            self[pi] = self[pi] - quantity
+
+    def check_transaction(self, transaction: Transaction):
+        '''
+        Raises an exception if the transaction cannot be applied to the positions
+        '''
+        quantity = transaction.get_quantity()
+        pi = transaction.get_position_identifier()
+        if(transaction.get_transaction_type() == SELL):
+            if(not ((pi in self) and (self[pi] >= quantity))):
                 raise PMException(f"Cannot sell {quantity} {pi.pretty_print()}. Either the portfolio does not own the instrument or it does not have enough quantity of this instrument.")
 
 
@@ -59,6 +68,9 @@ class Positions:
     def __getitem__(self, pi:PositionIdentifier)->number:
         return self.__positions[pi]
 
+    def __contains__(self, pi:PositionIdentifier)->bool:
+        return pi in self.__positions
+
     def __iter__(self):
         return self.__positions.__iter__()
 
@@ -79,9 +91,9 @@ class Positions:
 
     def copy(self):
         '''
-        Performs a deep copy of the positions
+        Returns a copy of the positions sharing the (immutable) position identifiers: only the quantities are copied
         '''
-        return Positions._create_from(deepcopy(self.__positions))
+        return Positions._create_from(dict(self.__positions))
 
     def get_tagged_positions(self,tags:set):
         toreturn:Positions = Positions()
@@ -108,7 +120,65 @@ class UnitTestPositions(unittest.TestCase):
         pi4:PositionIdentifier = PositionIdentifier(CASH, c1, tags={'MY CASH'})
         p[pi4] = 2500
         self.assertEqual(p[pi4], 2500)
-    
+
+    def test_copy(self):
+        pi1 = PositionIdentifier(EQUITY, Ticker('MSFT'))
+        pi2 = PositionIdentifier(CASH, Currency('USD'))
+        p = Positions()
+        p[pi1] = 10
+        c = p.copy()
+        self.assertEqual(c[pi1], 10)
+        c[pi1] = 20
+        c[pi2] = 100
+        self.assertEqual(p[pi1], 10)
+        self.assertFalse(pi2 in p)
+        p[pi1] = 30
+        self.assertEqual(c[pi1], 20)
+        self.assertIs(list(c)[0], list(p)[0])
+        self.assertEqual(list(c), [pi1, pi2])
+        self.assertEqual(p.state(), [{'identifier':pi1.state(), 'amount':30}])
+
+    def snapshot_chain(self, identifiers:list, snapshots:int)->list:
+        p = Positions()
+        for pi in identifiers:
+            p[pi] = 0
+        toreturn = []
+        for i in range(snapshots):
+            p = p.copy()
+            p[identifiers[i % len(identifiers)]] = i
+            toreturn.append(p)
+        return toreturn
+
+    def deepcopy_chain(self, identifiers:list, snapshots:int)->list:
+        # How snapshots were taken before copies shared the identifiers
+        p = Positions()
+        for pi in identifiers:
+            p[pi] = 0
+        toreturn = []
+        for i in range(snapshots):
+            p = deepcopy(p)
+            p[list(p)[i % len(identifiers)]] = i
+            toreturn.append(p)
+        return toreturn
+
+    def test_snapshots(self):
+        # A chain of snapshots, each changing one position, against deep copies of the positions
+        identifiers = [PositionIdentifier(EQUITY, Ticker('T{i}'.format(i=i)), tags={'TAG'}) for i in range(20)]
+        memory = {}
+        for chain in [self.snapshot_chain, self.deepcopy_chain]:
+            tracemalloc.start()
+            snapshots = chain(identifiers, 200)
+            memory[chain.__name__] = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del snapshots
+        snapshots = self.snapshot_chain(identifiers, 1000)
+        self.assertEqual(snapshots[-1][identifiers[999 % len(identifiers)]], 999)
+        self.assertEqual(snapshots[0][identifiers[0]], 0)
+        # Every snapshot holds the same identifier objects
+        for p in [snapshots[0], snapshots[-1]]:
+            for (pi, identifier) in zip(p, identifiers):
+                self.assertIs(pi, identifier)
+        self.assertLess(memory['snapshot_chain'], memory['deepcopy_chain'] / 5)
 
 
 if __name__ == '__main__':
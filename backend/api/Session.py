@@ -7,12 +7,13 @@ from shutil import rmtree
 from typing import TypedDict
 import unittest
  
-from Portfolios import Portfolio, PortfolioGroup
+from Portfolios import DEFAULT_VALUATION_DATAPOINT, Portfolio, PortfolioGroup
 from PositionIdentifier import CASH, EQUITY
 from Transaction import Transaction
 from dateutils import strtodatetime
 from exceptions import PMException
 from config import get_config, init_logging
+from pmdata import get_cache_stats, pin, unpin
 from os.path import exists
 
 class User(TypedDict):
@@ -27,6 +28,7 @@ class Session:
         self.login_time = login_time
         self.activity:list=[]
         self.user = user
+        self.pinned:dict={} # portfolio name, full tickers whose prices are pinned in the cache for the portfolio
 
     def get_login_time(self):
         return self.login_time
@@ -87,14 +89,36 @@ class Session:
         # Replay all historical transactions on the portfolio to recreate its state
         # This is needed to keep the historical portfolio consituents and avoid altering the portfolio historically
         history = state['positions']
+        transactions = []
         for date in history:
              #Get the transactions
-            transactions = date['transactions']
-            for transaction in transactions:
-                t:Transaction = Transaction.create_from_state(transaction)
-                toreturn._process_transaction(t)
+            for transaction in date['transactions']:
+                transactions.append(Transaction.create_from_state(transaction))
+        toreturn.apply_transactions(transactions)
+        self._pin_portfolio(toreturn)
         return toreturn
 
+    def _pin_portfolio(self, portfolio:Portfolio):
+        '''
+        Keeps the prices of the instruments held by the portfolio in the cache until it is closed or loaded again
+        '''
+        self.close_portfolio(portfolio.get_name())
+        full_tickers = [pi.id.get_full_ticker() for pi in portfolio.holdings.get_identifiers() if pi.type == EQUITY]
+        for full_ticker in full_tickers: pin(full_ticker, DEFAULT_VALUATION_DATAPOINT)
+        self.pinned[portfolio.get_name()] = full_tickers
+
+    def close_portfolio(self, name:str):
+        '''
+        Releases the prices kept in the cache for the portfolio loaded with this name
+        '''
+        for full_ticker in self.pinned.pop(name, []): unpin(full_ticker, DEFAULT_VALUATION_DATAPOINT)
+
+    def close(self):
+        '''
+        Releases the prices kept in the cache for all the portfolios loaded in the session
+        '''
+        for name in list(self.pinned.keys()): self.close_portfolio(name)
+
 
 
 class SessionEncoder(json.JSONEncoder):
@@ -315,6 +339,24 @@ class UnitTestSession(unittest.TestCase):
         p.add("CHF", 500, datetime(2022,10,2), tags={'Swiss franc'})
         session.save_portfolio(p)
 
+    def test_h_pinned_portfolio(self):
+        user = get_user(email="sebTest@yahoo.com")
+        session:Session =  create_session(user)
+        # The sessions of the previous tests keep their pins
+        pinned = get_cache_stats()["timeseries"]["pinned"]
+        session.load_portfolio("DEFAULT")
+        full_tickers = session.pinned["DEFAULT"]
+        self.assertTrue("STLA.PA" in full_tickers)
+        # Loading the portfolio again replaces its pins
+        session.load_portfolio("DEFAULT")
+        self.assertEqual(session.pinned["DEFAULT"], full_tickers)
+        session.close_portfolio("DEFAULT")
+        self.assertEqual(session.pinned, {})
+        self.assertEqual(get_cache_stats()["timeseries"]["pinned"], pinned)
+        session.load_portfolio("DEFAULT")
+        session.close()
+        self.assertEqual(get_cache_stats()["timeseries"]["pinned"], pinned)
+
 if __name__ == '__main__':
     init_logging()
     unittest.main()
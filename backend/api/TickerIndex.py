@@ -0,0 +1,368 @@
+import heapq
+from itertools import islice
+import time
+import unittest
+import numpy as np
+from numpy import ndarray
+from PositionIdentifier import Ticker
+
+_EMPTY = np.zeros(0, dtype=np.int32)
+_ISIN_LENGTH = 12
+_CHUNK = 1024 # Ids checked at once when a search can stop early
+SHORT_QUERY_LENGTH = 3
+SHORT_QUERY_LIMIT = 50
+
+class _GramIndex:
+    '''
+    Inverted index of the bigrams and trigrams of a list of strings.
+    Characters are first numbered in a dense alphabet of size K, a gram code being then a number in base K+1, K standing for the padding of bigrams.
+    The postings of all the grams are stored in a single array of string ids sorted by gram code and then by id.
+    '''
+    def __init__(self, values:list) -> None:
+        chars = np.frombuffer(('\x00'.join(values)+'\x00').encode('utf-32-le'), dtype=np.uint32)
+        # The separator is the smallest code point so it is numbered 0 in the alphabet
+        self._alphabet, letters = np.unique(np.append(chars, 0), return_inverse=True)
+        letters = letters[:-1].astype(np.int64)
+        owners = np.repeat(np.arange(len(values), dtype=np.int64), [len(value)+1 for value in values])
+        (bigrams, valid_bigrams, trigrams, valid_trigrams) = self._codes(letters)
+        codes = np.concatenate((bigrams[valid_bigrams], trigrams[valid_trigrams]))
+        ids = np.concatenate((owners[:-1][valid_bigrams], owners[:-2][valid_trigrams]))
+        # Sort and deduplicate the (code, id) pairs at once
+        n = max(len(values), 1)
+        pairs = np.unique(codes * n + ids)
+        codes = pairs // n
+        self._ids:ndarray = (pairs % n).astype(np.int32)
+        self._starts:ndarray = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1])))
+        self._grams:ndarray = codes[self._starts]
+        self._starts = np.append(self._starts, codes.size)
+
+    def _codes(self, letters:ndarray)->tuple:
+        '''
+        Returns the codes of the bigrams and of the trigrams of an array of letters (0 being a separator), with the masks of the grams not crossing a separator.
+        '''
+        base = self._alphabet.size + 1
+        pad = self._alphabet.size
+        c0, c1, c2 = letters[:-2], letters[1:-1], letters[2:]
+        bigrams = (letters[:-1] * base + letters[1:]) * base + pad
+        trigrams = (c0 * base + c1) * base + c2
+        return (bigrams, (letters[:-1] != 0) & (letters[1:] != 0), trigrams, (c0 != 0) & (c1 != 0) & (c2 != 0))
+
+    def get_postings(self, query:str)->list:
+        '''
+        Returns the postings of the trigrams of query, or of its bigram if query has 2 characters.
+        '''
+        chars = np.frombuffer(query.encode('utf-32-le'), dtype=np.uint32)
+        letters = np.searchsorted(self._alphabet, chars)
+        if (letters >= self._alphabet.size).any() or (self._alphabet[np.minimum(letters, self._alphabet.size-1)] != chars).any():
+            # A character of the query is not in any string
+            return [_EMPTY]
+        (bigrams, _, trigrams, _) = self._codes(letters.astype(np.int64))
+        toreturn = []
+        for code in np.unique(bigrams if len(query) == 2 else trigrams):
+            k = int(np.searchsorted(self._grams, code))
+            if (k == self._grams.size) or (self._grams[k] != code): return [_EMPTY]
+            toreturn.append(self._ids[self._starts[k]:self._starts[k+1]])
+        return toreturn
+
+class TickerList:
+    '''
+    Tickers of an exchange kept as columns of their codes, names, ISINs and types, each Ticker being created on its first access.
+    '''
+    def __init__(self, exchange:str, codes:list, names:list, isins:list, types:list) -> None:
+        self.exchange = exchange
+        self.codes = codes
+        self.names = names
+        self.isins = isins
+        self.types = types
+        self._tickers:list = [None]*len(codes)
+
+    @classmethod
+    def from_tickers(cls, exchange:str, tickers:list):
+        toreturn = cls(exchange, [t.code for t in tickers], [t.name for t in tickers], [t.isin for t in tickers], [t.type for t in tickers])
+        toreturn._tickers = list(tickers)
+        return toreturn
+
+    def __getitem__(self, i:int)->Ticker:
+        ticker = self._tickers[i]
+        if ticker is None:
+            ticker = Ticker(self.codes[i], self.exchange, isin=self.isins[i], name=self.names[i], type=self.types[i])
+            self._tickers[i] = ticker
+        return ticker
+
+    def __len__(self):
+        return len(self.codes)
+
+    def get_created(self)->int:
+        '''
+        Returns the number of Ticker objects created so far
+        '''
+        return sum(1 for ticker in self._tickers if ticker is not None)
+
+class TickerIndex:
+    '''
+    Search index over the tickers of all exchanges, built once:
+    . an inverted index of the bigrams and trigrams of the (lower case) names, each one pointing to the sorted ids of the tickers whose name contains it
+    . the same inverted index over the ISINs (built on first use), plus an exact ISIN hash
+    . an exact hash of the (lower case) codes
+    . for the ranked search of queries shorter than SHORT_QUERY_LENGTH, the ids of the tickers with a word starting with each prefix of 1 or 2 characters,
+    in ranking order (built on first use)
+    Ticker ids follow the order in which the tickers are given, so unranked results keep that order.
+    '''
+    def __init__(self, tickers:dict) -> None:
+        '''
+        tickers: dictionary of (exchange code, TickerList or list of Ticker)
+        '''
+        self._lists:list = [exchange_tickers if isinstance(exchange_tickers, TickerList) else TickerList.from_tickers(exchange, exchange_tickers)
+                            for exchange, exchange_tickers in tickers.items()]
+        sizes = [len(tickerlist) for tickerlist in self._lists]
+        # Id of the first ticker of each list
+        self._offsets:ndarray = np.cumsum([0]+sizes)
+        self._exchange_codes = {exchange:i for i, exchange in enumerate(tickers.keys())}
+        self._exchanges:ndarray = np.repeat(np.arange(len(self._lists), dtype=np.int32), sizes)
+        self._names = [name.lower() for tickerlist in self._lists for name in tickerlist.names]
+        self._isins = [isin.lower() if isin != None else None for tickerlist in self._lists for isin in tickerlist.isins]
+        # Types are few, each ticker only keeps the id of its type
+        types = [t.lower() for tickerlist in self._lists for t in tickerlist.types]
+        self._types:list = list(dict.fromkeys(types))
+        type_ids = {t:i for i, t in enumerate(self._types)}
+        self._type_ids:ndarray = np.array([type_ids[t] for t in types], dtype=np.int32)
+        self._name_index = _GramIndex(self._names)
+        # Only built on the first search for a partial ISIN
+        self._isin_index:_GramIndex = None
+        self._isin_hash = self._build_hash(self._isins)
+        self._code_hash = self._build_hash([code.lower() for tickerlist in self._lists for code in tickerlist.codes])
+        # ISINs longer than usual are not found by the exact hash when searching for a full ISIN
+        self._long_isins = [i for i, isin in enumerate(self._isins) if (isin != None) and (len(isin) > _ISIN_LENGTH)]
+        # Only built on the first ranked search for a short query
+        self._prefixes:dict = None
+        self._by_length:ndarray = None
+
+    def _ticker(self, i:int)->Ticker:
+        k = int(np.searchsorted(self._offsets, i, side='right')) - 1
+        return self._lists[k][i - int(self._offsets[k])]
+
+    @staticmethod
+    def _build_hash(values:list)->dict:
+        toreturn = {}
+        for i, value in enumerate(values):
+            if value != None: toreturn.setdefault(value, []).append(i)
+        return toreturn
+
+    def _candidates(self, index:_GramIndex, query:str, market:str)->ndarray:
+        '''
+        Returns the sorted ids of the tickers of the market ('' for all markets) which may contain query.
+        Single character queries cannot use the index and return all the tickers of the market.
+        '''
+        if market != '':
+            if market not in self._exchange_codes: return _EMPTY
+            candidates = np.flatnonzero(self._exchanges == self._exchange_codes[market])
+        else:
+            candidates = np.arange(len(self), dtype=np.int32)
+        if len(query) >= 2:
+            # Intersect the postings of all the trigrams (or of the bigram) of the query, starting with the shortest
+            postings = sorted(index.get_postings(query), key=len)
+            ids = postings[0]
+            for posting in postings[1:]:
+                if ids.size == 0: break
+                ids = np.intersect1d(ids, posting, assume_unique=True)
+            candidates = ids if market == '' else ids[self._exchanges[ids] == self._exchange_codes[market]]
+        return candidates
+
+    def _rank(self, ids:list, query:str, limit:int=None)->list:
+        '''
+        Orders the ids by relevance: exact name first, then names starting with the query, then names with a word starting with the query, then the others.
+        Shorter names come first within each group.
+        '''
+        def score(i:int):
+            name = self._names[i]
+            if name == query: group = 0
+            elif name.startswith(query): group = 1
+            elif (' '+query) in name: group = 2
+            else: group = 3
+            return (group, len(name))
+        if limit != None: return heapq.nsmallest(limit, ids, key=score)
+        return sorted(ids, key=score)
+
+    def _build_prefixes(self):
+        '''
+        Builds the ranked lists of the ids of the tickers with a word starting with each prefix of 1 or 2 characters, and the ids of all the tickers
+        by name length, both in the order of _rank.
+        '''
+        lengths = np.array([len(name) for name in self._names], dtype=np.int64)
+        self._by_length = np.argsort(lengths, kind='stable').astype(np.int32)
+        codes = {}
+        (prefixes, groups, ids) = ([], [], [])
+        for i, name in enumerate(self._names):
+            for k, word in enumerate(name.split(' ')):
+                for prefix in (word[:1], word[:2]) if len(word) > 1 else (word,):
+                    if prefix == '': continue
+                    prefixes.append(codes.setdefault(prefix, len(codes)))
+                    groups.append(2 if k > 0 else 0 if name == prefix else 1)
+                    ids.append(i)
+        (prefixes, groups, ids) = (np.array(prefixes, dtype=np.int64), np.array(groups, dtype=np.int64), np.array(ids, dtype=np.int64))
+        order = np.lexsort((ids, lengths[ids], groups, prefixes))
+        (prefixes, ids) = (prefixes[order], ids[order])
+        # A name with several words starting with the prefix is kept with its best group, which comes first
+        (_, first) = np.unique(prefixes * max(len(self), 1) + ids, return_index=True)
+        first.sort()
+        (prefixes, ids) = (prefixes[first], ids[first].astype(np.int32))
+        starts = np.searchsorted(prefixes, np.arange(len(codes) + 1))
+        self._prefixes = {prefix:ids[starts[code]:starts[code+1]] for prefix, code in codes.items()}
+
+    def _rank_short(self, query:str, market:str, matching_types:ndarray, count:int)->list:
+        '''
+        Returns the count most relevant ids of the tickers of the market with a type matching and a name containing query, shorter than SHORT_QUERY_LENGTH,
+        in the order of _rank: first from the ranked list of the prefix, then from the names containing query elsewhere by name length.
+        '''
+        if (market != '') and (market not in self._exchange_codes): return []
+        if self._prefixes is None: self._build_prefixes()
+        def keep(ids:ndarray)->ndarray:
+            if market != '': ids = ids[self._exchanges[ids] == self._exchange_codes[market]]
+            return ids[matching_types[self._type_ids[ids]]]
+        # All the names start with an empty query
+        ranked = self._prefixes.get(query, _EMPTY) if query != '' else self._by_length
+        toreturn = []
+        for start in range(0, ranked.size, _CHUNK):
+            toreturn.extend(keep(ranked[start:start+_CHUNK]).tolist())
+            if len(toreturn) >= count: return toreturn[:count]
+        if query == '': return toreturn
+        for start in range(0, self._by_length.size, _CHUNK):
+            for i in keep(self._by_length[start:start+_CHUNK]).tolist():
+                name = self._names[i]
+                if (query in name) and (not name.startswith(query)) and ((' '+query) not in name):
+                    toreturn.append(i)
+                    if len(toreturn) == count: return toreturn
+        return toreturn
+
+    def _matching(self, ids:ndarray, query:str):
+        '''
+        Yields the ids whose name contains query, converting them by chunks so that a limited search stops early
+        '''
+        for start in range(0, ids.size, _CHUNK):
+            for i in ids[start:start+_CHUNK].tolist():
+                if query in self._names[i]: yield i
+
+    def search(self, name:str, market:str='', type:str='', limit:int=None, ranked:bool=False, offset:int=0)->list[Ticker]:
+        '''
+        Returns the tickers of the market ('' for all markets) with a name containing name and a type containing type (case insensitive).
+        If ranked, the most relevant tickers come first. If limit is given, at most limit tickers are returned, after skipping offset tickers.
+        Names shorter than SHORT_QUERY_LENGTH match most tickers: at most SHORT_QUERY_LIMIT tickers are returned if no limit is given.
+        '''
+        query = name.lower()
+        if (limit == None) and (len(query) < SHORT_QUERY_LENGTH): limit = SHORT_QUERY_LIMIT
+        type_query = type.lower()
+        matching_types = np.array([type_query in t for t in self._types], dtype=bool)
+        if ranked and (limit != None) and (len(query) < SHORT_QUERY_LENGTH):
+            return [self._ticker(i) for i in self._rank_short(query, market, matching_types, offset + limit)[offset:]]
+        ids = self._candidates(self._name_index, query, market)
+        # Filter on the types
+        if not matching_types.all(): ids = ids[matching_types[self._type_ids[ids]]]
+        # Grams only tell the name may contain the query, check it does
+        if ranked or (limit == None):
+            ids = [i for i in ids.tolist() if query in self._names[i]]
+            if ranked: ids = self._rank(ids, query, None if limit == None else offset + limit)
+            ids = ids[offset:] if limit == None else ids[offset:offset + limit]
+        else:
+            ids = list(islice(self._matching(ids, query), offset, offset + limit))
+        return [self._ticker(i) for i in ids]
+
+    def search_isin(self, isin:str, market:str='', limit:int=None)->list[Ticker]:
+        '''
+        Returns the tickers of the market ('' for all markets) with an ISIN containing isin (case insensitive).
+        '''
+        query = isin.lower()
+        if len(query) == _ISIN_LENGTH:
+            ids = sorted(self._isin_hash.get(query, []) + [i for i in self._long_isins if query in self._isins[i]])
+            if market != '':
+                ids = [i for i in ids if self._exchanges[i] == self._exchange_codes.get(market)]
+        else:
+            if self._isin_index is None: self._isin_index = _GramIndex([isin if isin != None else "" for isin in self._isins])
+            ids = [i for i in self._candidates(self._isin_index, query, market).tolist() if (self._isins[i] != None) and (query in self._isins[i])]
+        if limit != None: ids = ids[:limit]
+        return [self._ticker(i) for i in ids]
+
+    def search_code(self, code:str, market:str='')->list[Ticker]:
+        '''
+        Returns the tickers of the market ('' for all markets) with the code (case insensitive).
+        '''
+        ids = self._code_hash.get(code.lower(), [])
+        if market != '':
+            ids = [i for i in ids if self._exchanges[i] == self._exchange_codes.get(market)]
+        return [self._ticker(i) for i in ids]
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+
+class UnitTestTickerIndex(unittest.TestCase):
+    def create_index(self)->TickerIndex:
+        return TickerIndex({"US":[Ticker("MSFT", "US", isin="US5949181045", name="Microsoft Corporation"),
+                                  Ticker("MICP", "US", type="ETF", isin="US0000000001", name="Micro Property ETF"),
+                                  Ticker("MU", "US", isin=None, name="Micron Technology")],
+                            "SW":[Ticker("MSFT", "SW", isin="US5949181045", name="Microsoft Corp"),
+                                  Ticker("MIC", "SW", isin="CH0000000001", name="Micro")]})
+
+    def test_search(self):
+        index = self.create_index()
+        self.assertEqual([t.code for t in index.search("micro")], ["MSFT", "MICP", "MU", "MSFT", "MIC"])
+        self.assertEqual([t.code for t in index.search("MICRO", "US", "common stock")], ["MSFT", "MU"])
+        self.assertEqual([t.code for t in index.search("micro", ranked=True, limit=3)], ["MIC", "MSFT", "MU"])
+        self.assertEqual([t.code for t in index.search("property")], ["MICP"])
+        self.assertEqual([t.code for t in index.search("ro", "SW")], ["MSFT", "MIC"])
+        self.assertEqual(index.search("xyz"), [])
+        self.assertEqual(index.search("micro", "XX"), [])
+        self.assertEqual(len(index.search("")), 5)
+        self.assertEqual([t.code for t in index.search("micro", limit=2, offset=2)], ["MU", "MSFT"])
+
+    def test_short_queries(self):
+        words = ["alpha", "beta", "gamma", "delta", "micro", "macro", "corp", "inc", "a", "ab"]
+        rng = np.random.default_rng(3)
+        names = [" ".join(rng.choice(words, size=rng.integers(1, 4))) for i in range(3000)]
+        types = ["Common Stock", "ETF"]
+        index = TickerIndex({exchange:[Ticker("T{i}".format(i=i), exchange, type=types[i % 2], name=names[i]) for i in range(k, len(names), 2)]
+                             for (k, exchange) in enumerate(["US", "SW"])})
+        # Short ranked queries give the same tickers as ranking all the names containing the query
+        for (query, market, type) in [("a", "", ""), ("ab", "US", ""), ("m", "", "etf"), ("lp", "", ""), ("", "SW", ""), ("z", "", "")]:
+            everything = index.search(query, market, type, limit=len(index))
+            ranked = [t.get_full_ticker() for t in index.search(query, market, type, ranked=True, limit=len(index))]
+            self.assertEqual(sorted(ranked), sorted([t.get_full_ticker() for t in everything]))
+            ids = index._rank([index._code_hash[t.code.lower()][0] for t in everything], query)
+            self.assertEqual(ranked, [index._ticker(i).get_full_ticker() for i in ids])
+            self.assertEqual([t.get_full_ticker() for t in index.search(query, market, type, ranked=True, limit=7, offset=3)], ranked[3:10])
+        self.assertEqual(len(index.search("a")), SHORT_QUERY_LIMIT)
+        self.assertEqual([t.code for t in index.search("a", offset=SHORT_QUERY_LIMIT, limit=2)], [t.code for t in index.search("a", limit=SHORT_QUERY_LIMIT+2)][-2:])
+        self.assertEqual(len(index.search("alpha")), len([name for name in names if "alpha" in name]))
+
+    def test_short_query_latency(self):
+        rng = np.random.default_rng(5)
+        chars = rng.integers(ord('a'), ord('z') + 1, size=(150000, 15), dtype=np.uint32)
+        chars[:, 8] = ord(' ')
+        names = np.frombuffer(chars.tobytes(), dtype='<U15').tolist()
+        index = TickerIndex({"US":TickerList("US", ["T{i}".format(i=i) for i in range(len(names))], names, [None]*len(names), ["Common Stock"]*len(names))})
+        index.search("a", ranked=True)
+        for (query, ranked) in [("a", False), ("a", True), ("qz", False), ("qz", True)]:
+            start = time.perf_counter()
+            self.assertEqual(len(index.search(query, ranked=ranked)), SHORT_QUERY_LIMIT)
+            self.assertLess(time.perf_counter() - start, 0.005)
+
+    def test_search_isin(self):
+        index = self.create_index()
+        self.assertEqual([t.exchange for t in index.search_isin("us5949181045")], ["US", "SW"])
+        self.assertEqual([t.exchange for t in index.search_isin("US5949181045", "SW")], ["SW"])
+        self.assertEqual([t.code for t in index.search_isin("0000000001")], ["MICP", "MIC"])
+        self.assertEqual([t.code for t in index.search_code("msft", "US")], ["MSFT"])
+
+    def test_lazy(self):
+        tickers = TickerList("US", ["MSFT", "MU", "GT"], ["Microsoft Corporation", "Micron Technology", "Goodyear Tire & Rubber Co"],
+                             ["US5949181045", None, "US3825501014"], ["Common Stock"]*3)
+        index = TickerIndex({"US":tickers, "SW":[Ticker("MIC", "SW", isin="CH0000000001", name="Micro")]})
+        self.assertEqual(len(index), 4)
+        self.assertEqual(tickers.get_created(), 0)
+        self.assertEqual([t.get_full_ticker() for t in index.search("micro")], ["MSFT.US", "MU.US", "MIC.SW"])
+        self.assertEqual(tickers.get_created(), 2)
+        self.assertIs(index.search_code("mu")[0], tickers[1])
+        self.assertEqual(index.search_isin("US3825501014")[0].name, "Goodyear Tire & Rubber Co")
+
+
+if __name__ == '__main__':
+    unittest.main()
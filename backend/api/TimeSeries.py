@@ -4,8 +4,9 @@ import types
 import unittest
 import numpy as np
 from numpy import ndarray, number
-import pandas as pd
 from exceptions import PMException
+import analytics
+from analytics import backward_fill, chain_returns, forward_fill
 
 fill = types.SimpleNamespace()
 fill.FORWARDFILL = 1
@@ -53,25 +54,104 @@ class TimeSeries:
     def __setitem__(self,i,v):
         self.time_series[i]=v
 
-    def __iadd__(self, other):
-        self.time_series+=other.time_series
+    # Let numpy defer to the reflected operators of TimeSeries, so ndarray + TimeSeries returns a TimeSeries
+    __array_ufunc__ = None
+
+    def __is_dated(self)->bool:
+        return (self.start_date != None) and (self.end_date != None)
+
+    def __window(self, start_date:date, end_date:date)->np.ndarray:
+        '''
+        Returns a view on the elements from start_date to end_date, both within the time series
+        '''
+        return self.time_series[(start_date - self.start_date).days:(end_date - self.start_date).days+1]
+
+    def __expand(self, start_date:date, end_date:date, fill_value:number)->np.ndarray:
+        '''
+        Returns the elements from start_date to end_date, the dates outside of the time series being fill_value.
+        Returns a view if the time series covers exactly these dates.
+        '''
+        if (start_date == self.start_date) and (end_date == self.end_date): return self.__window(start_date, end_date)
+        toreturn = np.full((end_date - start_date).days+1, fill_value, dtype=np.result_type(self.time_series.dtype, fill_value))
+        first = (self.start_date - start_date).days
+        toreturn[first:first+self.days] = self.__window(self.start_date, self.end_date)
+        return toreturn
+
+    def __align(self, other)->tuple:
+        '''
+        Returns a tuple (elements of self, elements of other, start date, end date) of the operands of an element wise operation:
+        . two dated time series are aligned on the dates they both cover, as views on their elements
+        . otherwise elements are taken by position, other being a time series, a numpy array or a scalar broadcast by numpy
+        '''
+        if not isinstance(other, TimeSeries):
+            return (self.time_series, other, self.start_date, self.end_date)
+        if self.__is_dated() and other.__is_dated():
+            start_date = max(self.start_date, other.start_date)
+            end_date = min(self.end_date, other.end_date)
+            if start_date > end_date:
+                raise PMException("Cannot align the time series from {start1} to {end1} and from {start2} to {end2}, they do not overlap".format(start1=self.start_date.strftime(_DATEFORMAT),
+                end1=self.end_date.strftime(_DATEFORMAT), start2=other.start_date.strftime(_DATEFORMAT), end2=other.end_date.strftime(_DATEFORMAT)))
+            return (self.__window(start_date, end_date), other.__window(start_date, end_date), start_date, end_date)
+        if self.__is_dated(): return (self.time_series, other.time_series, self.start_date, self.end_date)
+        return (self.time_series, other.time_series, other.start_date, other.end_date)
+
+    def combine(self, other, operator, how:str='inner', fill_value:number=np.nan):
+        '''
+        Applies operator (a numpy binary function such as np.add) element wise to the time series and other (a time series, a numpy array or a scalar).
+        how sets the dates of the result when both operands are dated time series:
+        . 'inner': the dates covered by both time series
+        . 'outer': the dates covered by either time series, the dates missing in one of them taking fill_value
+        '''
+        if (how == 'outer') and isinstance(other, TimeSeries) and self.__is_dated() and other.__is_dated():
+            start_date = min(self.start_date, other.start_date)
+            end_date = max(self.end_date, other.end_date)
+            return TimeSeries(operator(self.__expand(start_date, end_date, fill_value), other.__expand(start_date, end_date, fill_value)), start_date, end_date)
+        if how not in ('inner', 'outer'): raise PMException("Incorrect alignment {how}".format(how=how))
+        (a, b, start_date, end_date) = self.__align(other)
+        return TimeSeries(operator(a, b), start_date, end_date)
+
+    def __inplace(self, other, operator):
+        '''
+        Applies operator in place if the result covers the same dates as the time series, returns a new time series otherwise
+        '''
+        (a, b, start_date, end_date) = self.__align(other)
+        if (start_date != self.start_date) or (end_date != self.end_date) or not a.flags.writeable:
+            return TimeSeries(operator(a, b), start_date, end_date)
+        operator(a, b, out=a)
         return self
 
+    def __iadd__(self, other):
+        return self.__inplace(other, np.add)
+
     def __isub__(self, other):
-        self.time_series-=other.time_series
-        return self
+        return self.__inplace(other, np.subtract)
     
     def __add__(self, other):
-        return TimeSeries(self.time_series+other.time_series)
+        return self.combine(other, np.add)
 
     def __sub__(self, other):
-        return TimeSeries(self.time_series-other.time_series)
+        return self.combine(other, np.subtract)
 
     def __mul__(self, other):
-        return TimeSeries(self.time_series*other.time_series)
+        return self.combine(other, np.multiply)
 
     def __truediv__(self, other):
-        return TimeSeries(self.time_series/other.time_series)
+        return self.combine(other, np.true_divide)
+
+    def __radd__(self, other):
+        return self.combine(other, lambda a, b: np.add(b, a))
+
+    def __rsub__(self, other):
+        return self.combine(other, lambda a, b: np.subtract(b, a))
+
+    def __rmul__(self, other):
+        return self.combine(other, lambda a, b: np.multiply(b, a))
+
+    def __rtruediv__(self, other):
+        return self.combine(other, lambda a, b: np.true_divide(b, a))
+
+    def __neg__(self):
+        return TimeSeries(-self.time_series, self.start_date, self.end_date)
     
 
     def get(self,date:date)->np.float32:
@@ -80,7 +160,19 @@ class TimeSeries:
             raise PMException("Cannot return time series element at {date}, the time series ranges from {first_date} to {last_date}".format(date=date.strftime(_DATEFORMAT), 
             first_date=self.start_date.strftime(_DATEFORMAT), last_date=self.end_date.strftime(_DATEFORMAT)))
         return self.time_series[(date - self.start_date).days]
-    
+
+    def get_range(self, start_date:date, end_date:date)->np.ndarray:
+        '''
+        Returns a view on the elements of the time series from start_date to end_date (both inclusive).
+        Raises an exception if the range is not entirely covered by the time series, the same way get() does for a single date.
+        '''
+        first = (start_date - self.start_date).days
+        last = (end_date - self.start_date).days
+        if((first < 0) or (last >= self.time_series.size) or (first > last)):
+            raise PMException("Cannot return time series elements from {start} to {end}, the time series ranges from {first_date} to {last_date}".format(start=start_date.strftime(_DATEFORMAT), end=end_date.strftime(_DATEFORMAT),
+            first_date=self.start_date.strftime(_DATEFORMAT), last_date=self.end_date.strftime(_DATEFORMAT)))
+        return self.time_series[first:last+1]
+
 
     def start_date(self)->date:
         return self.start_date
@@ -108,34 +200,71 @@ class TimeSeries:
         '''
         if(base_date == None):
             base_date = self.start_date
-        period:pd.DatetimeIndex = pd.date_range(base_date, self.end_date, freq='D')
-        toreturn:ndarray = np.zeros((self.end_date - base_date).days+1)
-        toreturn[0]=base_value
-        for i, d in enumerate(period):
-            if(i==0): continue #Skip the first date since it is valued as base_value
-            toreturn[i]=toreturn[i-1] * self.get(base_date+timedelta(days=i))/ self.get(base_date+timedelta(days=i-1))
+        toreturn:ndarray = chain_returns(self.get_range(base_date, self.end_date), base_value)
         return TimeSeries(toreturn, base_date, end_date=self.end_date)
 
-    
+
+    def __observations(self)->tuple:
+        '''
+        Returns a tuple (positions, values as float64) of the days with a value, skipping the gaps (zero or NaN) of the calendar daily layout
+        '''
+        positions = np.flatnonzero((self.time_series != 0) & ~np.isnan(self.time_series))
+        return (positions, self.time_series[positions].astype(np.float64))
+
+    def __scatter(self, positions:ndarray, values:ndarray):
+        '''
+        Returns a time series with the same dates holding values at positions, the other days being NaN
+        '''
+        toreturn = np.full(self.time_series.size, np.nan)
+        toreturn[positions] = values
+        return TimeSeries(toreturn, self.start_date, self.end_date)
+
+    def apply(self, kernel, *args):
+        '''
+        Applies kernel (a function of analytics) to the values of the days with a value and returns a time series with the same dates,
+        the gap days (zero or NaN) being NaN.
+        '''
+        (positions, values) = self.__observations()
+        return self.__scatter(positions, kernel(values, *args))
+
+    def rolling(self, window:int):
+        '''
+        Returns the rolling statistics over the last window days with a value: gap days (zero or NaN) are not counted in the window,
+        so a time series filled on week-ends (fill_method) counts them as days with a value.
+        '''
+        return RollingWindow(self, window)
+
+    def returns(self):
+        '''
+        Returns the time series of the returns from the previous day with a value, NaN on the first day and on the gap days
+        '''
+        return self.apply(analytics.returns)
+
+    def drawdown(self):
+        '''
+        Returns the time series of the drawdowns from the highest value so far, NaN on the gap days
+        '''
+        return self.apply(analytics.drawdown)
+
+    def sharpe(self, periods_per_year:int=252, risk_free_rate:float=0.0)->float:
+        '''
+        Returns the annualized Sharpe ratio of the returns between the days with a value. risk_free_rate is an annual rate.
+        '''
+        return float(analytics.sharpe(self.__observations()[1], periods_per_year, risk_free_rate))
+
     def missing(self, method=fill.FORWARDFILL):
+        '''
+        Fills the missing (zero) values of the time series in place, copying it first if it is read only.
+        '''
+        if method not in (fill.FORWARDFILL, fill.BACKFILL):
+            raise PMException("Incorrect method {method}".format(method=method))
+        if not self.time_series.flags.writeable:
+            self.time_series = self.time_series.copy()
         match method:
             case fill.FORWARDFILL:
-                self.__forwardfill()
+                forward_fill(self.time_series)
             case fill.BACKFILL:
-                self.__backfill()
-            case _:
-                raise PMException("Incorrect method {method}".format(method=method))
-
-
-    def __forwardfill(self):
-        df = pd.DataFrame(self.time_series)
-        df.replace(0.0, method='ffill', inplace=True)
-        self.time_series = df.to_numpy().flatten()
-
-    def __backfill(self):
-        df = pd.DataFrame(self.time_series)
-        df.replace(0.0, method='bfill', inplace=True)
-        self.time_series = df.to_numpy().flatten()
+                backward_fill(self.time_series)
 
 
     def __repr__(self):
@@ -147,6 +276,31 @@ class TimeSeries:
     def __ne__(self, other):
         return not self.eq(other)
 
+class RollingWindow:
+    '''
+    Rolling statistics of a time series over the last window days with a value, returned by TimeSeries.rolling.
+    Each statistic is a time series with the same dates, NaN on the gap days and until window days with a value are available.
+    '''
+    def __init__(self, ts:TimeSeries, window:int) -> None:
+        if window < 1: raise PMException("Incorrect rolling window {window}".format(window=window))
+        self.ts = ts
+        self.window = window
+
+    def sum(self)->TimeSeries:
+        return self.ts.apply(analytics.rolling_sum, self.window)
+
+    def mean(self)->TimeSeries:
+        return self.ts.apply(analytics.rolling_mean, self.window)
+
+    def std(self, ddof:int=1)->TimeSeries:
+        return self.ts.apply(analytics.rolling_std, self.window, ddof)
+
+    def min(self)->TimeSeries:
+        return self.ts.apply(analytics.rolling_min, self.window)
+
+    def max(self)->TimeSeries:
+        return self.ts.apply(analytics.rolling_max, self.window)
+
 class UnitTestTimeSeries(unittest.TestCase):
     def test_iadd(self):
         ts1=TimeSeries(np.array([5,6,7,8]))
@@ -195,6 +349,38 @@ class UnitTestTimeSeries(unittest.TestCase):
         self.assertEqual(ts3[0], 5)
         self.assertEqual(ts3[3], 2)
 
+    def test_aligned_operators(self):
+        ts1=TimeSeries(np.array([1.0,2,3,4]), start_date=date(2022,1,1), end_date=date(2022,1,4))
+        ts2=TimeSeries(np.array([10.0,20,30]), start_date=date(2022,1,3), end_date=date(2022,1,5))
+        ts3 = ts1+ts2
+        self.assertEqual((ts3.start_date, ts3.end_date), (date(2022,1,3), date(2022,1,4)))
+        self.assertTrue(np.array_equal(ts3.get_full_time_series(), [13, 24]))
+        self.assertTrue(np.array_equal((ts2-ts1).get_full_time_series(), [7, 16]))
+        ts4 = ts1.combine(ts2, np.add, how='outer', fill_value=0)
+        self.assertEqual((ts4.start_date, ts4.end_date), (date(2022,1,1), date(2022,1,5)))
+        self.assertTrue(np.array_equal(ts4.get_full_time_series(), [1, 2, 13, 24, 30]))
+        self.assertTrue(np.isnan(ts1.combine(ts2, np.add, how='outer').get(date(2022,1,5))))
+        # Scalars and arrays are broadcast, on either side
+        self.assertEqual((ts1*2).get(date(2022,1,4)), 8)
+        self.assertEqual((1/ts1).get(date(2022,1,2)), 0.5)
+        ts5 = np.array([1,1,1,1])-ts1
+        self.assertTrue(isinstance(ts5, TimeSeries))
+        self.assertTrue(np.array_equal(ts5.get_full_time_series(), [0, -1, -2, -3]))
+        self.assertEqual(ts5.start_date, date(2022,1,1))
+        # In place when the dates are kept
+        a = ts2.get_full_time_series()
+        ts2 += TimeSeries(np.array([1.0,1,1,1,1]), start_date=date(2022,1,1), end_date=date(2022,1,5))
+        self.assertIs(ts2.get_full_time_series(), a)
+        self.assertTrue(np.array_equal(a, [11, 21, 31]))
+        ts1 -= ts2
+        self.assertEqual((ts1.start_date, ts1.end_date), (date(2022,1,3), date(2022,1,4)))
+        self.assertTrue(np.array_equal(ts1.get_full_time_series(), [-8, -17]))
+        try:
+            ts1 + TimeSeries(np.array([1.0]), start_date=date(2023,1,1), end_date=date(2023,1,1))
+            self.assertTrue(False)
+        except PMException:
+            self.assertTrue(True)
+
     def test_dates(self):
         ts1=TimeSeries(np.array([5,6,7,8]), start_date=date(2022,1,1), end_date=date(2022,1,4))
         self.assertEqual(ts1.get(date(2022,1,4)), 8)
@@ -204,5 +390,35 @@ class UnitTestTimeSeries(unittest.TestCase):
         except PMException:
             self.assertTrue(True)
 
+    def test_get_range(self):
+        ts1=TimeSeries(np.array([5,6,7,8]), start_date=date(2022,1,1), end_date=date(2022,1,4))
+        self.assertTrue(np.array_equal(ts1.get_range(date(2022,1,2), date(2022,1,3)), np.array([6,7])))
+        self.assertTrue(np.array_equal(ts1.get_range(date(2022,1,1), date(2022,1,4)), ts1.get_full_time_series()))
+        try:
+            ts1.get_range(date(2021,12,31), date(2022,1,2))
+            self.assertTrue(False)
+        except PMException:
+            self.assertTrue(True)
+
+    def test_rolling(self):
+        # Week-end gaps (zero) and a missing value (NaN) are skipped
+        ts1=TimeSeries(np.array([1,2,0,0,4,np.nan,8,16], dtype=np.float32), start_date=date(2022,1,1), end_date=date(2022,1,8))
+        np.testing.assert_array_equal(ts1.rolling(2).sum().get_full_time_series(), [np.nan, 3, np.nan, np.nan, 6, np.nan, 12, 24])
+        np.testing.assert_array_equal(ts1.rolling(3).max().get_full_time_series(), [np.nan, np.nan, np.nan, np.nan, 4, np.nan, 8, 16])
+        np.testing.assert_array_equal(ts1.rolling(3).min().get_full_time_series(), [np.nan, np.nan, np.nan, np.nan, 1, np.nan, 2, 4])
+        np.testing.assert_allclose(ts1.rolling(2).mean().get_full_time_series(), [np.nan, 1.5, np.nan, np.nan, 3, np.nan, 6, 12])
+        np.testing.assert_allclose(ts1.rolling(2).std().get(date(2022,1,8)), np.std([8, 16], ddof=1))
+        self.assertEqual((ts1.rolling(2).sum().start_date, ts1.rolling(2).sum().end_date), (ts1.start_date, ts1.end_date))
+        np.testing.assert_array_equal(ts1.returns().get_full_time_series(), [np.nan, 1, np.nan, np.nan, 1, np.nan, 1, 1])
+        ts2=TimeSeries(np.array([100,110,0,99,121]), start_date=date(2022,1,1), end_date=date(2022,1,5))
+        np.testing.assert_allclose(ts2.drawdown().get_full_time_series(), [0, 0, np.nan, -0.1, 0])
+        r = np.array([0.1, -0.1, 22/99])
+        self.assertAlmostEqual(ts2.sharpe(), np.mean(r) / np.std(r, ddof=1) * np.sqrt(252))
+        try:
+            ts1.rolling(0)
+            self.assertTrue(False)
+        except PMException:
+            self.assertTrue(True)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
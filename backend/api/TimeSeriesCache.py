@@ -0,0 +1,168 @@
+from collections import OrderedDict
+import mmap
+import os
+import sys
+import tempfile
+import unittest
+import numpy as np
+from TimeSeries import TimeSeries
+
+
+class TimeSeriesCache:
+    '''
+    Least recently used cache of time series with a budget in bytes.
+    When adding a time series exceeds the budget, the least recently used time series are evicted until the cache fits again.
+    Pinned keys are never evicted. A key can be pinned before its time series is added to the cache.
+    Pins are counted: a key pinned several times is evictable again once unpinned as many times.
+    Memory mapped time series only count for the size of their array object, their days being paged in and out by the OS.
+    A cache created without a budget (max_bytes is None) never evicts anything.
+    '''
+    def __init__(self, max_bytes:int=None) -> None:
+        self.max_bytes = max_bytes
+        self._entries:OrderedDict = OrderedDict() # key, TimeSeries from the least to the most recently used
+        self._pinned:dict = {} # key, number of times pinned
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def _size(ts:TimeSeries)->int:
+        values = ts.get_full_time_series()
+        base = values
+        while base is not None:
+            if isinstance(base, (np.memmap, mmap.mmap)): return sys.getsizeof(values)
+            base = getattr(base, 'base', None)
+        return values.nbytes
+
+    def get(self, key:str)->TimeSeries:
+        '''
+        Returns the time series cached for key or None.
+        '''
+        ts = self._entries.get(key)
+        if ts is None:
+            self._misses += 1
+            return None
+        self._hits += 1
+        self._entries.move_to_end(key)
+        return ts
+
+    def put(self, key:str, ts:TimeSeries):
+        if key in self._entries:
+            self._bytes -= self._size(self._entries.pop(key))
+        self._entries[key] = ts
+        self._bytes += self._size(ts)
+        self._evict()
+
+    def _evict(self):
+        if (self.max_bytes is None) or (self._bytes <= self.max_bytes): return
+        for key in list(self._entries.keys()):
+            if self._bytes <= self.max_bytes: return
+            if key in self._pinned: continue
+            self._bytes -= self._size(self._entries.pop(key))
+            self._evictions += 1
+
+    def pin(self, key:str):
+        self._pinned[key] = self._pinned.get(key, 0) + 1
+
+    def unpin(self, key:str):
+        if key not in self._pinned: return
+        self._pinned[key] -= 1
+        if self._pinned[key] == 0:
+            del self._pinned[key]
+            self._evict()
+
+    def clear(self):
+        self._entries.clear()
+        self._pinned.clear()
+        self._bytes = 0
+
+    def get_stats(self)->dict:
+        '''
+        Returns the hits, misses, evictions, number of entries, number of pinned keys, bytes used and byte budget of the cache.
+        '''
+        return {"hits":self._hits, "misses":self._misses, "evictions":self._evictions, "entries":len(self._entries),
+                "pinned":len(self._pinned), "bytes":self._bytes, "max_bytes":self.max_bytes}
+
+    def __contains__(self, key:str)->bool:
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class UnitTestTimeSeriesCache(unittest.TestCase):
+    def test_lru(self):
+        # Each time series takes 80 bytes
+        cache = TimeSeriesCache(200)
+        cache.put("A", TimeSeries(np.zeros(10)))
+        cache.put("B", TimeSeries(np.zeros(10)))
+        self.assertIsNotNone(cache.get("A"))
+        cache.put("C", TimeSeries(np.zeros(10)))
+        # B is the least recently used
+        self.assertFalse("B" in cache)
+        self.assertTrue("A" in cache)
+        self.assertIsNone(cache.get("B"))
+        stats = cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["evictions"], stats["entries"], stats["bytes"]), (1, 1, 1, 2, 160))
+
+    def test_pin(self):
+        cache = TimeSeriesCache(200)
+        cache.pin("A")
+        cache.put("A", TimeSeries(np.zeros(10)))
+        cache.put("B", TimeSeries(np.zeros(10)))
+        cache.put("C", TimeSeries(np.zeros(10)))
+        self.assertTrue("A" in cache)
+        self.assertFalse("B" in cache)
+        cache.put("D", TimeSeries(np.zeros(10)))
+        # C is evicted instead of A which is the least recently used but is pinned
+        self.assertEqual(len(cache), 2)
+        self.assertTrue("A" in cache)
+        self.assertFalse("C" in cache)
+        cache.unpin("A")
+        cache.put("E", TimeSeries(np.zeros(10)))
+        self.assertFalse("A" in cache)
+        # A key pinned twice stays pinned until unpinned twice
+        cache.pin("F")
+        cache.pin("F")
+        cache.put("F", TimeSeries(np.zeros(10)))
+        cache.unpin("F")
+        cache.put("G", TimeSeries(np.zeros(10)))
+        cache.put("H", TimeSeries(np.zeros(10)))
+        self.assertTrue("F" in cache)
+        cache.unpin("F")
+        cache.unpin("F")
+        self.assertEqual(cache.get_stats()["pinned"], 0)
+        cache.pin("H")
+        cache.clear()
+        self.assertEqual(cache.get_stats()["pinned"], 0)
+
+    def test_memory_mapped(self):
+        # The 200 mapped days would take 1600 bytes
+        cache = TimeSeriesCache(1000)
+        (fd, path) = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            np.zeros(1000).tofile(path)
+            block = np.memmap(path, dtype=np.float64, mode='r')
+            # Views on the mapped file do not count for their days
+            cache.put("A", TimeSeries(block[10:110]))
+            cache.put("B", TimeSeries(np.asarray(block[200:300])))
+            cache.put("C", TimeSeries(np.zeros(10)))
+            self.assertEqual(len(cache), 3)
+            self.assertTrue(cache.get_stats()["bytes"] < 1000)
+            del block
+            cache.clear()
+        finally:
+            os.remove(path)
+
+    def test_unbounded(self):
+        cache = TimeSeriesCache()
+        for i in range(100):
+            cache.put(str(i), TimeSeries(np.zeros(1000)))
+        self.assertEqual(len(cache), 100)
+        self.assertEqual(cache.get_stats()["evictions"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,252 @@
+'''
+Vectorized kernels on arrays of values, one dimensional (a time series) or two dimensional (a panel of one time series per row, as returned by pmdata.get_panel).
+The rolling, returns, drawdown and sharpe kernels work along the last axis, NaN standing for a missing value.
+'''
+import unittest
+import warnings
+import numpy as np
+from numpy import ndarray, number
+from exceptions import PMException
+
+
+def chain_returns(values:ndarray, base_value:number=100)->ndarray:
+    '''
+    Chains the daily returns of values from base_value: element i is base_value multiplied by the ratios values[j]/values[j-1] for j from 1 to i.
+    Computed as the cumulative product of the ratios, in float64. As with chaining one day at a time, a ratio to a zero value is infinite (or NaN for 0/0)
+    and NaN values propagate to all the following elements.
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    toreturn = np.empty(values.size, dtype=np.float64)
+    if values.size == 0: return toreturn
+    toreturn[0] = base_value
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(values[1:], values[:-1], out=toreturn[1:])
+        np.multiply.accumulate(toreturn, out=toreturn)
+    return toreturn
+
+
+def forward_fill(values:ndarray)->ndarray:
+    '''
+    Replaces in place each zero of values by the last non zero value before it (NaN being a value), leading zeros being kept.
+    The index of the last non zero value is propagated with a running maximum over the indexes of the non zero values.
+    Returns values.
+    '''
+    missing = values == 0
+    if missing.any():
+        index = np.arange(values.size)
+        index[missing] = 0
+        np.maximum.accumulate(index, out=index)
+        np.take(values, index, out=values)
+    return values
+
+def backward_fill(values:ndarray)->ndarray:
+    '''
+    Replaces in place each zero of values by the first non zero value after it (NaN being a value), trailing zeros being kept.
+    Returns values.
+    '''
+    missing = values == 0
+    if missing.any():
+        index = np.arange(values.size)
+        index[missing] = values.size-1
+        np.minimum.accumulate(index[::-1], out=index[::-1])
+        np.take(values, index, out=values)
+    return values
+
+def __check_window(window:int):
+    if window < 1: raise PMException("Incorrect rolling window {window}".format(window=window))
+
+def __window_differences(cumulated:ndarray, window:int)->ndarray:
+    '''
+    Returns the differences cumulated[i] - cumulated[i-window] for i from window-1 (cumulated[-1] being 0)
+    '''
+    toreturn = cumulated[..., window-1:].copy()
+    toreturn[..., 1:] -= cumulated[..., :-window]
+    return toreturn
+
+def rolling_sum(values:ndarray, window:int)->ndarray:
+    '''
+    Returns the sums of the last window values, from the differences of the cumulative sums.
+    The first window-1 elements and the windows containing a NaN are NaN.
+    '''
+    __check_window(window)
+    values = np.asarray(values, dtype=np.float64)
+    toreturn = np.full(values.shape, np.nan)
+    if window > values.shape[-1]: return toreturn
+    missing = np.isnan(values)
+    sums = __window_differences(np.cumsum(np.where(missing, 0.0, values), axis=-1), window)
+    sums[__window_differences(np.cumsum(missing, axis=-1), window) > 0] = np.nan
+    toreturn[..., window-1:] = sums
+    return toreturn
+
+def rolling_mean(values:ndarray, window:int)->ndarray:
+    return rolling_sum(values, window) / window
+
+def rolling_std(values:ndarray, window:int, ddof:int=1)->ndarray:
+    '''
+    Returns the standard deviations of the last window values, from the cumulative sums of the values and of their squares.
+    As for the extrema, the values are cut in blocks of window values, each centered on its own mean with the sums restarted at each block.
+    A window adds the end of its first block to the start of its second one around the mean of the second block,
+    which keeps the differences of the sums accurate on trending series.
+    '''
+    __check_window(window)
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[-1]
+    toreturn = np.full(values.shape, np.nan)
+    if window <= ddof or window > n: return toreturn
+    missing = np.isnan(values)
+    padded = np.concatenate((values, np.full(values.shape[:-1] + ((-n) % window,), np.nan)), axis=-1)
+    blocks = padded.reshape(values.shape[:-1] + (-1, window))
+    counts = np.sum(~np.isnan(blocks), axis=-1)
+    means = np.nansum(blocks, axis=-1) / np.maximum(counts, 1)
+    centered = np.nan_to_num(blocks - means[..., None])
+    sums = np.cumsum(centered, axis=-1)
+    squares = np.cumsum(centered * centered, axis=-1)
+    (totals, square_totals) = (sums[..., -1], squares[..., -1])
+    (sums, squares) = (sums.reshape(padded.shape), squares.reshape(padded.shape))
+    # Window ending at i: start of block i//window up to i, and the last lags values of the previous block
+    ends = np.arange(window-1, n)
+    block = ends // window
+    lags = (block + 1) * window - 1 - ends
+    previous = np.maximum(block - 1, 0)
+    cut = np.maximum(ends - window, 0)
+    head = np.where(lags > 0, totals[..., previous] - sums[..., cut], 0.0)
+    head_squares = np.where(lags > 0, square_totals[..., previous] - squares[..., cut], 0.0)
+    shift = np.where(lags > 0, means[..., previous] - means[..., block], 0.0)
+    window_sums = sums[..., ends] + head + lags * shift
+    window_squares = squares[..., ends] + head_squares + 2 * shift * head + lags * shift * shift
+    variances = (window_squares - window_sums * window_sums / window) / (window - ddof)
+    # Rounding may make the variance of constant values slightly negative
+    toreturn[..., window-1:] = np.sqrt(np.maximum(variances, 0.0))
+    toreturn[..., window-1:][__window_differences(np.cumsum(missing, axis=-1), window) > 0] = np.nan
+    return toreturn
+
+def __rolling_extremum(values:ndarray, window:int, operator, padding:number)->ndarray:
+    '''
+    van Herk/Gil-Werman algorithm: the values are cut in blocks of window values, each window spanning the end of a block and the start of the next one.
+    The extremum of a window is the extremum of the suffix extremum of its first block and of the prefix extremum of its second block,
+    which makes 3 comparisons per element whatever the window.
+    '''
+    __check_window(window)
+    values = np.asarray(values, dtype=np.float64)
+    n = values.shape[-1]
+    toreturn = np.full(values.shape, np.nan)
+    if window > n: return toreturn
+    padded = np.concatenate((values, np.full(values.shape[:-1] + ((-n) % window,), padding)), axis=-1)
+    blocks = padded.reshape(values.shape[:-1] + (-1, window))
+    prefix = operator.accumulate(blocks, axis=-1).reshape(padded.shape)
+    suffix = operator.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+    toreturn[..., window-1:] = operator(suffix[..., :n-window+1], prefix[..., window-1:n])
+    return toreturn
+
+def rolling_min(values:ndarray, window:int)->ndarray:
+    '''
+    Returns the minimum of the last window values, NaN for the first window-1 elements and the windows containing a NaN
+    '''
+    return __rolling_extremum(values, window, np.minimum, np.inf)
+
+def rolling_max(values:ndarray, window:int)->ndarray:
+    '''
+    Returns the maximum of the last window values, NaN for the first window-1 elements and the windows containing a NaN
+    '''
+    return __rolling_extremum(values, window, np.maximum, -np.inf)
+
+def returns(values:ndarray)->ndarray:
+    '''
+    Returns the returns values[i]/values[i-1] - 1, the first element being NaN
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    toreturn = np.full(values.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(values[..., 1:], values[..., :-1], out=toreturn[..., 1:])
+    toreturn[..., 1:] -= 1
+    return toreturn
+
+def drawdown(values:ndarray)->ndarray:
+    '''
+    Returns the drawdowns values[i]/(highest value up to i) - 1, NaN values being ignored by the running peak
+    '''
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return values / np.fmax.accumulate(values, axis=-1) - 1
+
+def sharpe(values:ndarray, periods_per_year:int=252, risk_free_rate:float=0.0):
+    '''
+    Returns the annualized Sharpe ratio of the returns of values: mean of the excess returns over their standard deviation, times the square root of periods_per_year.
+    risk_free_rate is an annual rate. Returns a number for a time series, an array with one ratio per row for a panel.
+    '''
+    excess = returns(values) - risk_free_rate / periods_per_year
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.nanmean(excess, axis=-1) / np.nanstd(excess, axis=-1, ddof=1) * np.sqrt(periods_per_year)
+
+
+class UnitTestAnalytics(unittest.TestCase):
+    def chain_one_day_at_a_time(self, values:ndarray, base_value:number)->ndarray:
+        toreturn = np.zeros(values.size)
+        toreturn[0] = base_value
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i in range(1, values.size):
+                toreturn[i] = toreturn[i-1] * values[i] / values[i-1]
+        return toreturn
+
+    def test_chain_returns(self):
+        values = np.array([10, 11, 12.5, 12, 0, 3, 4, 0, 0, 5, np.nan, 6], dtype=np.float32)
+        for (start, end) in [(0, 4), (0, 5), (0, 8), (3, 12), (6, 12), (9, 12)]:
+            expected = self.chain_one_day_at_a_time(values[start:end], 100)
+            np.testing.assert_allclose(chain_returns(values[start:end], 100), expected, rtol=1e-12)
+        self.assertEqual(chain_returns(np.array([5.0]), 100).tolist(), [100])
+        self.assertEqual(chain_returns(np.array([]), 100).size, 0)
+
+    def test_fill(self):
+        values = np.array([0, 0, 1, 0, np.nan, 0, 2, 0, -0.0, 3, 0], dtype=np.float32)
+        a = values.copy()
+        self.assertIs(forward_fill(a), a)
+        self.assertEqual(a.dtype, np.float32)
+        np.testing.assert_array_equal(a, [0, 0, 1, 1, np.nan, np.nan, 2, 2, 2, 3, 3])
+        a = values.copy()
+        np.testing.assert_array_equal(backward_fill(a), [1, 1, 1, np.nan, np.nan, 2, 2, 3, 3, 3, 0])
+        self.assertEqual(forward_fill(np.zeros(0)).size, 0)
+        np.testing.assert_array_equal(backward_fill(np.array([5.0, 6.0])), [5, 6])
+
+    def rolling_one_window_at_a_time(self, values:ndarray, window:int, statistic)->ndarray:
+        toreturn = np.full(values.shape, np.nan)
+        for i in range(window-1, values.shape[-1]):
+            toreturn[..., i] = statistic(values[..., i-window+1:i+1], axis=-1)
+        return toreturn
+
+    def test_rolling(self):
+        rng = np.random.default_rng(1)
+        panel = 1000 + rng.random((3, 50)) * 100
+        panel[0, :5] = np.nan
+        panel[1, 20] = np.nan
+        for window in [1, 3, 7, 50]:
+            for (kernel, statistic) in [(rolling_sum, np.sum), (rolling_mean, np.mean), (rolling_min, np.min), (rolling_max, np.max), (rolling_std, lambda a, axis: np.std(a, axis=axis, ddof=1))]:
+                with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                    expected = self.rolling_one_window_at_a_time(panel, window, statistic)
+                np.testing.assert_allclose(kernel(panel, window), expected, rtol=1e-9)
+                np.testing.assert_allclose(kernel(panel[2], window), expected[2], rtol=1e-9)
+        self.assertTrue(np.isnan(rolling_max(panel, 51)).all())
+        self.assertRaises(PMException, rolling_sum, panel, 0)
+        # A trending series has a small spread in each window compared to its overall spread
+        trend = 1e6 + np.arange(5000) * 1000.0 + rng.random(5000)
+        trend[100] = np.nan
+        for window in [2, 3, 7, 64]:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                expected = self.rolling_one_window_at_a_time(trend, window, lambda a, axis: np.std(a, axis=axis, ddof=1))
+            np.testing.assert_allclose(rolling_std(trend, window), expected, rtol=1e-9)
+
+    def test_performance(self):
+        values = np.array([100, 110, 99, 121, 120])
+        np.testing.assert_allclose(returns(values), [np.nan, 0.1, -0.1, 2/9, -1/121])
+        np.testing.assert_allclose(drawdown(values), [0, 0, -0.1, 0, -1/121])
+        r = returns(values)[1:]
+        self.assertAlmostEqual(sharpe(values), np.mean(r) / np.std(r, ddof=1) * np.sqrt(252))
+        self.assertAlmostEqual(sharpe(values, 12, 0.12), np.mean(r - 0.01) / np.std(r, ddof=1) * np.sqrt(12))
+        panel = np.array([values, values * 2])
+        np.testing.assert_allclose(sharpe(panel), [sharpe(values)] * 2)
+        np.testing.assert_allclose(drawdown(panel)[1], drawdown(values))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from genericpath import exists
 from glob import glob
@@ -7,25 +8,44 @@ import numpy as np
 import json
 from TimeSeries import fill, TimeSeries, PMException
 from FundamentalData import FundamentalData
-from PositionIdentifier import Ticker
+from PositionIdentifier import Ticker, supported_currencies, supported_crypto_currencies
+from FXEngine import FXEngine
+from TickerIndex import TickerIndex, TickerList
 from feedutils import get_equity_database, get_fx_database, set_database
+from ColumnStore import ColumnStore
+from tickermeta import FORWARD_FILLED, read_ticker_meta
+from universefile import read_universe
+from TimeSeriesCache import TimeSeriesCache
+from config import get_config
 
 __date_format = '%Y-%m-%d'
 
-TimeSeriesCache = dict[str, TimeSeries] # FullyQualifiedTicker_DataPointName, timeseries
-TickerCache = dict[str, dict[str, Ticker]] # Dictionary of (market, dictionary of (symbol name, Ticker)) for quick lookup by name
-
 DEFAULT_CURRENCY_DATAPOINT="adjusted_close"
+DEFAULT_CACHE_SIZE_MB=512
 
-__cache = {}
-__tickercache = {}
+__cache:TimeSeriesCache = None # FullyQualifiedTicker_DataPointName, timeseries. Bounded by TIMESERIES_CACHE_SIZE_MB, created on first use
+__fxcache:TimeSeriesCache = TimeSeriesCache() # Currency_DataPointName, timeseries. Always resident
+__fxengine:FXEngine = None # Created on first use, the rates of each currency being loaded when first converted
+__universe_columns = {} # exchange code, (dictionary of (ticker code, row), dictionary of (id file field, list of values)). Loaded on first use
+__universes = {} # exchange code, TickerList of the exchange. Loaded on first use
+__tickers = {} # fully qualified ticker, Ticker returned by get_ticker. Interned so equal tickers share one object
+__tickerindexes = {} # market ('' for all markets), search index over the tickers of the market. Built on first use
+__stores = {} # exchange code, ColumnStore or None if the exchange has no column store
 
 def init(database_location:str = None):
+    global __fxengine
     if(database_location != None): set_database(database_location)
     location = get_equity_database()
     #check if the location is correct
     if not exists(location): raise PMException("Missing database at {location}".format(location=location))
-    __init_ticker_cache()
+    # The universes of the exchanges are loaded on first use
+    __universe_columns.clear()
+    __universes.clear()
+    __tickerindexes.clear()
+    __tickers.clear()
+    # The fx rates are loaded again from the database
+    __fxcache.clear()
+    __fxengine = None
 
 def get_symbol_types():
     '''
@@ -33,65 +53,69 @@ def get_symbol_types():
     Supported ticker types:
     ['ETF', 'Note', 'FUND', 'Common Stock', 'Mutual Fund', 'ETC', 'INDEX', 'Preferred Stock']
     '''
-    tickers = __get_tickers_for_market()
-    return list(set([ticker.type for ticker in tickers]))
+    return list(set([type for exchange in __get_all_exchanges() for type in __get_universe(exchange).types]))
 
-def search(symbol_name:str, market:str='', type:str = "Common Stock")->list[Ticker]:
+def search(symbol_name:str, market:str='', type:str = "Common Stock", limit:int=None, ranked:bool=False, offset:int=0)->list[Ticker]:
     '''
     Searches for the instrument containing symbol_name in its name for the market specified
     Arguments:
     symbol_name: the symbol, or part of the symbol name (not ticker) to look for
     market: '' for all markets (which is the default) or the exchange (such as 'US' or 'SW')
     type: the types of symbol to look for. See the results of get_symbol_types()
+    limit: the maximum number of instruments to return (all by default, but SHORT_QUERY_LIMIT if symbol_name is shorter than SHORT_QUERY_LENGTH)
+    ranked: if True, the instruments whose name is, starts with, or has a word starting with symbol_name come first
+    offset: the number of instruments to skip, to get the next page of instruments
     '''
-    if not __tickercache:
-        __init_ticker_cache()
-    tickers = __get_tickers_for_market(market)
-    # Find the name in names
-    matching_tickers = [ticker for ticker in tickers if (symbol_name.lower() in ticker.name.lower()) and (type.lower() in ticker.type.lower())]
-    return matching_tickers
+    return __get_ticker_index(market).search(symbol_name, market, type, limit, ranked, offset)
 
-def search_isin(isin:str, market:str='')->list[Ticker]:
+def search_isin(isin:str, market:str='', limit:int=None)->list[Ticker]:
     '''
-    Searches for the instrument containing symbol_name in its name for the market specified
+    Searches for the instrument containing isin in its isin for the market specified
     Arguments:
-    symbol_name: the symbol, or part of the symbol name (not ticker) to look for
+    isin: the isin, or part of the isin to look for
     market: '' for all markets (which is the default) or the exchange (such as 'US' or 'SW')
-    type: the types of symbol to look for. See the results of get_symbol_types()
+    limit: the maximum number of instruments to return (all by default)
     '''
-    if not __tickercache:
-        __init_ticker_cache()
-    tickers = __get_tickers_for_market(market)
-    # Find the name in names
-    matching_tickers = [ticker for ticker in tickers if (ticker.isin != None) and (isin.lower() in ticker.isin.lower())]
-    return matching_tickers
-
-def __get_tickers_for_market(market:str='')->list:
-    if(len(market)!=0):
-        return __tickercache[market].values()
-    else:
-        #union of all symbols for all markets
-        toreturn = []
-        for exchange in __tickercache.keys():
-            toreturn.extend(__tickercache[exchange].values())
-        return toreturn
+    return __get_ticker_index(market).search_isin(isin, market, limit)
+
+def search_code(code:str, market:str='')->list[Ticker]:
+    '''
+    Returns the instruments with the code (such as 'MSFT') for the market specified ('' for all markets)
+    '''
+    return __get_ticker_index(market).search_code(code, market)
+
+def __get_universe_columns(exchange:str)->tuple:
+    '''
+    Returns the universe of the exchange as a tuple (dictionary of (ticker code, row), dictionary of (id file field, list of values)), reading it on first use.
+    '''
+    if exchange not in __universe_columns:
+        columns = read_universe(os.path.join(get_equity_database(), exchange))
+        __universe_columns[exchange] = ({code:i for i, code in enumerate(columns.get("Code", []))}, columns)
+    return __universe_columns[exchange]
+
+def __get_universe(exchange:str)->TickerList:
+    '''
+    Returns the tickers of the exchange, loading its universe file on first use.
+    When several tickers of the exchange have the same name, only the last one is kept.
+    '''
+    if exchange not in __universes:
+        columns = __get_universe_columns(exchange)[1]
+        names = columns.get("Name", [])
+        kept = list({name:i for i, name in enumerate(names)}.values())
+        if len(kept) != len(names):
+            columns = {field:[values[i] for i in kept] for field, values in columns.items()}
+        __universes[exchange] = TickerList(exchange, columns.get("Code", []), columns.get("Name", []), columns.get("Isin", []), columns.get("Type", []))
+    return __universes[exchange]
+
+def __get_ticker_index(market:str='')->TickerIndex:
+    '''
+    Returns the search index over the tickers of the market ('' for all markets), only loading the universes it covers.
+    '''
+    if market not in __tickerindexes:
+        exchanges = [exchange for exchange in __get_all_exchanges() if market in ('', exchange)]
+        __tickerindexes[market] = TickerIndex({exchange:__get_universe(exchange) for exchange in exchanges})
+    return __tickerindexes[market]
 
-            
-
-
-def __init_ticker_cache():
-    exchanges = __get_all_exchanges()
-    for exchange in exchanges:
-        if exchange not in __tickercache:
-            __tickercache[exchange] = {}
-        # Load the universe file
-        path = os.path.join(get_equity_database(), exchange)
-        tickers=[]
-        with open(os.path.join(path, "universe.json")) as universefile:
-            tickers=json.load(universefile)
-        for ticker in tickers:
-            __tickercache[exchange][ticker["Name"]] = Ticker(ticker["Code"], exchange, isin=ticker["Isin"], name=ticker["Name"], type=ticker["Type"])
-       
 def __get_all_exchanges():
     return [f.name for f in os.scandir(get_equity_database()) if f.is_dir()]
 
@@ -100,8 +124,9 @@ def get_fundamental_data(full_ticker:str)->FundamentalData:
 
 def get_fx_timeseries(currency:str, datapoint_name:str=DEFAULT_CURRENCY_DATAPOINT ,fill_method=fill.FORWARDFILL, use_cache=True)->TimeSeries:
     try:
-        if use_cache and (currency+"_"+datapoint_name in __cache):
-            return __cache[currency+"_"+datapoint_name]
+        if use_cache:
+            cached = __fxcache.get(currency+"_"+datapoint_name)
+            if cached is not None: return cached
         # read it from the database
         path = os.path.join(get_fx_database(), currency, datapoint_name)
         a = np.load(path+'.npy')
@@ -115,7 +140,7 @@ def get_fx_timeseries(currency:str, datapoint_name:str=DEFAULT_CURRENCY_DATAPOIN
         # Create the time series intance to return
         toreturn:TimeSeries =  TimeSeries(a, start_date.date(), end_date.date(), fill_method)
         if use_cache:
-            __cache[currency+"_"+datapoint_name] = toreturn
+            __fxcache.put(currency+"_"+datapoint_name, toreturn)
         return toreturn
 
     except FileNotFoundError:
@@ -124,30 +149,41 @@ def get_fx_timeseries(currency:str, datapoint_name:str=DEFAULT_CURRENCY_DATAPOIN
 def get_fx(currency:str, fx_date:date, datapoint_name:str=DEFAULT_CURRENCY_DATAPOINT, fill_method=fill.FORWARDFILL, use_cache=True):
     return get_fx_timeseries(currency, datapoint_name, fill_method, use_cache).get(fx_date)
 
+def __load_fx_rates(currency:str)->TimeSeries:
+    # Amounts are converted through USD, which has no rates
+    if (currency == "USD") or (currency not in supported_currencies + supported_crypto_currencies):
+        raise PMException("Could not find time series for currency {currency}".format(currency = currency))
+    return get_fx_timeseries(currency)
+
+def get_fx_engine()->FXEngine:
+    '''
+    Returns the FX engine converting between the supported currencies available in the database.
+    The rates of a currency are only loaded the first time it is converted.
+    '''
+    global __fxengine
+    if __fxengine is None:
+        __fxengine = FXEngine(loader=__load_fx_rates)
+    return __fxengine
+
 def fx_convert(value:np.number, from_currency:str, to_currency:str, date:date)->np.number:
     '''
     convert value from currency from_currency to currency to_currency using the fx rates at date
+    value and date can also be numpy arrays of the same size (values and datetime64 dates)
     '''
     if(from_currency != to_currency):
-        # Value the instrument to USD and then from USD to the target currency
-        value_usd = value
-        if(from_currency != "USD"):
-            value_usd = __convert_to_usd(value, from_currency, date)
-
-        if(to_currency != "USD"):
-            return __convert_usd_to_target(value_usd, to_currency, date)
-        return value_usd
+        return get_fx_engine().convert(value, from_currency, to_currency, date)
     return value
 
 
-def __convert_usd_to_target(value:np.number, target_currency:str, date:date)->np.number:
-    fx = get_fx(target_currency, date)
-    return value * fx
-
-def __convert_to_usd(value:np.number, source_currency:str, date:date)->np.number:
-    # Get the FX rate
-    fx = get_fx(source_currency, date)
-    return value/fx
+def fx_convert_range(values:np.ndarray, from_currency:str, to_currency:str, start_date:date)->np.ndarray:
+    '''
+    Vectorized version of fx_convert.
+    values contains one element per calendar day starting at start_date. Each element is converted from currency from_currency
+    to currency to_currency using the fx rates of its own date.
+    '''
+    if(from_currency != to_currency):
+        return get_fx_engine().convert_range(values, from_currency, to_currency, start_date)
+    return values
 
 
 def get_datapoint(full_ticker:str, datapoint_name:str, date:date)->np.float32:
@@ -168,40 +204,141 @@ def get_timeseries(full_ticker:str, datapoint_name:str, fill_method=fill.FORWARD
     Raises an exception if the time series cannot be loaded. Cannot return None.
     '''
     try:
-        if use_cache and (full_ticker+"_"+datapoint_name in __cache):
-            return __cache[full_ticker+"_"+datapoint_name]
+        if use_cache:
+            cached = __get_cache().get(full_ticker+"_"+datapoint_name)
+            if cached is not None: return cached
         # read it from the database
         (ticker, exchange) = full_ticker.split('.')
-        name = datapoint_name
-        path = os.path.join(get_equity_database(), exchange, ticker, name)
-        a = np.load(path+'.npy')
-        #Read start and end dates
-        path = os.path.join(get_equity_database(), exchange, ticker)
-        with open(os.path.join(path, datapoint_name+".meta")) as metafile:
-            meta = json.load(metafile)
-            start_date = datetime.strptime(meta["base_date"], __date_format)
-            end_date = datetime.strptime(meta["last_date"], __date_format)
+        stored = None
+        store = __get_column_store(exchange)
+        if store != None: stored = store.get(ticker, datapoint_name)
+        if stored != None:
+            (a, start_date, end_date) = stored
+            # Series forward filled when written are returned as read only views, the others are copied by TimeSeries to fill them
+            if (fill_method == fill.FORWARDFILL) and store.is_forward_filled(ticker): fill_method = None
+        else:
+            # Fall back to the data point files of the ticker
+            name = datapoint_name
+            path = os.path.join(get_equity_database(), exchange, ticker, name)
+            a = np.load(path+'.npy')
+            #Read start and end dates
+            path = os.path.join(get_equity_database(), exchange, ticker)
+            meta = read_ticker_meta(path).get(datapoint_name)
+            if meta is None: raise FileNotFoundError(os.path.join(path, datapoint_name))
+            if (fill_method == fill.FORWARDFILL) and meta.get(FORWARD_FILLED, False): fill_method = None
+            start_date = datetime.strptime(meta["base_date"], __date_format).date()
+            end_date = datetime.strptime(meta["last_date"], __date_format).date()
 
         # Create the time series intance to return
-        toreturn:TimeSeries =  TimeSeries(a, start_date.date(), end_date.date(), fill_method)
+        toreturn:TimeSeries =  TimeSeries(a, start_date, end_date, fill_method)
         if use_cache:
-            __cache[full_ticker+"_"+datapoint_name] = toreturn
+            __get_cache().put(full_ticker+"_"+datapoint_name, toreturn)
         return toreturn
 
     except FileNotFoundError:
         raise PMException("Could not find time series for ticker {full_ticker}".format(full_ticker = full_ticker))
 
+def get_panel(full_tickers:list, datapoint_name:str, start_date:date, end_date:date, fill_method=fill.FORWARDFILL, use_cache=True, max_workers:int=8)->tuple[np.ndarray, list]:
+    '''
+    Returns the data point of many tickers aligned on the calendar days from start_date to end_date (both inclusive) as a tuple of:
+    . a (days x tickers) float32 matrix, element [i, j] being the value of the ticker j at start_date + i days
+    . the list of the fully qualified tickers indexing the columns of the matrix
+    Days outside of the coverage of a ticker (before its base date or after its last date), and every day of a ticker missing in the database, are NaN.
+    The time series which are not cached are loaded in parallel by max_workers threads.
+    '''
+    if isinstance(start_date, datetime): start_date = start_date.date()
+    if isinstance(end_date, datetime): end_date = end_date.date()
+    if start_date > end_date: raise PMException(f"Cannot create a panel from {start_date} to {end_date}")
+    full_tickers = list(full_tickers)
+    series = {}
+    if use_cache:
+        for full_ticker in full_tickers:
+            cached = __get_cache().get(full_ticker+"_"+datapoint_name)
+            if cached is not None: series[full_ticker] = cached
+    to_load = [full_ticker for full_ticker in dict.fromkeys(full_tickers) if full_ticker not in series]
+
+    def load(full_ticker:str)->TimeSeries:
+        try:
+            return get_timeseries(full_ticker, datapoint_name, fill_method, use_cache=False)
+        except PMException:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for full_ticker, ts in zip(to_load, executor.map(load, to_load)):
+            if ts is None: continue
+            series[full_ticker] = ts
+            if use_cache: __get_cache().put(full_ticker+"_"+datapoint_name, ts)
+
+    panel = np.full(((end_date - start_date).days + 1, len(full_tickers)), np.nan, dtype=np.float32)
+    for column, full_ticker in enumerate(full_tickers):
+        if full_ticker not in series: continue
+        ts:TimeSeries = series[full_ticker]
+        # Copy the days covered by both the panel and the time series
+        first = max(start_date, ts.get_start_date())
+        last = min(end_date, ts.get_end_date())
+        if first > last: continue
+        panel[(first - start_date).days:(last - start_date).days + 1, column] = ts.get_range(first, last)
+    return (panel, full_tickers)
+
+def __get_cache()->TimeSeriesCache:
+    global __cache
+    if __cache is None:
+        size = get_config("TIMESERIES_CACHE_SIZE_MB")
+        __cache = TimeSeriesCache((int(size) if len(size) != 0 else DEFAULT_CACHE_SIZE_MB)*1024*1024)
+    return __cache
+
+def pin(full_ticker:str, datapoint_name:str):
+    '''
+    Keeps the time series of the data point in the cache once loaded, whatever the cache budget
+    '''
+    __get_cache().pin(full_ticker+"_"+datapoint_name)
+
+def unpin(full_ticker:str, datapoint_name:str):
+    __get_cache().unpin(full_ticker+"_"+datapoint_name)
+
+def get_cache_stats()->dict:
+    '''
+    Returns the statistics of the time series cache and of the fx cache
+    '''
+    return {"timeseries":__get_cache().get_stats(), "fx":__fxcache.get_stats()}
+
+def __get_column_store(exchange:str)->ColumnStore:
+    '''
+    Returns the column store of the exchange, or None if the exchange does not have one.
+    The store is opened (memory mapped) once per exchange.
+    '''
+    if exchange not in __stores:
+        location = os.path.join(get_equity_database(), exchange)
+        __stores[exchange] = ColumnStore(location) if ColumnStore.exists(location) else None
+    return __stores[exchange]
+
 def get_ticker(full_ticker:str)->Ticker:
     '''
     Get the ticker from the fully qualified ticker
     '''
+    ticker = __tickers.get(full_ticker)
+    if ticker is None:
+        (code, exchange) = full_ticker.split('.')
+        td = __get_ticker_data(code, exchange)
+        ticker = Ticker(type=td['Type'], code=td['Code'], isin=td['Isin'], name=td['Name'], country=td['Country'], exchange=td['Exchange'], currency=td['Currency'])
+        __tickers[full_ticker] = ticker
+    return ticker
+
+def __get_ticker_data(code:str, exchange:str)->dict:
+    '''
+    Returns the id file structure of the ticker from the universe of its exchange, or from its id file if it is not indexed (yet)
+    '''
+    try:
+        (rows, columns) = __get_universe_columns(exchange)
+    except FileNotFoundError:
+        (rows, columns) = ({}, {})
+    row = rows.get(code)
+    if row != None:
+        return {field:values[row] for field, values in columns.items()}
     #read ticker details from datbase
-    (ticker, exchange) = full_ticker.split('.')
-    idfile = os.path.join(get_equity_database(), exchange, ticker, "id")
+    idfile = os.path.join(get_equity_database(), exchange, code, "id")
     with open(idfile) as idf:
-        td = json.load(idf)
-    return Ticker(type=td['Type'], code=td['Code'], isin=td['Isin'], name=td['Name'], country=td['Country'], exchange=td['Exchange'], currency=td['Currency'])
-
+        return json.load(idf)
 
 class UnitTestData(unittest.TestCase):
     def test_get_timeseries(self):
@@ -227,6 +364,7 @@ class UnitTestData(unittest.TestCase):
         self.assertEqual(t.isin, 'US3825501014')
         self.assertEqual(t.name, 'Goodyear Tire & Rubber Co')
         self.assertEqual(t.type, 'Common Stock')
+        self.assertIs(get_ticker('GT.US'), t)
 
     def test_multiple_search(self):
         self.assertGreaterEqual(len(search("MICRO")), 46)
@@ -248,10 +386,48 @@ class UnitTestData(unittest.TestCase):
     def test_search_isin(self):
         self.assertEqual(len(search_isin("US55354G1004")), 1)
 
+    def test_ranked_search(self):
+        tickers = search("micro", ranked=True, limit=2)
+        self.assertLessEqual(len(tickers), 2)
+        self.assertTrue(tickers[0].name.lower().startswith("micro"))
+        self.assertEqual(search_code("MSFT", "US")[0].code, "MSFT")
+
     def test_crypto(self):
         self.assertAlmostEqual(get_fx_timeseries("BTC").get(date(2022,11,9)), 6.2969199843932e-05, delta = 1e-05)
         self.assertAlmostEqual(get_fx_timeseries("ETH").get(date(2022,11,9)), 1/1100, delta = 0.001)
 
+    def test_fx_engine(self):
+        init()
+        engine = get_fx_engine()
+        self.assertEqual(engine.get_currencies(), [])
+        chf = get_fx("CHF", date(2022,11,9))
+        self.assertAlmostEqual(fx_convert(1, "USD", "CHF", np.datetime64('2022-11-09')), chf, delta=1e-6)
+        self.assertEqual(engine.get_currencies(), ["CHF"])
+        # The engine is created again with the rates of the database
+        init()
+        self.assertIsNot(get_fx_engine(), engine)
+
+    def test_cache_stats(self):
+        before = get_cache_stats()["timeseries"]
+        get_timeseries('GT.US', 'close')
+        get_timeseries('GT.US', 'close')
+        after = get_cache_stats()["timeseries"]
+        self.assertGreaterEqual(after["hits"], before["hits"]+1)
+        self.assertLessEqual(after["bytes"], after["max_bytes"])
+
+    def test_get_panel(self):
+        (panel, tickers) = get_panel(['MSFT.US', 'LCTU.US', 'STLA.PA', 'NOTHERE.US'], 'close', date(2021,4,1), date(2021,4,30))
+        self.assertEqual(panel.shape, (30, 4))
+        self.assertEqual(panel.dtype, np.float32)
+        self.assertEqual(tickers, ['MSFT.US', 'LCTU.US', 'STLA.PA', 'NOTHERE.US'])
+        self.assertTrue(np.array_equal(panel[:,0], get_timeseries('MSFT.US', 'close').get_range(date(2021,4,1), date(2021,4,30))))
+        self.assertTrue(np.isnan(panel[:,3]).all())
+        # LCTU starts on April 8th 2021
+        ts = get_timeseries('LCTU.US', 'close')
+        days = (ts.get_start_date() - date(2021,4,1)).days
+        self.assertTrue(np.isnan(panel[:days,1]).all())
+        self.assertFalse(np.isnan(panel[days:,1]).any())
+
     def test_cut2dates(self):
         ts = get_timeseries('C40.PA', "adjusted_close")
         ts2=ts.cut2dates(date(2022,1,1), ts.get_end_date())
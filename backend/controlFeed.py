@@ -2,14 +2,19 @@ import argparse
 import json
 import logging
 import logging.config
-from multiprocessing import Process
-from feeder import run_feeder_batch
+import os
+import queue
+import time
+from datetime import date
+from multiprocessing import Process, Queue
+from feeder import run_feeder_batch, get_failed_tickers, get_batch_load_report, open_checkpoint_journal, run_feeder_worker, split_in_chunks, build_column_stores
+from config import get_config, init_config
 from fdfeed import run_fundamental_data_feeder_batch
 
 logging.config.fileConfig("config/logging.conf")
 __logger = logging.getLogger('controller')
 
-def run_batch(config:dict, configfile, batch_definition_file, load_type, debug_level)->Process:
+def run_batch(config:dict, configfile, batch_definition_file, load_type, debug_level, retry_failures:bool=False)->Process:
     '''
     Spawns a batch process and return the process spawned
     '''
@@ -17,7 +22,7 @@ def run_batch(config:dict, configfile, batch_definition_file, load_type, debug_l
     __logger.info("Exchanges covered:%s", [exchange['Code'] for exchange in config['Exchanges']])
     #spawn the feeder with the list of exchanges
     if(load_type == "price"):
-        p = Process(target=run_feeder_batch, args=(config['Batch_Name'],configfile, batch_definition_file))
+        p = Process(target=run_feeder_batch, args=(config['Batch_Name'],configfile, batch_definition_file, retry_failures))
     if(load_type == "fundamental_data"):
         p = Process(target=run_fundamental_data_feeder_batch, args=(config['Batch_Name'],configfile, batch_definition_file, debug_level))
     p.start()
@@ -34,6 +39,8 @@ def process_arguments():
     parser.add_argument('--feederconfig', '-f', nargs='?', action="store",type=str, help="Use the feeder configuration file specified when spawning the feeders.")
     parser.add_argument('--load', '-l', nargs='?', action="store",type=str, help="Load type. Type can be price|fundamental_data. Default is price")
     parser.add_argument('--batch', '-b', nargs='?', action="store",type=str, help="Loads the batch specified.")
+    parser.add_argument('--retry-failures', action="store_true", help="Only reloads the tickers which failed in the last run of each batch (price load only)")
+    parser.add_argument('--workers', '-w', nargs='?', action="store",type=int, const=0, help="Price load only: runs this number of worker processes (FEEDER_WORKERS if no number is given) pulling chunks of tickers from a shared queue instead of one process per batch")
     parser.add_argument('--version', action='version', version='%(prog)s 0.1')
     args=parser.parse_args()
     debug_level = None
@@ -58,28 +65,109 @@ def process_arguments():
         load_type = args.load 
     if hasattr(args,"batch") and (args.batch != None): 
         batch = args.batch 
-    return config_file,feeder_config_file, load_type,debug_level, batch
+    return config_file,feeder_config_file, load_type,debug_level, batch, args.retry_failures, args.workers
 
-def run_control(config:list, configfile, batch_definition_file, load_type, debug_level):
+def run_control(config:list, configfile, batch_definition_file, load_type, debug_level, retry_failures:bool=False):
     #run each batch on the current machine
     processes=[]
+    loaded=[]
     for configuration in config:
+        if retry_failures and (load_type == "price"):
+            # Only the batches with failures are run again
+            failed = get_failed_tickers(configuration['Batch_Name'], configfile)
+            if len(failed) == 0:
+                __logger.info("No failure to retry for batch %s", configuration['Batch_Name'])
+                continue
+            __logger.info("Retrying %d failed tickers of batch %s", len(failed), configuration['Batch_Name'])
         __logger.info("Spawning batch process...")
-        p = run_batch(configuration, configfile, batch_definition_file, load_type, debug_level)
+        p = run_batch(configuration, configfile, batch_definition_file, load_type, debug_level, retry_failures)
         __logger.info("Batch process spawn %s", str(p))
         processes.append(p)
+        loaded.append(configuration)
 
     #wait for each process to terminate
     for process in processes:
         process.join()
         __logger.info("Process %s terminated with exit code %d", str(process),process.exitcode)
 
+    #update the column stores once, the exchanges being split across batches loaded at the same time
+    if (load_type == "price") and (len(processes) > 0):
+        build_column_stores(list(dict.fromkeys([exchange['Code'] for configuration in loaded for exchange in configuration['Exchanges']])), configfile)
+
+    #report the predicted and actual runtime of each batch
+    if load_type == "price":
+        for (batch_name, load_time, predicted, actual) in get_batch_load_report([configuration['Batch_Name'] for configuration in config], configfile):
+            __logger.info("Batch %s started at %s: predicted %s, actual %s", batch_name, load_time,
+                "{0:.0f}s".format(predicted) if predicted != None else "unknown", "{0:.0f}s".format(actual) if actual != None else "unknown (interrupted)")
+
+def run_dynamic_control(config:list, configfile, workers:int):
+    '''
+    Loads the exchanges of all the batches with workers processes pulling chunks of FEEDER_CHUNK_SIZE tickers from a shared queue,
+    so that the load is balanced whatever the size and latency of each exchange.
+    The progress reported by the workers is aggregated and logged each time a chunk is loaded.
+    A chunk being loaded by a worker which dies is put back in the queue.
+    '''
+    init_config(None, configfile)
+    if workers == 0: workers = int(get_config("FEEDER_WORKERS") or os.cpu_count())
+    chunk_size = int(get_config("FEEDER_CHUNK_SIZE") or 500)
+    chunks = split_in_chunks([exchange for configuration in config for exchange in configuration['Exchanges']], chunk_size)
+    total_tickers = sum([chunk[1] for chunk in chunks if chunk[1] != -1])
+    __logger.info("%d chunks of at most %d tickers (%d tickers) to load with %d workers", len(chunks), chunk_size, total_tickers, workers)
+    # The journal is opened before the workers so they all resume the same run, each one recording its tickers in its own part
+    journal_name = "Workers"
+    journal = open_checkpoint_journal(journal_name, configfile)
+    if journal.resumed: __logger.info("Resuming the run: %d tickers done, %d failed", len(journal.get_done()), len(journal.get_failed()))
+    todo = Queue()
+    progress = Queue()
+    for chunk in chunks: todo.put(chunk)
+    processes = {}
+    for i in range(workers):
+        worker_name = "Worker_{n:02d}".format(n=i+1)
+        processes[worker_name] = Process(target=run_feeder_worker, args=(worker_name, configfile, todo, progress, False, date.today(), journal_name), name=worker_name)
+        processes[worker_name].start()
+    started = time.monotonic()
+    running = {} # worker name, chunk being loaded
+    done = 0
+    tickers = 0
+    errors = 0
+    while done < len(chunks):
+        try:
+            message = progress.get(timeout=10)
+        except queue.Empty:
+            # Put back the chunks of the workers which died
+            for worker_name, process in processes.items():
+                if (not process.is_alive()) and (worker_name in running):
+                    __logger.error("Worker %s terminated with exit code %s while loading chunk %s, putting the chunk back in the queue", worker_name, str(process.exitcode), str(running[worker_name]))
+                    todo.put(running.pop(worker_name))
+            if not any([process.is_alive() for process in processes.values()]):
+                __logger.error("All workers terminated, %d chunks were not loaded", len(chunks) - done)
+                break
+            continue
+        if message[0] == "started":
+            running[message[1]] = message[2]
+            continue
+        (_, worker_name, chunk, processed, failed, elapsed) = message
+        running.pop(worker_name, None)
+        done += 1
+        tickers += processed
+        errors += failed
+        __logger.info("%s loaded %s part %d (%d tickers, %d errors) in %.1fs. Progress: %d/%d chunks, %d/%d tickers, %d errors, %.0fs elapsed",
+            worker_name, chunk[0], chunk[2], processed, failed, elapsed, done, len(chunks), tickers, total_tickers, errors, time.monotonic() - started)
+    for _ in processes: todo.put(None)
+    for process in processes.values():
+        process.join()
+        __logger.info("Process %s terminated with exit code %s", str(process), str(process.exitcode))
+    build_column_stores(list(dict.fromkeys([chunk[0] for chunk in chunks])), configfile)
+
 if __name__ == '__main__':
     #read json config file
-    conf,feeder_conf, load_type,debug_level,batch = process_arguments()
+    conf,feeder_conf, load_type,debug_level,batch,retry_failures,workers = process_arguments()
     with open(conf, "r") as config_file:
         config = json.load(config_file)
     if(batch != None):
         # Just retain the batch to process, not the set of batches specified in the configuration file
         config = [conf for conf in config if conf["Batch_Name"] == batch]
-    run_control(config, feeder_conf, conf, load_type, debug_level)
+    if (workers != None) and (load_type == "price"):
+        run_dynamic_control(config, feeder_conf, workers)
+    else:
+        run_control(config, feeder_conf, conf, load_type, debug_level, retry_failures)
@@ -1,6 +1,9 @@
 import json
+import os
+import statistics
 from config import process_arguments
-from config import get_config
+from config import get_config, init_config
+from loadstats import connect, get_ticker_costs, estimate_costs, plan_batches
 import logging
 import logging.config
 from eod import EodHistoricalData
@@ -8,14 +11,13 @@ from eod import EodHistoricalData
 logging.config.fileConfig("config/logging.conf")
 __logger = logging.getLogger('controller')
 
-class ExchangeNotAssigned(Exception): pass
-class AllocationError(Exception): pass
-
 '''
 Creates the json configuration file of the controlFeed
 
 Without any argument, the configuration file created will be based on the entire today's universe.
 The biggest exchanges will be split according to the configuration file 
+The exchanges (or parts) are then allocated to the batches according to their predicted load time, using the durations of the past loads of their tickers
+recorded by the feeders in the load statistics database (FEEDER_LOAD_STATS_DB). Tickers never loaded cost the median duration of the loaded ones.
 
 We can provide the -e or --exchanges argument to restrict the universe to the list of exchanges provided.
 We can also provide the -c or --config argument to specify a custom configuration file.
@@ -30,86 +32,27 @@ def generate_exchange_list(client):
     return exchanges
 
 
-def __fillbucket(bucket_number:int, exchanges_remaining:list, buckets, buckets_size):
-    '''
-    Fills in the bucket identified with bucket_number (0-based) with one exchang
-    The exchange chosen will be the biggest fitting in the bucket
-    If the smallest exchange is bigger when the bucket remaining size, an exeption will be thrown since it would mean the bucket is too small
-
-    Parameters:
-    bucket_number: Identifies the bucket to be filled by one exchange
-    exchanges_remaining: List of remaining exchanges waiting to be assigned a bucket. This is an output parameter since the algorithm will remove the exchange allocated to a bucket from the list.
-    buckets: List of dictionaries containing:
-        . Remaining_size: size remaining in the bucket
-        . Exchanges: List of exchanges. 
-    This is an output parameter since the list of bucket will be modified with the exchange allocated into a bucket.
-    
-    buckets_batch_size: The initial size of each bucket
-    '''
-    #get the current list of exchanges of the bucket
-    if buckets[bucket_number] == None: 
-        buckets[bucket_number]={}
-        buckets[bucket_number]['Batch_Name'] = 'Batch_{n:02d}'.format(n=bucket_number+1)
-        buckets[bucket_number]['Remaining_size'] = buckets_size
-        buckets[bucket_number]['Exchanges'] = []
-    exchanges_in_bucket = buckets[bucket_number]
-        
-    #get the remaining size of the bucket
-    remaining_size = buckets[bucket_number]['Remaining_size']
-    #Find the biggest exchange smaller than remaining_size
-    found = False
-    for exchange in exchanges_remaining:
-        if exchange['Size'] <= remaining_size:
-            found = True
-            #Assign the exchange to the bucket
-            exchanges_in_bucket['Exchanges'].append(exchange)
-            exchanges_in_bucket['Remaining_size']-=exchange['Size']
-            #Remove the exchange from the list of remaining exchanges to be assigned
-            exchanges_remaining.remove(exchange)
-            __logger.debug("Exchange %s (%d tickers) assigned to bucket %d", exchange['Code'],exchange['Size'], bucket_number)
-            __logger.debug("%d exchanges remain to be assigned", len(exchanges_remaining))
-            break
-    if not found:
-        #We could not assign an exchange to the bucket
-        raise ExchangeNotAssigned("Bucket {bucket_index} could not be given an exchange to process. Its remaining size is {remaining_size} and the smallest exchange size is {smallest_exchange_size} -,> {smallest_exchange} exchange"
-        .format(bucket_index=bucket_number, remaining_size=remaining_size, smallest_exchange_size=exchanges_remaining[len(exchanges_remaining)-1]['Size'], smallest_exchange=exchanges_remaining[len(exchanges_remaining)-1]['Code']))
-
-        
-
-
-def __split_exchanges(batch_number:int, exchange_stats:list):
+def __predict_load_times(exchange_stats:list, symbols:dict, concurrency:int):
     '''
-    Algorithm splitting the ticker universes into batch_number batches
-    Returns a list of batch_number elements with each element being dictionary with:
-    .Batch_Name being the name of the batch
-    .Remaining_Size number of tickers remaining to add in the element until it is full 
-    .Exchanges being the list of echanges in that batch
+    Adds the Predicted_Seconds of each exchange (or part) of exchange_stats: the sum of the last load durations of its tickers, divided by the number of
+    tickers loaded concurrently by a feeder.
+    symbols is a dictionary of (exchange code, list of ticker codes)
     '''
-    universe_size = sum([stat['Size'] for stat in exchange_stats])
-    __logger.debug("Total universe size:%d", universe_size)
-    batch_size = universe_size / batch_number * 1.25 #25% buffer
-    buckets = [None]*batch_number
-    buckets_size = int(batch_size)
-    exchanges = exchange_stats.copy()
-    # Sort the exchanges from the biggest to the smallest because we want to allocate the biggest first
-    exchanges.sort(key=lambda e: e['Size'], reverse=True)
-    bucket_number = -1
-    nextb = 0    
-    while len(exchanges) >0:
-        #Try to fill the bucket with an exchange.
-        #If not possible, try the next bucket
-        try:
-            bucket_number+=1
-            __fillbucket(bucket_number%batch_number, exchanges, buckets, buckets_size)
-            nextb = 0        
-        except ExchangeNotAssigned as ena:
-            nextb +=1
-            if(nextb >=batch_number):
-                #We could not allocate the remaining exchanges
-                raise AllocationError("Could not allocate the following exchanges:" + str(exchanges)+". Underlying cause:"+str(ena))
-    #All buckets allocated
-    __logger.info("All %d exchanges have been allocated within %d buckets", len(exchange_stats), batch_number)
-    return buckets
+    location = get_config("FEEDER_LOAD_STATS_DB")
+    if len(location) == 0: location = os.path.join(get_config("LOG_FILE_LOC"), "loadstats.db")
+    conn = connect(location)
+    costs = {code:get_ticker_costs(conn, code) for code in symbols}
+    conn.close()
+    all_costs = [cost for exchange_costs in costs.values() for cost in exchange_costs.values()]
+    # Exchanges never loaded cost the median of all the tickers loaded
+    default = statistics.median(all_costs) if len(all_costs) > 0 else 1.0
+    for e in exchange_stats:
+        codes = symbols[e['Code']][e['Start']:e['Start']+e['Size']]
+        exchange_default = None if len(costs[e['Code']]) > 0 else default
+        e['Predicted_Seconds'] = sum(estimate_costs(codes, costs[e['Code']], exchange_default)) / concurrency
+        __logger.info("Exchange %s part %d: %d tickers, %d with a recorded load time, predicted load time %.0fs", e['Code'], e['Part'], len(codes),
+            len([code for code in codes if code in costs[e['Code']]]), e['Predicted_Seconds'])
+
 
 def __split_one_exchange(ex, parts):
     '''
@@ -145,16 +88,18 @@ def __split_exchange(exchange_stats:list, exchange_code_to_split:str, parts:int)
 
 
 el, configfile,up = process_arguments()
-API_KEY = get_config("EOD_API_KEY", configfile=configfile)
+init_config(None, configfile)
+API_KEY = get_config("EOD_API_KEY")
 client = EodHistoricalData(API_KEY)
 #To generate the list of exchanges, invoke generate_exchange_list(client)
 #exchanges = ['US', 'LSE', 'NEO', 'TO', 'BE', 'F', 'STU', 'HA', 'XETRA', 'HM', 'MU', 'DU', 'MI', 'VI', 'LU', 'PA', 'BR', 'AS', 'LS', 'VX', 'SW', 'MC', 'IR', 'ST', 'OL', 'CO', 'HE', 'IC', 'PR', 'TA', 'HK', 'KQ', 'KO', 'WAR', 'BUD', 'PSE', 'SG', 'BSE', 'KAR', 'SR', 'TSE', 'SN', 'BK', 'JSE', 'SHG', 'NSE', 'AT', 'SHE', 'AU', 'JK', 'CM', 'VN', 'KLSE', 'RO', 'SA', 'BA', 'MX', 'IL', 'ZSE', 'BOND', 'TWO', 'EUBOND', 'LIM', 'GBOND', 'MONEY', 'EUFUND', 'MCX', 'FOREX', 'TW', 'IS', 'INDX', 'CC', 'COMM']
 # For each exchange, get the size of the universe
-exchanges = get_config("SPLIT_EXCHANGES", configfile=configfile)
+exchanges = get_config("SPLIT_EXCHANGES")
 exchanges = exchanges.split(',')
 if len(exchanges) == 0:
     exchanges = [e['Code'] for e in generate_exchange_list(client)]
 exchange_stats=[]
+symbols_by_exchange = {}
 for exchange in exchanges:
     # Get the size of the universe
     try:
@@ -165,6 +110,7 @@ for exchange in exchanges:
         exchange_stat['Part']=1 #not plit by default
         exchange_stat['Start']=0
         exchange_stat['Size'] = len(symbols)
+        symbols_by_exchange[exchange] = [symbol['Code'] for symbol in symbols]
         exchange_stats.append(exchange_stat)
     except Exception as e:
         __logger.error("Error for %s -> %s", exchange, str(e))
@@ -173,9 +119,12 @@ for exchange in exchanges:
 exchanges_codes_to_split = exchanges
 for exchange_code_to_split in exchanges_codes_to_split:
     #How many parts ?
-    parts = get_config("SPLIT_" + exchange_code_to_split.strip(), configfile=configfile)
+    parts = get_config("SPLIT_" + exchange_code_to_split.strip())
     __split_exchange(exchange_stats, exchange_code_to_split, int(parts))
 
-bs = __split_exchanges(int(get_config("SPLIT_BATCHES", configfile=configfile)), exchange_stats)
+__predict_load_times(exchange_stats, symbols_by_exchange, max(int(get_config("FEEDER_CONCURRENCY") or 1), 1))
+bs = plan_batches(exchange_stats, int(get_config("SPLIT_BATCHES")))
+for b in bs:
+    __logger.info("%s: %d exchanges (or parts), predicted load time %.0fs", b['Batch_Name'], len(b['Exchanges']), b['Predicted_Seconds'])
 with open("config/controller.json","w") as config_file:
     json.dump(bs, config_file)
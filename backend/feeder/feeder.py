@@ -1,5 +1,5 @@
-from genericpath import exists
 import glob
+import io
 import os
 import unittest
 from eod import EodHistoricalData
@@ -8,13 +8,25 @@ import logging.config
 import logging.handlers
 import json
 import math
+import queue
 import shutil
+import tempfile
+import threading
+import time
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from operator import itemgetter
 import numpy as np
 from config import DEFAULT_CONFIG_FILE, DEFAULT_LOGGING_CONFIG_FILE, get_config, process_arguments, init_config
 from exceptions import FeederException
 from feedutils import get_ticker_slice
+from ColumnStore import ColumnStore, DATAPOINTS
+from RateLimiter import RateLimiter
+from CheckpointJournal import CheckpointJournal
+from loadstats import connect as connect_load_stats, start_batch_load, end_batch_load, start_exchange_load, end_exchange_load, record_ticker_loads, get_batch_loads, get_ticker_costs
+from tickermeta import FORWARD_FILLED, get_last_coverage_date, read_coverage, read_ticker_meta, update_coverage, write_ticker_meta
+from analytics import forward_fill
 
 
 __logger = None
@@ -168,16 +180,17 @@ def __display_stats_tickers(stats, logger):
             logger.info("{0:15} -> {1}".format(ticker['Code'],ticker['Error']))
 
 
-def __update_meta_data_file(filename, data_point):
+def __merge_meta_data(previous:dict, data_point)->tuple:
     '''
-    Updates the meta data on the file database for the data point data_file
+    Merges the meta data of the data point with its previous meta data in the database (None if there is no data yet)
 
     Returns a tuple:
     The start date of the data point in the database before the update
     The end date of the data point in the database before the update
     The start date of the data point in the database after the update
     The end date of the data point in the database after the update
-    or (None, None, start date after update, end date after update) if the file did not exists and was created by this function.
+    The meta data to commit once the data file is updated
+    or (None, None, start date after update, end date after update, meta data) if there is no data yet.
 
     '''
  
@@ -188,23 +201,14 @@ def __update_meta_data_file(filename, data_point):
     s['last_date'] = data_point['last_date']
     s['name'] = data_point['name']
 
-    previous_datapoint_base_date = None
-    previous_datapoint_last_date = None
-    toupdate = s
-    # Read the previous meta data file if it does exist
-    if exists(filename):
-        with open(filename,'r') as metafile:
-            toupdate = json.loads(metafile.read())
-            previous_datapoint_base_date = datetime.datetime.strptime(toupdate['base_date'], DATE_FORMAT).date()
-            previous_datapoint_last_date = datetime.datetime.strptime(toupdate['last_date'], DATE_FORMAT).date()
-            if new_datapoint_base_date < previous_datapoint_base_date: toupdate['base_date'] = s['base_date']
-            if new_datapoint_last_date > previous_datapoint_last_date: toupdate['last_date'] = s['last_date']
-    with open(filename,'w') as metafile:
-        json.dump(toupdate, metafile)
-    if previous_datapoint_base_date != None:
-        return (previous_datapoint_base_date, previous_datapoint_last_date, min(new_datapoint_base_date, previous_datapoint_base_date), max(new_datapoint_last_date, previous_datapoint_last_date))
-    else:
-        return (None, None, new_datapoint_base_date, new_datapoint_last_date)
+    if previous == None:
+        return (None, None, new_datapoint_base_date, new_datapoint_last_date, s)
+    toupdate = dict(previous)
+    previous_datapoint_base_date = datetime.datetime.strptime(toupdate['base_date'], DATE_FORMAT).date()
+    previous_datapoint_last_date = datetime.datetime.strptime(toupdate['last_date'], DATE_FORMAT).date()
+    if new_datapoint_base_date < previous_datapoint_base_date: toupdate['base_date'] = s['base_date']
+    if new_datapoint_last_date > previous_datapoint_last_date: toupdate['last_date'] = s['last_date']
+    return (previous_datapoint_base_date, previous_datapoint_last_date, min(new_datapoint_base_date, previous_datapoint_base_date), max(new_datapoint_last_date, previous_datapoint_last_date), toupdate)
 
 def __update_data_vector(before_datavec:np.ndarray, before_start_date, before_end_date, new_data_vec, new_start_date, new_end_date):
     #Check how many days prepend at the beginning of the data vector
@@ -223,148 +227,280 @@ def __update_data_vector(before_datavec:np.ndarray, before_start_date, before_en
     return newvec
     
 
-
-def __update_data_file(filename, data_point:np.ndarray, before_start_date, before_end_date, new_start_date, new_end_date):
+def __write_data_file_in_place(filename, data_point:np.ndarray, offset:int)->bool:
+    '''
+    Writes data_point in the existing data file from the element offset, extending the file (with zeros if offset is after its end) if needed.
+    Only the new values and the header are written: the values are written first and the header with the new size last, so an interrupted write
+    leaves a file with its previous size (any extra value after the end being ignored).
+    Returns False, without writing anything, if the file cannot be updated in place (its new header would not fit in the space of the old one).
+    '''
+    with open(filename, 'r+b') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0): (shape, fortran_order, dtype) = np.lib.format.read_array_header_1_0(f)
+        elif version == (2, 0): (shape, fortran_order, dtype) = np.lib.format.read_array_header_2_0(f)
+        else: return False
+        data_offset = f.tell()
+        if (len(shape) != 1) or dtype.hasobject: return False
+        size = max(shape[0], offset + data_point.size)
+        header = io.BytesIO()
+        d = {'descr':np.lib.format.dtype_to_descr(dtype), 'fortran_order':fortran_order, 'shape':(size,)}
+        if version == (1, 0): np.lib.format.write_array_header_1_0(header, d)
+        else: np.lib.format.write_array_header_2_0(header, d)
+        if len(header.getvalue()) != data_offset: return False
+        if offset > shape[0]:
+            f.seek(data_offset + shape[0]*dtype.itemsize)
+            f.write(np.zeros(offset - shape[0], dtype).tobytes())
+        f.seek(data_offset + offset*dtype.itemsize)
+        f.write(data_point.astype(dtype).tobytes())
+        f.flush()
+        f.seek(0)
+        f.write(header.getvalue())
+    return True
+
+def __seed_forward_fill(filename, data_point:np.ndarray, offset:int)->tuple:
+    '''
+    Forward fills the values to write from the element offset of a forward filled data file, the leading missing values (and the days between the end
+    of the file and offset) taking the value stored before offset.
+    Returns a tuple of the values to write and the element from which to write them.
+    '''
+    stored = np.load(filename, mmap_mode='r')
+    start = min(offset, stored.shape[0])
+    if start == 0: return (forward_fill(data_point), offset)
+    values = np.zeros(offset - start + 1 + data_point.size, dtype=data_point.dtype)
+    values[0] = stored[start-1]
+    values[offset - start + 1:] = data_point
+    return (forward_fill(values)[1:], start)
+
+def __update_data_file(filename, data_point:np.ndarray, before_start_date, before_end_date, new_start_date, new_end_date, fill_gaps:bool=False, filled:bool=False)->str:
+    '''
+    Writes the new values of the data point in its data file.
+    Appends (or overwrites) after the start of the file are written in place. Other updates are staged in a new file, whose name is returned
+    for the caller to rename it when committing the update. Returns None if there is nothing to rename.
+    If fill_gaps, the missing values are forward filled: only the new values if the file is already filled, the whole file otherwise.
+    '''
     #Check if file exists
     if os.path.exists(filename):
-        #Update the file (read->add->store)
+        #Appending (or overwriting) after the start of the file only writes the new values
+        if (new_start_date >= before_start_date) and (filled or not fill_gaps):
+            (values, offset) = (data_point, (new_start_date - before_start_date).days)
+            if fill_gaps: (values, offset) = __seed_forward_fill(filename, data_point, offset)
+            if __write_data_file_in_place(filename, values, offset): return None
+        #Prepending rewrites the file (read->add->store)
         before_datavec = np.load(file=filename)
         new_data_vec = __update_data_vector(before_datavec, before_start_date, before_end_date, data_point, new_start_date, new_end_date)
-        #deletes the previous file to write the new one
-        os.remove(filename)
-        np.save(filename, new_data_vec)
     else:
-        # Create the numpy array
-        np.save(filename, data_point)
-
-
-
-def __feed_data_file(exchange:str, ticker:str, data_point:dict):
-    '''
-    Creates (and creates only, does not support update) the data point file in the DB
+        new_data_vec = data_point
+    if fill_gaps: forward_fill(new_data_vec)
+    with open(filename+".tmp", 'wb') as f:
+        np.save(f, new_data_vec)
+    return filename+".tmp"
 
-    Arguments:
-    . exchange: Exchange code
-    . ticker: ticker code (not fully qualified with the exchange)
-    . full_ticker: Fully qualified ticker 
-    . data_point: dict containing the fields of the data points (name, data, base_date, last_date)
-    '''
-    #Check if file exists
-    db_loc = get_config('DB_LOCATION')
-    exchange_loc = os.path.join(db_loc, 'EQUITIES', exchange)
-    ticker_loc = os.path.join(exchange_loc, ticker)
-    meta_loc = os.path.join(ticker_loc,data_point['name']+".meta")
-    data_loc = os.path.join(ticker_loc,data_point['name']+".npy")
-    start_date = data_point['base_date']
-    end_date = data_point['last_date']
-    before_start_date, before_end_date, after_start_date, after_end_date = __update_meta_data_file(meta_loc,data_point)
-    __update_data_file(data_loc,data_point['data'], before_start_date, before_end_date, datetime.datetime.strptime(start_date, DATE_FORMAT).date(), datetime.datetime.strptime(end_date, DATE_FORMAT).date())
-    
 
-def __get_eod_field(prices:list, base_date:str, field_name:str, type:np.dtype, as_of_date:date)->np.ndarray:
-    '''
-    returns a ndarray containing the data point values.
-    There is one element per calendar date from the base date to the as_of_date
+def __pack_eodprices(prices:list, as_of_date:date, padded:bool=False)->tuple:
     '''
-    base_date = datetime.date.fromisoformat(base_date)
-    to_date = min(date.fromisoformat(prices[len(prices)-1]['date']), as_of_date)
-    number_of_elements = to_date - base_date 
-    toreturn = np.zeros(number_of_elements.days+1, type)
-    for price in prices:
-        dp_date = datetime.date.fromisoformat(price['date'])
-        index = (dp_date - base_date).days
-        if (index > number_of_elements.days): break
-        toreturn[index]= np.float32(price[field_name])
-    return toreturn
-
-def __pack_datapoint(dp:dict,fieldname:str,prices:list, as_of_date:date):
-    '''
-    Update the data point dictionary dp by adding the following keys:
-    
+    Packs the prices [{date,open,high,low,close,adjusted_close,volume}] (sorted by date) in a single pass.
+    If padded is True, the prices are known to be complete up to as_of_date and the data points run up to it.
+    Returns a tuple:
     .base_date: The date of the oldest data point of the time series
-    .last_date: The date of the most recent data point
-    .name: The name of the field
-    .data: a numpy array containing the data time series. Empty values are 0.0.
-
-    Returns the dp dictionary containing the updated data point
+    .last_date: The date of the most recent data point (at most as_of_date), or as_of_date if padded
+    .data: a float32 numpy array with one row per data point of DATAPOINTS and one column per calendar date from the base date to the last date.
+    Empty values are 0.0.
     '''
-    dp['base_date']=prices[0]['date']
-    dp['last_date']=date.strftime(min(date.fromisoformat(prices[len(prices)-1]['date']), as_of_date), DATE_FORMAT)
-    dp['name'] = fieldname
-    dp['data'] = __get_eod_field(prices, dp['base_date'], fieldname, np.float32, as_of_date)
-    return dp
+    dates = np.array([price['date'] for price in prices], dtype='datetime64[D]')
+    last_date = np.datetime64(as_of_date, 'D') if padded else min(dates[-1], np.datetime64(as_of_date, 'D'))
+    index = (dates - dates[0]).astype(np.int64)
+    number_of_elements = int((last_date - dates[0]).astype(np.int64)) + 1
+    # Prices after the as of date are ignored
+    kept = index < number_of_elements
+    values = np.array(list(map(itemgetter(*DATAPOINTS), prices)), dtype=np.float32)
+    data = np.zeros((len(DATAPOINTS), number_of_elements), np.float32)
+    data[:, index[kept]] = values[kept].T
+    return (str(dates[0]), str(last_date), data)
 
 def get_last_date(full_ticker:str)->date:
     '''
     Return the last coverage date or None
     '''
     try:
-        # Read the meta data files to extract the last date 
-        # We retain the oldest last date of all meta files
-        filenames = __getmetafilenames(full_ticker)
-        start_date:date | None = None
-        for filename in filenames:
-            file_start_date = get_start_date(filename)
-            if(start_date==None): 
-                start_date = file_start_date
-            else:
-                start_date = min(start_date, file_start_date)
-        return start_date
+        # We retain the oldest last date of all the data points
+        (ticker, exchange) = full_ticker.split('.')
+        last_date = get_last_coverage_date(read_ticker_meta(os.path.join(get_config('DB_LOCATION'), "EQUITIES", exchange, ticker)))
+        return date.fromisoformat(last_date) if last_date != None else None
 
     except Exception as e:
         __logger.error("Failed to retrive the last coverage date for ticker %s: %s", full_ticker, str(e))
 
-def get_start_date(filename:os.path)->date:
-    with open(filename,'r') as metafile:
-        meta = json.loads(metafile.read())
-        return date.fromisoformat(meta["last_date"])
+def get_last_dates(exchange_code:str, codes:list)->dict:
+    '''
+    Returns the last coverage dates (or None) of the tickers of the exchange as a dictionary of (ticker code, date).
+    The dates are read from the coverage file of the exchange, the meta data of the tickers missing in the coverage file being read one by one.
+    '''
+    coverage = read_coverage(os.path.join(get_config('DB_LOCATION'), "EQUITIES", exchange_code))
+    toreturn = {}
+    for code in codes:
+        if code in coverage: toreturn[code] = date.fromisoformat(coverage[code])
+        else: toreturn[code] = get_last_date(code+'.'+exchange_code)
+    return toreturn
 
-def __getmetafilenames(full_ticker:str)->list:
-    db_loc = get_config('DB_LOCATION')
-    full_ticker_list = full_ticker.split('.')
-    ticker = full_ticker_list[0]
-    exchange = full_ticker_list[1]
-    exchange_loc = os.path.join(db_loc, "EQUITIES", exchange)
-    ticker_loc = os.path.join(exchange_loc, ticker)
-    #List all meta files
-    return glob.glob(ticker_loc+"/*.meta")
 
 
+def __get_int_config(key:str, default:int)->int:
+    value = get_config(key)
+    return int(value) if len(value) != 0 else default
 
-def __feed_db_eodprices(client,exchange:dict, ticker:dict, update:bool, as_of_date:date):
+def __fetch_eodprices(client, exchange:dict, ticker:dict, from_date:date, rate_limiter:RateLimiter)->list:
     '''
-    Populate the database with end of day market data for the ticker belonging to this exchange (or subexchange)
+    Fetches the end of day prices of the ticker from the API.
+    If from_date is not None (update mode), only the prices after from_date (the last date in the database) are fetched.
+    '''
+    __logger.info("Fetching EOD prices for ticker %s from exchange %s", ticker['Code'], exchange['Code'])
+    full_ticker= ticker['Code']+'.'+exchange['Code']
+    rate_limiter.acquire()
+    if from_date == None:
+        return client.get_prices_eod(full_ticker)
+    return client.get_prices_eod(full_ticker, period = 'd', order='a', from_=from_date + datetime.timedelta(1))
+
+def __fetch_bulk_eodprices(client, exchange:dict, tickers:list, last_dates:dict, as_of_date:date, bulk_days:int, rate_limiter:RateLimiter)->tuple:
+    '''
+    Fetches the last end of day prices of the whole exchange with one bulk request per day of the last bulk_days days up to as_of_date.
+    Returns a tuple:
+    . a list of (ticker, prices) for the tickers updated from the bulk prices (prices after the last date of the ticker in the database)
+    . the list of the tickers with a gap (no data or a last date before the bulk days) which have to be fetched one by one
     '''
+    first_bulk_date = as_of_date - datetime.timedelta(bulk_days-1)
+    bulk_tickers = {}
+    gaps = []
+    for ticker in tickers:
+        last_date = last_dates[ticker['Code']]
+        if (last_date == None) or (last_date < first_bulk_date - datetime.timedelta(1)):
+            gaps.append(ticker)
+        elif last_date < as_of_date:
+            bulk_tickers[ticker['Code']] = ticker
+    if len(bulk_tickers) == 0: return ([], gaps)
+    prices = {code:{} for code in bulk_tickers}
+    day = min([last_dates[code] for code in bulk_tickers]) + datetime.timedelta(1)
+    __logger.info("Fetching bulk EOD prices of exchange %s from %s for %d tickers", exchange['Code'], day.isoformat(), len(bulk_tickers))
+    while day <= as_of_date:
+        rate_limiter.acquire()
+        for row in client.get_bulk_markets(exchange['Code'], date=day.isoformat()):
+            code = row['code']
+            # Rows are keyed by date as a bulk request for a day without trading may return the prices of the previous trading day
+            if (code in prices) and (date.fromisoformat(row['date']) > last_dates[code]): prices[code][row['date']] = row
+        day += datetime.timedelta(1)
+    return ([(bulk_tickers[code], [ticker_prices[d] for d in sorted(ticker_prices)]) for code, ticker_prices in prices.items()], gaps)
+
+def __write_eodprices(exchange:dict, ticker:dict, prices:list, as_of_date:date, padded:bool=False)->str:
+    '''
+    Writes the data points of the prices [{date,open,high,low,close,adjusted_close,volume}] in the database
+    The data files are written (or staged) first and the update is committed by renaming the staged files and then the meta data file of the ticker,
+    so the meta data never describes data which is not written yet.
+    The change is recorded for the column store of the exchange before anything is written.
+    If padded is True, the data points are written up to as_of_date (see __pack_eodprices).
+    Returns a tuple of the new last coverage date of the ticker, the number of days and the number of bytes written.
+    '''
+    ticker_loc = os.path.join(get_config('DB_LOCATION'), 'EQUITIES', exchange['Code'], ticker['Code'])
+    (base_date, last_date, data) = __pack_eodprices(prices, as_of_date, padded)
+    meta = read_ticker_meta(ticker_loc)
+    fill_gaps = __get_int_config('FEEDER_FILL_GAPS', 0) != 0
+    # Filling the gaps of data files which were not filled yet changes them entirely
+    refilled = fill_gaps and not all([meta.get(fieldname, {}).get(FORWARD_FILLED, False) for fieldname in DATAPOINTS])
+    ColumnStore.record_change(os.path.dirname(ticker_loc), ticker['Code'], None if refilled else base_date)
+    staged = []
+    for (i, fieldname) in enumerate(DATAPOINTS):
+        data_loc = os.path.join(ticker_loc, fieldname+".npy")
+        filled = meta.get(fieldname, {}).get(FORWARD_FILLED, False)
+        before_start_date, before_end_date, after_start_date, after_end_date, meta[fieldname] = __merge_meta_data(meta.get(fieldname), {'base_date':base_date, 'last_date':last_date, 'name':fieldname})
+        staged_loc = __update_data_file(data_loc, data[i], before_start_date, before_end_date, datetime.datetime.strptime(base_date, DATE_FORMAT).date(), datetime.datetime.strptime(last_date, DATE_FORMAT).date(), fill_gaps, filled)
+        if staged_loc != None: staged.append((staged_loc, data_loc))
+        # Values appended without filling them make the whole file unfilled
+        if fill_gaps: meta[fieldname][FORWARD_FILLED] = True
+        else: meta[fieldname].pop(FORWARD_FILLED, None)
+    for (staged_loc, data_loc) in staged:
+        os.replace(staged_loc, data_loc)
+    write_ticker_meta(ticker_loc, meta)
+    return (get_last_coverage_date(meta), data.shape[1], data.nbytes)
+
+def __write_fetched_eodprices(fetched:queue.Queue, exchange:dict, as_of_date:date, journal:CheckpointJournal, loads:list):
+    '''
+    Writer stage: writes the prices fetched (ticker, prices, error, seconds to fetch, padded) until None is received.
+    Only this stage writes the files, updates the statistics of the tickers and records them in the checkpoint journal (if any).
+    The (full ticker, days, bytes, seconds to fetch and write) of each ticker written are appended to loads.
+    The coverage file of the exchange is updated with the last dates of the tickers written once all of them are written.
+    '''
+    last_dates = {}
     try:
-        __logger.info("Fetching EOD prices for ticker %s from exchange %s", ticker['Code'], exchange['Code'])
-        full_ticker= ticker['Code']+'.'+exchange['Code']
-        if not update:
-            prices = client.get_prices_eod(full_ticker)
-        else:
-            from_date = get_last_date(full_ticker)
-            if from_date == None:
-                prices = client.get_prices_eod(full_ticker)
-            else:
-                from_date = from_date + datetime.timedelta(1)
-                prices = client.get_prices_eod(full_ticker, period = 'd', order='a', from_=from_date)
-        # Getting back [{date,open,high,low,close,adjusted_close,volume}]
-        dp = {}
-        if len(prices) >0 :
-            dp=__pack_datapoint(dp,'open', prices, as_of_date)
-            __feed_data_file(exchange['Code'], ticker['Code'], dp)
-            dp=__pack_datapoint(dp,'close', prices, as_of_date)
-            __feed_data_file(exchange['Code'], ticker['Code'], dp)
-            dp=__pack_datapoint(dp,'high', prices, as_of_date)
-            __feed_data_file(exchange['Code'], ticker['Code'], dp)
-            dp=__pack_datapoint(dp,'low', prices, as_of_date)
-            __feed_data_file(exchange['Code'], ticker['Code'], dp)
-            dp=__pack_datapoint(dp,'adjusted_close', prices, as_of_date)
-            __feed_data_file(exchange['Code'], ticker['Code'], dp)
-            dp=__pack_datapoint(dp,'volume', prices, as_of_date)
-            __feed_data_file(exchange['Code'], ticker['Code'], dp)
-    except Exception as e:
-        __logger.error("Could not get eod data for ticker %s.%s->%s", ticker['Code'], exchange['Code'], str(e))
-        __update_stat_ticker_error(exchange, ticker, e)
+        while True:
+            item = fetched.get()
+            if item == None: return
+            (ticker, prices, error, fetch_seconds, padded) = item
+            try:
+                if error != None: raise error
+                if len(prices) > 0:
+                    start = time.monotonic()
+                    (last_dates[ticker['Code']], days, size) = __write_eodprices(exchange, ticker, prices, as_of_date, padded)
+                    loads.append((ticker['Code']+'.'+exchange['Code'], days, size, fetch_seconds + time.monotonic() - start))
+                if journal != None: journal.record_done(ticker['Code']+'.'+exchange['Code'], last_dates.get(ticker['Code']))
+            except Exception as e:
+                __logger.error("Could not get eod data for ticker %s.%s->%s", ticker['Code'], exchange['Code'], str(e))
+                __update_stat_ticker_error(exchange, ticker, e)
+                if journal != None: journal.record_failed(ticker['Code']+'.'+exchange['Code'], str(e))
+    finally:
+        if len(last_dates) > 0:
+            try:
+                update_coverage(os.path.join(get_config('DB_LOCATION'), 'EQUITIES', exchange['Code']), last_dates)
+            except Exception as e:
+                __logger.error("Could not update the coverage file of exchange %s->%s", exchange['Code'], str(e))
+
+def __feed_db_eodprices(client, exchange:dict, tickers:list, update:bool, as_of_date:date, journal:CheckpointJournal=None)->list:
+    '''
+    Populate the database with end of day market data for the tickers belonging to this exchange (or subexchange)
+    Prices are fetched by FEEDER_CONCURRENCY threads, with at most FEEDER_REQUESTS_PER_MINUTE requests per minute (no limit if 0),
+    and handed over to a single writer thread through a bounded queue.
+    In update mode, if FEEDER_BULK_DAYS is not 0, the prices of the last FEEDER_BULK_DAYS days of the whole exchange are fetched with bulk requests
+    and only the tickers with a gap are fetched one by one.
+    A ticker fetched on its own runs up to its last price (at most as_of_date), which leaves the days without prices after it to the next update.
+    As the bulk requests cover every day up to as_of_date, the tickers they update run up to as_of_date when FEEDER_FILL_GAPS is set,
+    so their last prices are filled up to it.
+    Returns the loads (full ticker, days, bytes, seconds to fetch and write) of the tickers written.
+    '''
+    concurrency = max(__get_int_config("FEEDER_CONCURRENCY", 1), 1)
+    rate_limiter = RateLimiter(__get_int_config("FEEDER_REQUESTS_PER_MINUTE", 0)/60, burst=concurrency)
+    bulk_days = __get_int_config("FEEDER_BULK_DAYS", 0)
+    fetched = queue.Queue(maxsize=2*concurrency)
+
+    # In update mode, the last dates of all the tickers are read at once
+    last_dates = get_last_dates(exchange['Code'], [ticker['Code'] for ticker in tickers]) if update else {}
+
+    def fetch(ticker:dict):
+        start = time.monotonic()
+        try:
+            prices = __fetch_eodprices(client, exchange, ticker, last_dates.get(ticker['Code']), rate_limiter)
+            fetched.put((ticker, prices, None, time.monotonic() - start, False))
+        except Exception as e:
+            fetched.put((ticker, None, e, time.monotonic() - start, False))
+
+    loads = []
+    writer = threading.Thread(target=__write_fetched_eodprices, args=(fetched, exchange, as_of_date, journal, loads), name="writer-"+exchange['Code'])
+    writer.start()
+    try:
+        if update and (bulk_days > 0):
+            try:
+                start = time.monotonic()
+                (bulk_prices, tickers) = __fetch_bulk_eodprices(client, exchange, tickers, last_dates, as_of_date, bulk_days, rate_limiter)
+                # The time of the bulk requests is shared by the tickers they update
+                fetch_seconds = (time.monotonic() - start) / max(len(bulk_prices), 1)
+                padded = __get_int_config('FEEDER_FILL_GAPS', 0) != 0
+                for (ticker, prices) in bulk_prices:
+                    fetched.put((ticker, prices, None, fetch_seconds, padded))
+            except Exception as e:
+                __logger.warning("Could not get bulk eod data for exchange %s, falling back to one request per ticker->%s", exchange['Code'], str(e))
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="fetch-"+exchange['Code']) as executor:
+            for ticker in tickers:
+                executor.submit(fetch, ticker)
+    finally:
+        fetched.put(None)
+        writer.join()
+    return loads
 
 
 def display_stats(stats):
@@ -380,9 +516,27 @@ def display_stats(stats):
     __display_stats_tickers(stats, logger)
     
 
-def __populate_exchanges(client, exchanges:dict, update:bool, as_of_date:date):
+def __record_load(function, *args):
+    '''
+    Calls the loadstats function to record a load in the load statistics database (FEEDER_LOAD_STATS_DB, loadstats.db in LOG_FILE_LOC by default).
+    Failing to record the statistics does not fail the load. Returns the result of the function or None.
+    '''
+    try:
+        location = get_config("FEEDER_LOAD_STATS_DB")
+        if len(location) == 0: location = os.path.join(get_config("LOG_FILE_LOC"), "loadstats.db")
+        conn = connect_load_stats(location)
+        try:
+            return function(conn, *args)
+        finally:
+            conn.close()
+    except Exception as e:
+        __logger.warning("Could not record the load statistics->%s", str(e))
+        return None
+
+def __populate_exchanges(client, exchanges:dict, update:bool, as_of_date:date, journal:CheckpointJournal=None, retry_failures:bool=False, build_column_stores:bool=True):
     '''
     Feed the database(s) with the exchanges market data
+    With a checkpoint journal, the tickers already committed are skipped, or only the tickers which failed are processed if retry_failures.
     '''
     for exchange in exchanges:
         if exchange['Size'] == -1:
@@ -391,12 +545,35 @@ def __populate_exchanges(client, exchanges:dict, update:bool, as_of_date:date):
             __logger.info("Populating database for exchange %s part %d (%d tickers)", exchange['Code'], exchange['Part'], exchange['Size'])
         __updatedb_exchange(exchange)
         tickers = __updatedb_tickers(exchange,client)
-        for ticker in tickers:
-            __feed_db_eodprices(client,exchange, ticker, update, as_of_date)
+        if journal != None:
+            count = len(tickers)
+            if retry_failures: tickers = [ticker for ticker in tickers if journal.is_failed(ticker['Code']+'.'+exchange['Code'])]
+            else: tickers = [ticker for ticker in tickers if not journal.is_done(ticker['Code']+'.'+exchange['Code'])]
+            __logger.info("Skipping %d tickers of exchange %s part %d according to the checkpoint journal", count - len(tickers), exchange['Code'], exchange['Part'])
+        start = time.monotonic()
+        exchange_load_id = __record_load(start_exchange_load, exchange['Code'], exchange['Part'], update)
+        loads = __feed_db_eodprices(client, exchange, tickers, update, as_of_date, journal)
+        __record_load(record_ticker_loads, exchange_load_id, loads)
+        __record_load(end_exchange_load, exchange_load_id, time.monotonic() - start)
+    # Update the column store once per exchange, after all its parts are loaded
+    if not build_column_stores: return
+    for exchange_code in dict.fromkeys([exchange['Code'] for exchange in exchanges]):
+        __build_column_store(exchange_code)
+
+def __build_column_store(exchange_code:str):
+    '''
+    Updates the memory mapped column store of the exchange with the data point files of the tickers changed since its last update
+    '''
+    try:
+        db_loc = get_config('DB_LOCATION')
+        count = ColumnStore.update(os.path.join(db_loc, "EQUITIES", exchange_code))
+        __logger.info("Column store of exchange %s updated with %d tickers", exchange_code, count)
+    except Exception as e:
+        __logger.error("Could not build the column store of exchange %s -> %s", exchange_code, str(e))
 
 
 
-def update_db(client, exchange_list:list, update, as_of_date:date=date.today()):
+def update_db(client, exchange_list:list, update, as_of_date:date=date.today(), journal:CheckpointJournal=None, retry_failures:bool=False, build_column_stores:bool=True):
     '''
     Populate the file database
     Arguments are:
@@ -417,6 +594,9 @@ def update_db(client, exchange_list:list, update, as_of_date:date=date.today()):
 
     . update: True if we just update the database up to today's data (we are not processing the full history)
     . as_of_date: as of date, which basically means run the loader as if we were on that date
+    . journal: checkpoint journal of the run (or None). The tickers already committed in the journal are skipped and the tickers processed are recorded in it.
+    . retry_failures: only process the tickers which failed according to the journal
+    . build_column_stores: rebuild the column stores of the exchanges once loaded
     '''
     __reset_stats()
     exchanges=[]
@@ -448,7 +628,7 @@ def update_db(client, exchange_list:list, update, as_of_date:date=date.today()):
             if(found == False):
                 __logger.warning("Could not find exchange %s", exchange_code)
 
-    __populate_exchanges(client, exchanges, update, as_of_date)
+    __populate_exchanges(client, exchanges, update, as_of_date, journal, retry_failures, build_column_stores)
 
 
 
@@ -471,11 +651,50 @@ def build_exchange_list(exchange_list:list):
         to_return.append((exchange, -1, 1, 0))
     return to_return
 
-def run_feeder_batch(batch_name:str, configfile:str, batch_definition_file:str):
+def __get_checkpoint_file(batch_name:str)->str:
+    '''
+    Returns the location of the checkpoint journal of the batch, in FEEDER_CHECKPOINT_LOC (LOG_FILE_LOC by default)
+    '''
+    location = get_config("FEEDER_CHECKPOINT_LOC")
+    if len(location) == 0: location = get_config("LOG_FILE_LOC")
+    os.makedirs(location, exist_ok=True)
+    return os.path.join(location, "checkpoint_{batch_name}.jsonl".format(batch_name=batch_name))
+
+def get_checkpoint_journal(batch_name:str, update:bool, as_of_date:date, retry_failures:bool=False, part:str=None)->CheckpointJournal:
+    '''
+    Returns the checkpoint journal of the batch, resumed if it was written by a run of the batch for the same as of date and mode.
+    If retry_failures, the last run of the batch is resumed whatever its as of date and mode, to retry its failures.
+    If part is given, the tickers are recorded in the part of the journal of this name, the processes of the batch writing each their own part.
+    '''
+    filename = __get_checkpoint_file(batch_name)
+    run = {"batch":batch_name, "as_of_date":as_of_date.isoformat(), "update":update}
+    if retry_failures: run = CheckpointJournal.read(filename).run or run
+    return CheckpointJournal(filename, run, part)
+
+def open_checkpoint_journal(batch_name:str, configfile:str, update:bool=False, as_of_date:date=date.today())->CheckpointJournal:
+    '''
+    Opens (resumes or starts) the checkpoint journal of the batch from another process than the feeder, like the controller.
+    '''
+    init(None, configfile)
+    return get_checkpoint_journal(batch_name, update, as_of_date)
+
+def get_failed_tickers(batch_name:str, configfile:str)->dict:
+    '''
+    Returns the tickers which failed in the last run of the batch as a dictionary of (full ticker, error).
+    The journal is only read, a feeder retrying the failures resuming the same run.
+    '''
+    init(None, configfile)
+    return CheckpointJournal.read(__get_checkpoint_file(batch_name)).get_failed()
+
+def run_feeder_batch(batch_name:str, configfile:str, batch_definition_file:str, retry_failures:bool=False):
     '''
     Run the feeder for the list of exchanges in batch identified by batch_name
     configfile is the usual pm.conf or equivalent configuration file
     batch_definition_file is the json file containing the batch definitions.
+    An interrupted run of the batch is resumed from its checkpoint journal, skipping the tickers already committed.
+    If retry_failures, only the tickers which failed in the journal are processed.
+    The column stores are not updated: batches running at the same time may load parts of the same exchange,
+    so the controller updates them once all the batches are done (build_column_stores).
     '''
     init(None, configfile)
     __logger.info("Running batch feeder process %s", batch_name)
@@ -484,9 +703,110 @@ def run_feeder_batch(batch_name:str, configfile:str, batch_definition_file:str):
     with open(batch_definition_file, "r") as batch_file:
         config = json.load(batch_file)
     exchange_list = __get_exchange_list(config, batch_name)
-    update_db(client, exchange_list, False)
+    journal = get_checkpoint_journal(batch_name, False, date.today(), retry_failures)
+    if journal.resumed: __logger.info("Resuming batch %s: %d tickers done, %d failed", batch_name, len(journal.get_done()), len(journal.get_failed()))
+    # Predicted by the batch planner
+    predicted = [batches.get('Predicted_Seconds') for batches in config if batches['Batch_Name'] == batch_name][0]
+    start = time.monotonic()
+    batch_load_id = __record_load(start_batch_load, batch_name, predicted)
+    update_db(client, exchange_list, False, date.today(), journal, retry_failures, build_column_stores=False)
+    __record_load(end_batch_load, batch_load_id, time.monotonic() - start)
+    __logger.info("Batch %s loaded in %.0fs (predicted %s)", batch_name, time.monotonic() - start, "{0:.0f}s".format(predicted) if predicted != None else "unknown")
     display_stats(__stats)
 
+def get_batch_load_report(batch_names:list, configfile:str)->list:
+    '''
+    Returns the last run of each batch as a list of (batch name, load time, predicted seconds, actual seconds)
+    '''
+    init(None, configfile)
+    loads = __record_load(get_batch_loads)
+    if loads == None: return []
+    return [load for load in loads if load[0] in batch_names]
+
+def split_in_chunks(exchanges:list, chunk_size:int)->list:
+    '''
+    Splits the exchanges (or exchange parts) {Code, Part, Start, Size} of batch definitions in chunks of at most chunk_size tickers.
+    Returns the list of chunks (code, size, part, start) as expected by update_db, the biggest first. Chunks of the same exchange are numbered from 1.
+    Exchanges of unknown size (-1) are a single chunk.
+    '''
+    chunks = []
+    parts = {}
+    for exchange in exchanges:
+        if exchange['Size'] == -1:
+            chunks.append((exchange['Code'], -1, 1, 0))
+            continue
+        for start in range(exchange['Start'], exchange['Start'] + exchange['Size'], chunk_size):
+            parts[exchange['Code']] = parts.get(exchange['Code'], 0) + 1
+            chunks.append((exchange['Code'], min(chunk_size, exchange['Start'] + exchange['Size'] - start), parts[exchange['Code']], start))
+    chunks.sort(key=lambda chunk: math.inf if chunk[1] == -1 else chunk[1], reverse=True)
+    return chunks
+
+class CachedListsClient:
+    '''
+    Wraps an EOD client to fetch the list of exchanges and the list of symbols of each exchange only once,
+    as a worker loading many chunks of the same exchanges needs them for each chunk.
+    '''
+    def __init__(self, client) -> None:
+        self._client = client
+        self._exchanges = None
+        self._symbols = {}
+
+    def get_exchanges(self):
+        if self._exchanges == None: self._exchanges = self._client.get_exchanges()
+        # update_db annotates the exchanges it processes
+        return [dict(exchange) for exchange in self._exchanges]
+
+    def get_exchange_symbols(self, exchange:str):
+        if exchange not in self._symbols: self._symbols[exchange] = self._client.get_exchange_symbols(exchange=exchange)
+        return self._symbols[exchange]
+
+    def __getattr__(self, name:str):
+        return getattr(self._client, name)
+
+def __merge_stats(total:dict, stats:dict):
+    for key in ['Processed', 'Errors']:
+        total['Exchanges'][key].extend(stats['Exchanges'][key])
+    total['Tickers']['Processed'].extend(stats['Tickers']['Processed'])
+    for part, errors in stats['Tickers']['Errors'].items():
+        total['Tickers']['Errors'].setdefault(part, []).extend(errors)
+
+def run_feeder_worker(worker_name:str, configfile:str, chunks, progress, update:bool, as_of_date:date=date.today(), journal_name:str=None, client=None):
+    '''
+    Worker of the dynamic controller: loads the chunks (code, size, part, start) pulled from the chunks queue until None is pulled.
+    For each chunk, a ("started", worker_name, chunk) message is put in the progress queue before loading it,
+    and a ("done", worker_name, chunk, tickers processed, tickers in error, elapsed seconds) message once loaded.
+    The column stores are not rebuilt by the workers.
+    journal_name is the name of the checkpoint journal shared by the workers (None for no journal), each worker writing its own part.
+    '''
+    init(None, configfile)
+    __logger.info("Running feeder worker %s", worker_name)
+    if client == None: client = EodHistoricalData(get_oed_apikey())
+    client = CachedListsClient(client)
+    journal = get_checkpoint_journal(journal_name, update, as_of_date, part=worker_name) if journal_name != None else None
+    total = {'Exchanges':{'Processed':[], 'Errors':[]}, 'Tickers':{'Processed':[], 'Errors':{}}}
+    while True:
+        chunk = chunks.get()
+        if chunk == None: break
+        progress.put(("started", worker_name, chunk))
+        start = time.monotonic()
+        try:
+            update_db(client, [tuple(chunk)], update, as_of_date, journal, build_column_stores=False)
+        except Exception as e:
+            __logger.exception("Worker %s could not load chunk %s->%s", worker_name, str(chunk), str(e))
+            __stats['Exchanges']['Errors'].append(chunk[0]+'-'+str(chunk[2]))
+        __merge_stats(total, __stats)
+        errors = sum([len(errors) for errors in __stats['Tickers']['Errors'].values()])
+        progress.put(("done", worker_name, chunk, len(__stats['Tickers']['Processed']), errors, time.monotonic() - start))
+    display_stats(total)
+
+def build_column_stores(exchange_codes:list, configfile:str):
+    '''
+    Updates the column stores of the exchanges, once all their tickers are loaded
+    '''
+    init(None, configfile)
+    for exchange_code in exchange_codes:
+        __build_column_store(exchange_code)
+
 def run_feeder(exchange_list, configfile:str,  update:bool, as_of_date:date=date.today()):
     '''
     Run the feeder for the list of exchanges passed in argument
@@ -499,10 +819,249 @@ def run_feeder(exchange_list, configfile:str,  update:bool, as_of_date:date=date
     display_stats(__stats)
 
 
+class FakeEodHistoricalData:
+    '''
+    Local stand-in for the EodHistoricalData client serving canned JSON responses after an artificial latency.
+    Keeps track of the maximum number of requests served concurrently.
+    '''
+    def __init__(self, exchanges:list, symbols:dict, prices:dict, latency:float=0.0):
+        '''
+        exchanges: list of exchange dictionaries
+        symbols: dictionary of (exchange code, list of symbol dictionaries)
+        prices: dictionary of (fully qualified ticker, list of price dictionaries {date,open,high,low,close,adjusted_close,volume})
+        '''
+        self.latency = latency
+        self._exchanges = json.dumps(exchanges)
+        self._symbols = {code:json.dumps(s) for code, s in symbols.items()}
+        self._prices = {full_ticker:json.dumps(p) for full_ticker, p in prices.items()}
+        # Rows of the bulk requests by exchange code and date
+        bulk = {}
+        for full_ticker, ticker_prices in prices.items():
+            (code, exchange_code) = full_ticker.split('.')
+            for price in ticker_prices:
+                bulk.setdefault((exchange_code, price['date']), []).append(dict(price, code=code, exchange_short_name=exchange_code))
+        self._bulk = {key:json.dumps(rows) for key, rows in bulk.items()}
+        self._lock = threading.Lock()
+        self._running = 0
+        self.max_concurrent_requests = 0
+        self.requests = 0
+        # Fully qualified tickers whose prices cannot be fetched
+        self.failing = set()
+
+    def __serve(self, response:str):
+        with self._lock:
+            self._running += 1
+            self.requests += 1
+            self.max_concurrent_requests = max(self.max_concurrent_requests, self._running)
+        try:
+            time.sleep(self.latency)
+            return json.loads(response)
+        finally:
+            with self._lock: self._running -= 1
+
+    def get_exchanges(self):
+        return self.__serve(self._exchanges)
+
+    def get_exchange_symbols(self, exchange:str):
+        return self.__serve(self._symbols.get(exchange, "[]"))
+
+    def get_prices_eod(self, symbol:str, period:str='d', order:str='a', from_=None):
+        if symbol in self.failing: raise FeederException("Cannot fetch the prices of "+symbol)
+        prices = self.__serve(self._prices.get(symbol, "[]"))
+        if from_ != None: prices = [price for price in prices if date.fromisoformat(price['date']) >= from_]
+        return prices
+
+    def get_bulk_markets(self, exchange:str, date:str, type:str='eod'):
+        return self.__serve(self._bulk.get((exchange, date), "[]"))
+
+    @staticmethod
+    def create(exchange_code:str, number_of_tickers:int, start_date:date, days:int, latency:float=0.0):
+        '''
+        Creates a fake client serving number_of_tickers tickers (T0, T1...) of the exchange, each with days of prices from start_date.
+        The close price of ticker Ti on day d (0 based) is i*1000+d.
+        '''
+        symbols = [{"Code":"T"+str(i), "Name":"Ticker "+str(i), "Country":"USA", "Exchange":exchange_code, "Currency":"USD", "Type":"Common Stock", "Isin":""} for i in range(number_of_tickers)]
+        prices = {}
+        for i in range(number_of_tickers):
+            prices["T"+str(i)+"."+exchange_code] = [{"date":(start_date + datetime.timedelta(d)).isoformat(), "open":i*1000+d, "high":i*1000+d, "low":i*1000+d,
+                "close":i*1000+d, "adjusted_close":i*1000+d, "volume":i*1000+d} for d in range(days)]
+        return FakeEodHistoricalData([{"Code":exchange_code, "Name":exchange_code}], {exchange_code:symbols}, prices, latency)
+
+
 class UnitTestFeeder(unittest.TestCase):
 
     TEST_CONFIG="tests/config/pm.conf"
+
+    def set_temporary_db(self, **overrides)->str:
+        '''
+        Points the configuration to a new temporary database (also used for the logs), removed with the configuration overrides at the end of the test
+        '''
+        init(None, self.TEST_CONFIG)
+        location = tempfile.mkdtemp()
+        overrides["DB_LOCATION"] = location
+        overrides["LOG_FILE_LOC"] = location
+        previous = {key:os.environ.get(key) for key in overrides}
+        os.environ.update(overrides)
+        def restore():
+            for key, value in previous.items():
+                if value == None: del os.environ[key]
+                else: os.environ[key] = value
+            shutil.rmtree(location)
+        self.addCleanup(restore)
+        return location
+
+    def test_parallel_load(self):
+        location = self.set_temporary_db(FEEDER_CONCURRENCY="8", FEEDER_REQUESTS_PER_MINUTE="0")
+        client = FakeEodHistoricalData.create("XX", 20, date(2022,1,1), 10, latency=0.05)
+        start = time.monotonic()
+        update_db(client, [("XX", -1, 1, 0)], False, date(2022,1,31))
+        # Fetching the 20 tickers one after the other would take at least 1 second
+        self.assertLess(time.monotonic() - start, 20*0.05)
+        self.assertGreater(client.max_concurrent_requests, 1)
+        for i in range(20):
+            self.assertTrue(os.path.exists(os.path.join(location, "EQUITIES", "XX", "T"+str(i), "volume.npy")))
+        close = np.load(os.path.join(location, "EQUITIES", "XX", "T3", "close.npy"))
+        self.assertTrue(np.array_equal(close, [3000+d for d in range(10)]))
+
+    def test_bulk_update(self):
+        location = self.set_temporary_db(FEEDER_CONCURRENCY="4", FEEDER_REQUESTS_PER_MINUTE="0", FEEDER_BULK_DAYS="5")
+        client = FakeEodHistoricalData.create("XX", 20, date(2022,1,1), 10)
+        update_db(client, [("XX", -1, 1, 0)], False, date(2022,1,7))
+        # T5 has no data, T7 has a gap of more than 5 days
+        shutil.rmtree(os.path.join(location, "EQUITIES", "XX", "T5"))
+        ticker_loc = os.path.join(location, "EQUITIES", "XX", "T7")
+        meta = read_ticker_meta(ticker_loc)
+        for fieldname in meta:
+            meta[fieldname]["last_date"] = "2022-01-01"
+            np.save(os.path.join(ticker_loc, fieldname+".npy"), np.load(os.path.join(ticker_loc, fieldname+".npy"))[:1])
+        write_ticker_meta(ticker_loc, meta)
+        coverage = read_coverage(os.path.join(location, "EQUITIES", "XX"))
+        del coverage["T5"]
+        del coverage["T7"]
+        with open(os.path.join(location, "EQUITIES", "XX", "coverage.json"), 'w') as coveragefile: json.dump(coverage, coveragefile)
+        client.requests = 0
+        update_db(client, [("XX", -1, 1, 0)], True, date(2022,1,10))
+        # get_exchanges, get_exchange_symbols, 3 bulk requests (January 8 to 10) and one request for each of T5 and T7
+        self.assertEqual(client.requests, 7)
+        for i in [3, 5, 7]:
+            close = np.load(os.path.join(location, "EQUITIES", "XX", "T"+str(i), "close.npy"))
+            self.assertTrue(np.array_equal(close, [i*1000+d for d in range(10)]))
     
+    def test_packing(self):
+        location = self.set_temporary_db(FEEDER_CONCURRENCY="1", FEEDER_REQUESTS_PER_MINUTE="0")
+        prices = [{"date":d, "open":1, "high":2, "low":0.5, "close":1.5, "adjusted_close":"1.25", "volume":None} for d in ["2022-01-03", "2022-01-04", "2022-01-07", "2022-01-12"]]
+        client = FakeEodHistoricalData([{"Code":"XX", "Name":"XX"}], {"XX":[{"Code":"T", "Name":"T", "Type":"Common Stock"}]}, {"T.XX":prices})
+        update_db(client, [("XX", -1, 1, 0)], False, date(2022,1,10))
+        ticker_loc = os.path.join(location, "EQUITIES", "XX", "T")
+        # Missing days are 0, prices after the as of date are ignored
+        self.assertTrue(np.array_equal(np.load(os.path.join(ticker_loc, "adjusted_close.npy")), [1.25, 1.25, 0, 0, 1.25, 0, 0, 0]))
+        self.assertTrue(np.array_equal(np.load(os.path.join(ticker_loc, "high.npy")), [2, 2, 0, 0, 2, 0, 0, 0]))
+        self.assertTrue(np.isnan(np.load(os.path.join(ticker_loc, "volume.npy"))[0]))
+        self.assertEqual(read_ticker_meta(ticker_loc)["low"], {"base_date":"2022-01-03", "last_date":"2022-01-10", "name":"low"})
+        self.assertEqual(read_coverage(os.path.join(location, "EQUITIES", "XX")), {"T":"2022-01-10"})
+
+    def test_append_in_place(self):
+        location = self.set_temporary_db(FEEDER_CONCURRENCY="4", FEEDER_REQUESTS_PER_MINUTE="0", FEEDER_BULK_DAYS="5")
+        client = FakeEodHistoricalData.create("XX", 5, date(2022,1,1), 10)
+        update_db(client, [("XX", -1, 1, 0)], False, date(2022,1,7))
+        filename = os.path.join(location, "EQUITIES", "XX", "T3", "close.npy")
+        inode = os.stat(filename).st_ino
+        update_db(client, [("XX", -1, 1, 0)], True, date(2022,1,10))
+        # The file is extended, not replaced by a new one
+        self.assertEqual(os.stat(filename).st_ino, inode)
+        close = np.load(filename)
+        self.assertEqual(close.dtype, np.float32)
+        self.assertTrue(np.array_equal(close, [3000+d for d in range(10)]))
+        self.assertEqual(read_ticker_meta(os.path.dirname(filename))["close"]["last_date"], "2022-01-10")
+        self.assertEqual(get_last_dates("XX", ["T3", "T9"]), {"T3":date(2022,1,10), "T9":None})
+
+    def test_fill_gaps(self):
+        location = self.set_temporary_db(FEEDER_CONCURRENCY="1", FEEDER_REQUESTS_PER_MINUTE="0", FEEDER_FILL_GAPS="0")
+        prices = [{"date":d, "open":v, "high":v, "low":v, "close":v, "adjusted_close":v, "volume":v} for (d, v) in [("2022-01-03", 1), ("2022-01-05", 2), ("2022-01-07", 3), ("2022-01-12", 4), ("2022-01-14", 5)]]
+        client = FakeEodHistoricalData([{"Code":"XX", "Name":"XX"}], {"XX":[{"Code":"T", "Name":"T", "Type":"Common Stock"}]}, {"T.XX":prices})
+        update_db(client, [("XX", -1, 1, 0)], False, date(2022,1,5))
+        filename = os.path.join(location, "EQUITIES", "XX", "T", "close.npy")
+        self.assertTrue(np.array_equal(np.load(filename), [1, 0, 2]))
+        # The file written without filling is filled as a whole by the first update filling the gaps,
+        # the bulk prices being filled up to the as of date
+        os.environ["FEEDER_FILL_GAPS"] = "1"
+        update_db(client, [("XX", -1, 1, 0)], True, date(2022,1,10))
+        self.assertTrue(np.array_equal(np.load(filename), [1, 1, 2, 2, 3, 3, 3, 3]))
+        self.assertTrue(read_ticker_meta(os.path.dirname(filename))["close"][FORWARD_FILLED])
+        self.assertEqual(read_ticker_meta(os.path.dirname(filename))["close"]["last_date"], "2022-01-10")
+        # The next updates only fill the values appended
+        inode = os.stat(filename).st_ino
+        update_db(client, [("XX", -1, 1, 0)], True, date(2022,1,12))
+        self.assertEqual(os.stat(filename).st_ino, inode)
+        self.assertTrue(np.array_equal(np.load(filename), [1, 1, 2, 2, 3, 3, 3, 3, 3, 4]))
+        self.assertTrue(ColumnStore(os.path.join(location, "EQUITIES", "XX")).is_forward_filled("T"))
+        os.environ["FEEDER_FILL_GAPS"] = "0"
+        update_db(client, [("XX", -1, 1, 0)], True, date(2022,1,14))
+        self.assertTrue(np.array_equal(np.load(filename)[-3:], [4, 0, 5]))
+        self.assertFalse(FORWARD_FILLED in read_ticker_meta(os.path.dirname(filename))["close"])
+
+    def test_resume(self):
+        location = self.set_temporary_db(FEEDER_CONCURRENCY="4", FEEDER_REQUESTS_PER_MINUTE="0")
+        run = {"batch":"Batch_01", "as_of_date":"2022-01-10", "update":False}
+        filename = os.path.join(location, "checkpoint_Batch_01.jsonl")
+        client = FakeEodHistoricalData.create("XX", 10, date(2022,1,1), 10)
+        client.failing = {"T2.XX", "T4.XX"}
+        update_db(client, [("XX", -1, 1, 0)], False, date(2022,1,10), CheckpointJournal(filename, run))
+        journal = CheckpointJournal(filename, run)
+        self.assertEqual(len(journal.get_done()), 8)
+        self.assertEqual(sorted(journal.get_failed().keys()), ["T2.XX", "T4.XX"])
+        # Reading the failures the next day does not start a new run, the retry resumes the run which failed
+        self.assertEqual(sorted(get_failed_tickers("Batch_01", self.TEST_CONFIG).keys()), ["T2.XX", "T4.XX"])
+        self.assertEqual(get_checkpoint_journal("Batch_01", False, date(2022,1,11), retry_failures=True).run, run)
+        # The exchange now has 2 more tickers, only the failures are retried
+        client = FakeEodHistoricalData.create("XX", 12, date(2022,1,1), 10)
+        update_db(client, [("XX", -1, 1, 0)], False, date(2022,1,10), CheckpointJournal(filename, run), retry_failures=True)
+        # get_exchanges, get_exchange_symbols and the prices of T2 and T4
+        self.assertEqual(client.requests, 4)
+        self.assertEqual(CheckpointJournal(filename, run).get_failed(), {})
+        self.assertFalse(os.path.exists(os.path.join(location, "EQUITIES", "XX", "T10", "close.npy")))
+        # Resuming only processes the tickers not done yet
+        client.requests = 0
+        update_db(client, [("XX", -1, 1, 0)], False, date(2022,1,10), CheckpointJournal(filename, run))
+        self.assertEqual(client.requests, 4)
+        self.assertEqual(len(CheckpointJournal(filename, run).get_done()), 12)
+        self.assertTrue(os.path.exists(os.path.join(location, "EQUITIES", "XX", "T10", "close.npy")))
+
+    def test_worker(self):
+        location = self.set_temporary_db(FEEDER_CONCURRENCY="4", FEEDER_REQUESTS_PER_MINUTE="0")
+        chunks = split_in_chunks([{"Code":"XX", "Part":1, "Start":0, "Size":7}, {"Code":"XX", "Part":2, "Start":7, "Size":3}, {"Code":"YY", "Part":1, "Start":0, "Size":-1}], 3)
+        self.assertEqual(chunks, [("YY", -1, 1, 0), ("XX", 3, 1, 0), ("XX", 3, 2, 3), ("XX", 3, 4, 7), ("XX", 1, 3, 6)])
+        client = FakeEodHistoricalData.create("XX", 10, date(2022,1,1), 10)
+        client.failing = {"T4.XX"}
+        todo = queue.Queue()
+        progress = queue.Queue()
+        for chunk in chunks[1:] + [None]: todo.put(chunk)
+        open_checkpoint_journal("Workers", self.TEST_CONFIG, False, date(2022,1,10))
+        run_feeder_worker("Worker_01", self.TEST_CONFIG, todo, progress, False, date(2022,1,10), "Workers", client=client)
+        messages = [progress.get() for _ in range(progress.qsize())]
+        self.assertEqual([message[0] for message in messages], ["started", "done"]*4)
+        self.assertEqual(sum([message[3] for message in messages if message[0] == "done"]), 10)
+        self.assertEqual(sum([message[4] for message in messages if message[0] == "done"]), 1)
+        # The list of symbols is only fetched once (the failing ticker does not reach the fake API)
+        self.assertEqual(client.requests, 2 + 9)
+        for i in range(10):
+            self.assertEqual(os.path.exists(os.path.join(location, "EQUITIES", "XX", "T"+str(i), "close.npy")), i != 4)
+        # The worker records the tickers in its own part of the journal
+        self.assertTrue(os.path.exists(os.path.join(location, "checkpoint_Workers.Worker_01.jsonl")))
+        journal = CheckpointJournal.read(os.path.join(location, "checkpoint_Workers.jsonl"))
+        self.assertEqual((len(journal.get_done()), list(journal.get_failed().keys())), (9, ["T4.XX"]))
+
+    def test_load_stats(self):
+        location = self.set_temporary_db(FEEDER_CONCURRENCY="4", FEEDER_REQUESTS_PER_MINUTE="0")
+        client = FakeEodHistoricalData.create("XX", 5, date(2022,1,1), 10, latency=0.01)
+        update_db(client, [("XX", -1, 1, 0)], False, date(2022,1,10))
+        conn = connect_load_stats(os.path.join(location, "loadstats.db"))
+        costs = get_ticker_costs(conn, "XX")
+        self.assertEqual(sorted(costs.keys()), ["T0", "T1", "T2", "T3", "T4"])
+        self.assertTrue(all([cost >= 0.01 for cost in costs.values()]))
+        self.assertEqual(conn.execute("SELECT SUM(days), SUM(bytes) FROM TickerLoad").fetchone(), (50, 50*6*4))
+        conn.close()
+
     def test__get_last_date(self):
         self.assertEqual(get_last_date("PGHN.VX"), date(2022,11,10))
 
@@ -1,22 +1,67 @@
 import json
 import logging
 import os
+import shutil
+import tempfile
+import unittest
 from config import  get_config, get_install_location,  init_logging, process_arguments
 from exceptions import PMException
+from tickermeta import write_atomically
+from universefile import UNIVERSE_FILE, UNIVERSE_JSON_FILE, read_universe, write_universe
 
 
-__logger = None
+__logger = logging.getLogger('indexer')
+
+# Manifest of the id files indexed in an exchange directory: ticker directory -> [id file mtime (ns), id file size, id file content]
+MANIFEST_FILE = "index_manifest.json"
+
+def __read_manifest(directory)->dict:
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), 'rt') as manifest:
+            return json.load(manifest)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def index_exchange(basedir, exchange_dir)->tuple:
+    '''
+    Incrementally indexes the tickers of the exchange: only the id files which are new or modified (mtime or size) since the last run are read,
+    the others being taken from the manifest of the exchange.
+    The universe file and the manifest are only rewritten if a ticker was added, modified or removed.
+    Tickers keep their position in the universe, new tickers being appended.
+    Returns a tuple (universe, True if the universe changed).
+    '''
+    directory = os.path.join(basedir, exchange_dir)
+    manifest = __read_manifest(directory)
+    indexed = {}
+    read = 0
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_dir(): continue
+            try:
+                stat = os.stat(os.path.join(entry.path, 'id'))
+            except FileNotFoundError:
+                __logger.warning("Ticker directory %s has no id file, ignoring it", entry.path)
+                continue
+            previous = manifest.get(entry.name)
+            if (previous != None) and (previous[0] == stat.st_mtime_ns) and (previous[1] == stat.st_size):
+                indexed[entry.name] = previous
+            else:
+                with open(os.path.join(entry.path, 'id'), 'rt') as id:
+                    indexed[entry.name] = [stat.st_mtime_ns, stat.st_size, json.load(id)]
+                read += 1
+    changed = (read > 0) or (len(indexed) != len(manifest)) or not os.path.exists(os.path.join(directory, UNIVERSE_FILE))
+    order = [name for name in manifest if name in indexed] + [name for name in indexed if name not in manifest]
+    universe = [indexed[name][2] for name in order]
+    if changed:
+        __logger.info("%d id files read for exchange %s, %d tickers removed", read, exchange_dir, len([name for name in manifest if name not in indexed]))
+        update_universe(directory, exchange_dir, universe)
+        write_atomically(os.path.join(directory, MANIFEST_FILE), {name:indexed[name] for name in order})
+    else:
+        __logger.info("Universe of exchange %s unchanged", exchange_dir)
+    return (universe, changed)
 
 def walk_exchange(basedir, exchange_dir)->list:
-    universe=[]
-    for ticker in os.listdir(os.path.join(basedir,exchange_dir)):
-        #Find the ID file
-        idfiledir = os.path.join(basedir, exchange_dir, ticker)
-        if(os.path.isdir(idfiledir)):
-            with open(os.path.join(idfiledir, 'id'), 'rt') as id:
-                universe.append(json.load(id))
-    update_universe(os.path.join(basedir, exchange_dir), exchange_dir, universe)
-    return universe
+    return index_exchange(basedir, exchange_dir)[0]
 
 def walk(databasename:str, exchange_list:list)->list:
     '''
@@ -27,19 +72,57 @@ def walk(databasename:str, exchange_list:list)->list:
     basedir = os.path.join(install, "backend", db_location,databasename)
     universe = []
     if(len(exchange_list)==0):
+        changed = not os.path.exists(os.path.join(basedir, UNIVERSE_FILE))
         for exchange in os.listdir(basedir):
             if(os.path.isdir(os.path.join(basedir, exchange))):
-                universe.extend(walk_exchange(basedir, exchange))
-        update_universe(basedir, "ALL", universe)
+                (exchange_universe, exchange_changed) = index_exchange(basedir, exchange)
+                universe.extend(exchange_universe)
+                changed = changed or exchange_changed
+        if changed: update_universe(basedir, "ALL", universe)
     else:
         for exchange in exchange_list:
             universe.extend(walk_exchange(basedir, exchange))
     return universe
 
 def update_universe(directory, exchange, universe:list):
+    '''
+    Writes the JSON and the columnar universe files, the columnar one last so it is not older than the JSON one.
+    '''
     __logger.info("Creating universe file for " + exchange)
-    with open(os.path.join(directory, 'universe.json'), 'wt') as u:
-        json.dump(universe, u)
+    write_atomically(os.path.join(directory, UNIVERSE_JSON_FILE), universe)
+    write_universe(directory, universe)
+
+
+class UnitTestIndexer(unittest.TestCase):
+    def create_ticker(self, location:str, code:str, name:str):
+        os.makedirs(os.path.join(location, "XX", code), exist_ok=True)
+        with open(os.path.join(location, "XX", code, "id"), 'wt') as id:
+            json.dump({"Code":code, "Name":name}, id)
+
+    def test_incremental(self):
+        location = tempfile.mkdtemp()
+        try:
+            for code in ["A", "B", "C"]:
+                self.create_ticker(location, code, code)
+            (universe, changed) = index_exchange(location, "XX")
+            self.assertTrue(changed)
+            self.assertEqual(sorted([ticker["Code"] for ticker in universe]), ["A", "B", "C"])
+            (universe, changed) = index_exchange(location, "XX")
+            self.assertFalse(changed)
+            order = [ticker["Code"] for ticker in universe]
+            # Modify B (the size of its id file changes), add D and remove C
+            self.create_ticker(location, "B", "New B")
+            self.create_ticker(location, "D", "D")
+            shutil.rmtree(os.path.join(location, "XX", "C"))
+            (universe, changed) = index_exchange(location, "XX")
+            self.assertTrue(changed)
+            self.assertEqual([ticker["Code"] for ticker in universe], [code for code in order if code != "C"] + ["D"])
+            self.assertEqual([ticker["Name"] for ticker in universe if ticker["Code"] == "B"], ["New B"])
+            with open(os.path.join(location, "XX", UNIVERSE_JSON_FILE)) as universefile:
+                self.assertEqual(json.load(universefile), universe)
+            self.assertEqual(read_universe(os.path.join(location, "XX"))["Name"], [ticker["Name"] for ticker in universe])
+        finally:
+            shutil.rmtree(location)
 
 
 if __name__ == '__main__':
@@ -55,6 +138,3 @@ if __name__ == '__main__':
     except Exception as e:
         print("Fatal error:", str(e))
         __logger.exception("Fatal error:%s", str(e))
-
-
-
@@ -1,2 +1,2 @@
-set PYTHONPATH=.\utils;.\backend\feeder;.\backend\api
+set PYTHONPATH=.\utils;.\backend\feeder;.\backend\api;.\backend\indexer
 code .
\ No newline at end of file
@@ -1,11 +1,18 @@
 import unittest
 
+from ColumnStore import UnitTestColumnStore
+from FXEngine import UnitTestFXEngine
 from FundamentalData import UnitTestFundamentalData
+from Holdings import UnitTestHoldings
 from Portfolios import UnitTestPortfolio, UnitTestValuations
 from PositionIdentifier import UnitTestTicker
 from Positions import UnitTestPositions
 from Session import UnitTestSession
 from TimeSeries import UnitTestTimeSeries
+from TimeSeriesCache import UnitTestTimeSeriesCache
+from TickerIndex import UnitTestTickerIndex
+from analytics import UnitTestAnalytics
+from LazyTimeSeries import UnitTestLazyTimeSeries
 from pmdata import UnitTestData
 
 
@@ -35,6 +42,11 @@ def apitestsuite():
     suite.addTest(UnitTestPortfolio('test_portfolio_tags'))
     suite.addTest(UnitTestPortfolio('test_multiple_currencies'))
     suite.addTest(UnitTestPortfolio('test_cryptos'))
+    suite.addTest(UnitTestPortfolio('test_quantities'))
+    suite.addTest(UnitTestPortfolio('test_apply_transactions'))
+    suite.addTest(UnitTestPortfolio('test_backdated_sell'))
+    suite.addTest(UnitTestPortfolio('test_backdated_load'))
+    suite.addTest(UnitTestPortfolio('test_snapshots_benchmark'))
     suite.addTest(UnitTestValuations('test_portfolio_ts'))
     suite.addTest(UnitTestValuations('test_currency_conversion'))
     suite.addTest(UnitTestValuations('test_get_valuations'))
@@ -55,6 +67,7 @@ def apitestsuite():
     suite.addTest(UnitTestValuations('test_dated_buy_multiccy'))
     suite.addTest(UnitTestValuations('test_portfolio_transaction_evaluation'))
     suite.addTest(UnitTestValuations('test_historical_portfolio_valuation'))
+    suite.addTest(UnitTestValuations('test_get_valuations_consistency'))
     suite.addTest(UnitTestValuations('test_tag_selection'))
     suite.addTest(UnitTestTicker('test_ticker'))
     suite.addTest(UnitTestTicker('test_ticker_equal'))
@@ -62,13 +75,44 @@ def apitestsuite():
     suite.addTest(UnitTestTicker('test_currency'))
     suite.addTest(UnitTestTicker('test_positionIdentifier'))
     suite.addTest(UnitTestPositions('test_positions_tags'))
+    suite.addTest(UnitTestPositions('test_copy'))
+    suite.addTest(UnitTestPositions('test_snapshots'))
+    suite.addTest(UnitTestHoldings('test_holdings'))
+    suite.addTest(UnitTestHoldings('test_growth'))
+    suite.addTest(UnitTestColumnStore('test_build'))
+    suite.addTest(UnitTestColumnStore('test_rebuild'))
+    suite.addTest(UnitTestColumnStore('test_update'))
+    suite.addTest(UnitTestTimeSeriesCache('test_lru'))
+    suite.addTest(UnitTestTimeSeriesCache('test_pin'))
+    suite.addTest(UnitTestTimeSeriesCache('test_unbounded'))
+    suite.addTest(UnitTestTimeSeriesCache('test_memory_mapped'))
+    suite.addTest(UnitTestData('test_fx_engine'))
+    suite.addTest(UnitTestData('test_cache_stats'))
+    suite.addTest(UnitTestData('test_get_panel'))
+    suite.addTest(UnitTestFXEngine('test_convert'))
+    suite.addTest(UnitTestFXEngine('test_coverage'))
+    suite.addTest(UnitTestFXEngine('test_loader'))
+    suite.addTest(UnitTestTickerIndex('test_search'))
+    suite.addTest(UnitTestTickerIndex('test_search_isin'))
+    suite.addTest(UnitTestTickerIndex('test_lazy'))
+    suite.addTest(UnitTestTickerIndex('test_short_queries'))
+    suite.addTest(UnitTestTickerIndex('test_short_query_latency'))
+    suite.addTest(UnitTestAnalytics('test_chain_returns'))
+    suite.addTest(UnitTestAnalytics('test_fill'))
+    suite.addTest(UnitTestAnalytics('test_rolling'))
+    suite.addTest(UnitTestAnalytics('test_performance'))
+    suite.addTest(UnitTestData('test_ranked_search'))
     suite.addTest(UnitTestTimeSeries('test_iadd'))
     suite.addTest(UnitTestTimeSeries('test_add'))
+    suite.addTest(UnitTestTimeSeries('test_aligned_operators'))
+    suite.addTest(UnitTestLazyTimeSeries('test_lazy'))
     suite.addTest(UnitTestTimeSeries('test_isub'))
     suite.addTest(UnitTestTimeSeries('test_sub'))
     suite.addTest(UnitTestTimeSeries('test_mul'))
     suite.addTest(UnitTestTimeSeries('test_div'))
     suite.addTest(UnitTestTimeSeries('test_dates'))
+    suite.addTest(UnitTestTimeSeries('test_get_range'))
+    suite.addTest(UnitTestTimeSeries('test_rolling'))
     suite.addTest(UnitTestSession('test_a_new_user'))
     suite.addTest(UnitTestSession('test_b_get_user'))
     suite.addTest(UnitTestSession('test_c_new_session'))
@@ -76,6 +120,7 @@ def apitestsuite():
     suite.addTest(UnitTestSession('test_e_portfolio_save_and_load'))
     suite.addTest(UnitTestSession('test_f_portfolio_group_save_and_load'))
     suite.addTest(UnitTestSession('test_g_save_dated_portfolio'))
+    suite.addTest(UnitTestSession('test_h_pinned_portfolio'))
     suite.addTest(UnitTestSession('test_z_delete_user'))
     return suite
 
@@ -3,14 +3,38 @@ from fdfeed import UnitTestFDFeeder
 
 from feeder import UnitTestFeeder
 from fxfeed import UnitTestFXFeeder
+from indexer import UnitTestIndexer
+from RateLimiter import UnitTestRateLimiter
+from CheckpointJournal import UnitTestCheckpointJournal
+from loadstats import UnitTestLoadStats
+from tickermeta import UnitTestTickerMeta
+from universefile import UnitTestUniverseFile
 
 
 def feedtestsuite():
     suite = unittest.TestSuite()
+    suite.addTest(UnitTestRateLimiter('test_rate'))
+    suite.addTest(UnitTestRateLimiter('test_unlimited'))
+    suite.addTest(UnitTestTickerMeta('test_ticker_meta'))
+    suite.addTest(UnitTestTickerMeta('test_coverage'))
+    suite.addTest(UnitTestUniverseFile('test_universe'))
+    suite.addTest(UnitTestCheckpointJournal('test_resume'))
+    suite.addTest(UnitTestCheckpointJournal('test_parts'))
+    suite.addTest(UnitTestLoadStats('test_costs'))
+    suite.addTest(UnitTestLoadStats('test_plan_batches'))
+    suite.addTest(UnitTestFeeder('test_parallel_load'))
+    suite.addTest(UnitTestFeeder('test_bulk_update'))
+    suite.addTest(UnitTestFeeder('test_append_in_place'))
+    suite.addTest(UnitTestFeeder('test_packing'))
+    suite.addTest(UnitTestFeeder('test_fill_gaps'))
+    suite.addTest(UnitTestFeeder('test_resume'))
+    suite.addTest(UnitTestFeeder('test_worker'))
+    suite.addTest(UnitTestFeeder('test_load_stats'))
     suite.addTest(UnitTestFeeder('test_full_load'))
     suite.addTest(UnitTestFeeder('test__get_last_date'))
     suite.addTest(UnitTestFeeder('test_update_load'))
     suite.addTest(UnitTestFeeder('test__get_next_last_date'))
+    suite.addTest(UnitTestIndexer('test_incremental'))
     suite.addTest(UnitTestFXFeeder('test_fx_load'))
     suite.addTest(UnitTestFDFeeder('test_fd_load'))
     suite.addTest(UnitTestFDFeeder('check_fd_load'))
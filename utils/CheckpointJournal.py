@@ -0,0 +1,198 @@
+from glob import escape, glob
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+
+class CheckpointJournal:
+    '''
+    Persistent journal of the tickers processed by a feeder run, used to resume an interrupted run.
+    The journal is a JSON lines file: a header describing the run (as of date, update mode) followed by one line per ticker processed,
+    appended and flushed as soon as the ticker is committed in the database (or has failed). The last line of a ticker gives its state.
+    Processes sharing a run each write their own part of the journal, <journal>.<part>.jsonl with the same header, read along with the journal.
+    A ticker done in any part is done, the parts not being ordered with each other.
+    Opening the journal (not a part) of a different run (another as of date or mode) starts a new journal, removing the parts of the previous run.
+    '''
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, filename:str, run:dict, part:str=None) -> None:
+        '''
+        filename: location of the journal
+        run: dictionary describing the run, the journal being resumed only if it was written by a run with the same description
+        part: name of the part written by this journal, None to write the journal itself
+        '''
+        self.filename = filename
+        self.run = run
+        self._tickers = {} # full ticker, entry {ticker, status, last_date or error}
+        self._lock = threading.Lock()
+        (root, extension) = os.path.splitext(filename)
+        self._written = filename if part is None else "{root}.{part}{extension}".format(root=root, part=part, extension=extension)
+        self.resumed = self._load(run)
+        if (not self.resumed) and (part is None):
+            # A new run starts
+            self._tickers.clear()
+            for path in self._get_parts(): os.remove(path)
+        if self._read_header(self._written) != run:
+            with open(self._written, 'w') as journal:
+                journal.write(json.dumps(run)+"\n")
+
+    @classmethod
+    def read(cls, filename:str):
+        '''
+        Returns the journal of the last run written in filename (its run being None if there is no journal), without writing anything:
+        it cannot record tickers.
+        '''
+        journal = cls.__new__(cls)
+        (journal.filename, journal._tickers, journal._lock, journal._written) = (filename, {}, threading.Lock(), None)
+        journal.run = cls._read_header(filename)
+        journal.resumed = (journal.run != None) and journal._load(journal.run)
+        return journal
+
+    @staticmethod
+    def _read_header(filename:str)->dict:
+        if not os.path.exists(filename): return None
+        with open(filename) as journal:
+            line = journal.readline()
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            return None
+
+    def _get_parts(self)->list:
+        (root, extension) = os.path.splitext(self.filename)
+        return glob(escape(root) + ".*" + escape(extension))
+
+    def _load(self, run:dict)->bool:
+        '''
+        Loads the tickers of the journal and of its parts written by run. Returns True if the journal was written by run.
+        '''
+        resumed = False
+        for path in [self.filename] + self._get_parts():
+            if not os.path.exists(path): continue
+            with open(path) as journal:
+                lines = journal.readlines()
+            try:
+                if (len(lines) == 0) or (json.loads(lines[0]) != run): continue
+            except json.JSONDecodeError:
+                continue
+            if path == self.filename: resumed = True
+            tickers = {}
+            for line in lines[1:]:
+                # A line partially written when the run died is ignored, the ticker is processed again
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                tickers[entry["ticker"]] = entry
+            for ticker, entry in tickers.items():
+                if (ticker not in self._tickers) or (self._tickers[ticker]["status"] != self.DONE): self._tickers[ticker] = entry
+            if (path == self._written) and not lines[-1].endswith("\n"):
+                with open(path, 'a') as journal: journal.write("\n")
+        return resumed
+
+    def __append(self, entry:dict):
+        if self._written is None: raise ValueError("The journal {filename} is read only".format(filename=self.filename))
+        with self._lock:
+            self._tickers[entry["ticker"]] = entry
+            with open(self._written, 'a') as journal:
+                journal.write(json.dumps(entry)+"\n")
+                journal.flush()
+
+    def record_done(self, full_ticker:str, last_date:str=None):
+        '''
+        Records the ticker as committed in the database, with its last coverage date
+        '''
+        self.__append({"ticker":full_ticker, "status":self.DONE, "last_date":last_date})
+
+    def record_failed(self, full_ticker:str, error:str):
+        self.__append({"ticker":full_ticker, "status":self.FAILED, "error":error})
+
+    def is_done(self, full_ticker:str)->bool:
+        entry = self._tickers.get(full_ticker)
+        return (entry != None) and (entry["status"] == self.DONE)
+
+    def is_failed(self, full_ticker:str)->bool:
+        entry = self._tickers.get(full_ticker)
+        return (entry != None) and (entry["status"] == self.FAILED)
+
+    def get_done(self)->dict:
+        '''
+        Returns the tickers committed as a dictionary of (full ticker, last coverage date)
+        '''
+        return {ticker:entry["last_date"] for ticker, entry in self._tickers.items() if entry["status"] == self.DONE}
+
+    def get_failed(self)->dict:
+        '''
+        Returns the tickers which failed (and did not succeed since) as a dictionary of (full ticker, error)
+        '''
+        return {ticker:entry["error"] for ticker, entry in self._tickers.items() if entry["status"] == self.FAILED}
+
+
+class UnitTestCheckpointJournal(unittest.TestCase):
+    def test_resume(self):
+        location = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(location, "checkpoint.jsonl")
+            journal = CheckpointJournal(filename, {"as_of_date":"2022-01-10", "update":True})
+            self.assertFalse(journal.resumed)
+            journal.record_done("A.US", "2022-01-10")
+            journal.record_failed("B.US", "timeout")
+            journal.record_failed("C.US", "timeout")
+            journal.record_done("C.US", "2022-01-07")
+            with open(filename, 'a') as f: f.write('{"ticker":"D.US", "sta')
+            journal = CheckpointJournal(filename, {"as_of_date":"2022-01-10", "update":True})
+            self.assertTrue(journal.resumed)
+            self.assertTrue(journal.is_done("A.US"))
+            self.assertTrue(journal.is_failed("B.US"))
+            self.assertFalse(journal.is_done("D.US") or journal.is_failed("D.US"))
+            self.assertEqual(journal.get_done(), {"A.US":"2022-01-10", "C.US":"2022-01-07"})
+            self.assertEqual(journal.get_failed(), {"B.US":"timeout"})
+            journal.record_done("B.US", "2022-01-10")
+            self.assertEqual(CheckpointJournal(filename, {"as_of_date":"2022-01-10", "update":True}).get_failed(), {})
+            # Reading the journal, whatever its run, does not change it
+            with open(filename) as f: content = f.read()
+            journal = CheckpointJournal.read(filename)
+            self.assertEqual(journal.run, {"as_of_date":"2022-01-10", "update":True})
+            self.assertEqual(journal.get_done(), {"A.US":"2022-01-10", "B.US":"2022-01-10", "C.US":"2022-01-07"})
+            self.assertRaises(ValueError, journal.record_done, "E.US")
+            with open(filename) as f: self.assertEqual(f.read(), content)
+            self.assertIsNone(CheckpointJournal.read(os.path.join(location, "none.jsonl")).run)
+            # Another run starts a new journal
+            journal = CheckpointJournal(filename, {"as_of_date":"2022-01-11", "update":True})
+            self.assertFalse(journal.resumed)
+            self.assertEqual(journal.get_done(), {})
+        finally:
+            shutil.rmtree(location)
+
+    def test_parts(self):
+        location = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(location, "checkpoint_Workers.jsonl")
+            run = {"as_of_date":"2022-01-10", "update":False}
+            journal = CheckpointJournal(filename, run)
+            workers = [CheckpointJournal(filename, run, "Worker_{n:02d}".format(n=n)) for n in (1, 2)]
+            self.assertTrue(workers[0].resumed)
+            workers[0].record_done("A.US", "2022-01-10")
+            workers[0].record_failed("B.US", "timeout")
+            workers[1].record_failed("A.US", "timeout")
+            workers[1].record_done("B.US", "2022-01-10")
+            workers[1].record_failed("C.US", "timeout")
+            self.assertEqual(sorted(os.listdir(location)), ["checkpoint_Workers.Worker_01.jsonl", "checkpoint_Workers.Worker_02.jsonl", "checkpoint_Workers.jsonl"])
+            # A ticker done by any worker is done
+            for journal in [CheckpointJournal(filename, run), CheckpointJournal.read(filename), CheckpointJournal(filename, run, "Worker_03")]:
+                self.assertEqual(journal.get_done(), {"A.US":"2022-01-10", "B.US":"2022-01-10"})
+                self.assertEqual(journal.get_failed(), {"C.US":"timeout"})
+            # The parts of a previous run are removed when a new run starts
+            journal = CheckpointJournal(filename, {"as_of_date":"2022-01-11", "update":False})
+            self.assertEqual(journal.get_done(), {})
+            self.assertEqual(os.listdir(location), ["checkpoint_Workers.jsonl"])
+        finally:
+            shutil.rmtree(location)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,420 @@
+from datetime import date, timedelta
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+from numpy import ndarray
+from analytics import forward_fill
+from tickermeta import FORWARD_FILLED, read_ticker_meta
+
+DATAPOINTS = ['open', 'close', 'high', 'low', 'adjusted_close', 'volume']
+
+_INDEX_FILE = "prices.index.npy"
+_DATA_FILE = "prices.{datapoint}.bin"
+_CHANGES_FILE = "prices.changes.{pid}.jsonl"
+_INDEX_DTYPE = [('offset', np.int64), ('base_date', 'datetime64[D]'), ('last_date', 'datetime64[D]'), ('forward_filled', bool), ('capacity', np.int64)]
+_BUILD_SIZE = np.dtype(np.int64).itemsize
+_VALUE_SIZE = np.dtype(np.float32).itemsize
+_MIN_RESERVED_DAYS = 32
+
+def _read_index(path:str)->tuple:
+    '''
+    Returns the (index, build id) of a store, both read from the same file so they belong to the same build.
+    The build id follows the array and is None for the stores built without one.
+    '''
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        (shape, _, dtype) = np.lib.format.read_array_header_1_0(f) if version == (1, 0) else np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+        index = np.memmap(f, dtype=dtype, mode='r', offset=offset, shape=shape)
+        f.seek(offset + index.nbytes)
+        build = f.read(_BUILD_SIZE)
+    return (index, int(np.frombuffer(build, dtype=np.int64)[0]) if len(build) == _BUILD_SIZE else None)
+
+def _read_build(path:str):
+    with open(path, 'rb') as f:
+        header = f.read(_BUILD_SIZE)
+    return int(np.frombuffer(header, dtype=np.int64)[0]) if len(header) == _BUILD_SIZE else None
+
+def _open_block(path:str, build)->ndarray:
+    '''
+    Maps the block of a data point, or returns None if it does not belong to the build of the index
+    '''
+    with open(path, 'rb') as f:
+        if build is None: return np.memmap(f, dtype=np.float32, mode='r')
+        header = f.read(_BUILD_SIZE)
+        if (len(header) != _BUILD_SIZE) or (int(np.frombuffer(header, dtype=np.int64)[0]) != build): return None
+        return np.memmap(f, dtype=np.float32, mode='r', offset=_BUILD_SIZE)
+
+def _get_capacity(days:int)->int:
+    '''
+    Returns the number of days kept for a time series of days, the days reserved growing with the time series so that it is moved
+    to the end of the blocks a logarithmic number of times
+    '''
+    return days + max(_MIN_RESERVED_DAYS, days // 8)
+
+def _read_changes(location:str)->tuple:
+    '''
+    Returns the change files of the exchange located at location and the changes they record:
+    the first date changed of each ticker, or None if the whole ticker changed.
+    '''
+    files = [f.path for f in os.scandir(location) if f.is_file() and f.name.startswith("prices.changes.") and f.name.endswith(".jsonl")]
+    changes = {}
+    for path in files:
+        with open(path) as changesfile:
+            for line in changesfile:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # The last line of a feeder which was interrupted
+                    continue
+                from_date = date.fromisoformat(change["from"]) if change["from"] != None else None
+                if change["code"] not in changes: changes[change["code"]] = from_date
+                elif (changes[change["code"]] != None): changes[change["code"]] = None if from_date == None else min(changes[change["code"]], from_date)
+    return (files, changes)
+
+def _read_ticker(ticker_loc:str, datapoints:list)->tuple:
+    '''
+    Returns the data points of the ticker located at ticker_loc as a tuple:
+    the (values, base date, last date) of each data point, the base date and last date of the ticker and whether all its data points are forward filled,
+    or None if the ticker has no data point.
+    The values are memory mapped so that only the days read are loaded.
+    '''
+    series = {}
+    metas = read_ticker_meta(ticker_loc)
+    for datapoint in datapoints:
+        if not ((datapoint in metas) and os.path.exists(os.path.join(ticker_loc, datapoint+".npy"))): continue
+        meta = metas[datapoint]
+        series[datapoint] = (np.load(os.path.join(ticker_loc, datapoint+".npy"), mmap_mode='r'), date.fromisoformat(meta["base_date"]), date.fromisoformat(meta["last_date"]))
+    if len(series) == 0: return None
+    # Data points padded to the dates of the ticker are filled again, so the ticker is only filled if they all are
+    forward_filled = all([metas[datapoint].get(FORWARD_FILLED, False) for datapoint in series])
+    return (series, min([s[1] for s in series.values()]), max([s[2] for s in series.values()]), forward_filled)
+
+def _align(series:dict, datapoint:str, start:date, last_date:date, days:int, seed=None)->ndarray:
+    '''
+    Returns days values of the data point from start, the values after last_date or missing for the data point being zero.
+    If seed is not None, the missing values are forward filled from seed, the value before start.
+    '''
+    data = np.zeros(days, dtype=np.float32)
+    if datapoint in series:
+        (a, base_date, end) = series[datapoint]
+        size = min(a.size, (end - base_date).days + 1, (last_date - base_date).days + 1)
+        first = max((start - base_date).days, 0)
+        if first < size:
+            position = max((base_date - start).days, 0)
+            data[position:position + size - first] = a[first:size]
+    if seed is not None:
+        data = forward_fill(np.concatenate(([seed], data)).astype(np.float32))[1:]
+    return data
+
+def _write_index(location:str, entries:list, build:ndarray, tmp:str):
+    index = np.array(entries, dtype=[('code', 'U{size}'.format(size=max([len(entry[0]) for entry in entries], default=1)))] + _INDEX_DTYPE)
+    with open(os.path.join(location, _INDEX_FILE+tmp), 'wb') as indexfile:
+        np.save(indexfile, index)
+        build.tofile(indexfile)
+
+class ColumnStore:
+    '''
+    Read only, memory mapped store of the end of day prices of an exchange.
+    The store is made of files located in the exchange directory of the database:
+    . prices.<datapoint>.bin: one contiguous block of float32 per data point containing the time series of all tickers one after the other,
+    each one followed by days reserved for its updates
+    . prices.index.npy: a sorted array of ticker codes, each one with the offset of its time series in the blocks, its base date, its last date,
+    whether its missing values are already forward filled and its number of days including the reserved ones
+    . prices.changes.<pid>.jsonl: the tickers changed by the feeders since the store was built or updated
+    All the data points of a ticker share the same offset, base date and last date.
+    Each build of the store has an id, written after the index and at the start of the blocks, so that the blocks,
+    which are mapped when first read, are never read with the offsets of another build: the index is read again when they differ.
+    Time series are returned as read only views on the memory mapped blocks, no data is copied.
+    '''
+    def __init__(self, location:str):
+        self.location = location
+        self._load()
+
+    def _load(self):
+        (index, self._build) = _read_index(os.path.join(self.location, _INDEX_FILE))
+        self._codes:ndarray = index['code']
+        self._index:ndarray = index[['offset', 'base_date', 'last_date']]
+        # Stores built before the flag have no forward filled ticker
+        self._forward_filled:ndarray = index['forward_filled'] if 'forward_filled' in index.dtype.names else None
+        self._blocks = {}
+
+    @staticmethod
+    def exists(location:str)->bool:
+        return os.path.exists(os.path.join(location, _INDEX_FILE))
+
+    def _find(self, ticker:str)->int:
+        i = int(np.searchsorted(self._codes, ticker))
+        if (i < self._codes.size) and (self._codes[i] == ticker): return i
+        return -1
+
+    def _get_block(self, datapoint:str)->ndarray:
+        if datapoint not in self._blocks:
+            path = os.path.join(self.location, _DATA_FILE.format(datapoint=datapoint))
+            if not os.path.exists(path): return None
+            block = _open_block(path, self._build)
+            if block is None:
+                # The store was rebuilt since the index was read: the blocks already mapped belong to the previous build
+                self._load()
+                block = _open_block(path, self._build)
+                # Still being rebuilt, the time series is read from the files of the ticker in the meantime
+                if block is None: return None
+            self._blocks[datapoint] = block
+        return self._blocks[datapoint]
+
+    def get(self, ticker:str, datapoint:str):
+        '''
+        Returns a (time series, base date, last date) tuple for the data point of the ticker (not fully qualified with the exchange)
+        or None if the ticker or the data point is not in the store.
+        '''
+        # The block is mapped first as the index may be read again if it belongs to another build
+        block = self._get_block(datapoint)
+        if block is None: return None
+        i = self._find(ticker)
+        if i < 0: return None
+        offset, base_date, last_date = self._index[i].item()
+        return (block[offset:offset + (last_date - base_date).days + 1], base_date, last_date)
+
+    def is_forward_filled(self, ticker:str)->bool:
+        '''
+        Returns True if the missing values of all the data points of the ticker were forward filled when written
+        '''
+        i = self._find(ticker)
+        return (i >= 0) and (self._forward_filled is not None) and bool(self._forward_filled[i])
+
+    def get_tickers(self)->ndarray:
+        return self._codes
+
+    def __contains__(self, ticker:str)->bool:
+        return self._find(ticker) >= 0
+
+    def __len__(self):
+        return self._codes.size
+
+    @staticmethod
+    def record_change(location:str, ticker:str, from_date:str):
+        '''
+        Records that the data points of the ticker will be written from from_date (ISO format), or entirely if from_date is None,
+        so that the next update of the store of the exchange located at location reads them again.
+        Each process appends to its own change file, which the next build or update of the store removes.
+        '''
+        with open(os.path.join(location, _CHANGES_FILE.format(pid=os.getpid())), 'a') as changesfile:
+            changesfile.write(json.dumps({"code":ticker, "from":from_date}) + "\n")
+
+    @staticmethod
+    def build(location:str, datapoints:list=DATAPOINTS)->int:
+        '''
+        (Re)builds the store of the exchange located at location from the .npy files and the meta data of its tickers.
+        The files are written aside, under names specific to the process, and renamed once complete so readers never see a partially written store.
+        The store must be built once the tickers of the exchange are loaded, not while feeders are writing them.
+        Returns the number of tickers in the store.
+        '''
+        (changes_files, _) = _read_changes(location)
+        codes = sorted([f.name for f in os.scandir(location) if f.is_dir()])
+        entries = []
+        offset = 0
+        tmp = ".{pid}.tmp".format(pid=os.getpid())
+        build = np.array([time.time_ns()], dtype=np.int64)
+        files = {datapoint:open(os.path.join(location, _DATA_FILE.format(datapoint=datapoint)+tmp), 'wb') for datapoint in datapoints}
+        try:
+            for f in files.values(): build.tofile(f)
+            for code in codes:
+                ticker = _read_ticker(os.path.join(location, code), datapoints)
+                if ticker is None: continue
+                (series, base_date, last_date, forward_filled) = ticker
+                # Align all the data points of the ticker on the same dates, followed by the days reserved for its updates
+                capacity = _get_capacity((last_date - base_date).days + 1)
+                for datapoint in datapoints:
+                    _align(series, datapoint, base_date, last_date, capacity, 0.0 if forward_filled else None).tofile(files[datapoint])
+                entries.append((code, offset, base_date, last_date, forward_filled, capacity))
+                offset += capacity
+        finally:
+            for f in files.values(): f.close()
+        _write_index(location, entries, build, tmp)
+        for datapoint in datapoints:
+            os.replace(os.path.join(location, _DATA_FILE.format(datapoint=datapoint)+tmp), os.path.join(location, _DATA_FILE.format(datapoint=datapoint)))
+        os.replace(os.path.join(location, _INDEX_FILE+tmp), os.path.join(location, _INDEX_FILE))
+        for path in changes_files: os.remove(path)
+        return len(entries)
+
+    @staticmethod
+    def update(location:str, datapoints:list=DATAPOINTS)->int:
+        '''
+        Updates the store of the exchange located at location with the tickers changed since it was built or updated (see record_change):
+        only their data points are read, from the first date changed.
+        The new days of a ticker are written in place when they fit in the days reserved after its time series, otherwise the ticker is moved
+        to the end of the blocks. The days visible through the index are never moved, so readers keep reading the index they read.
+        The store is built again if it has no reserved days, or if less than half of its blocks is used.
+        As for a build, the store must not be updated while feeders are writing the tickers of the exchange.
+        Returns the number of tickers in the store.
+        '''
+        (changes_files, changes) = _read_changes(location)
+        if not ColumnStore.exists(location): return ColumnStore.build(location, datapoints)
+        (index, build) = _read_index(os.path.join(location, _INDEX_FILE))
+        paths = {datapoint:os.path.join(location, _DATA_FILE.format(datapoint=datapoint)) for datapoint in datapoints}
+        if (build is None) or ('capacity' not in index.dtype.names) or any([(not os.path.exists(path)) or (_read_build(path) != build) for path in paths.values()]):
+            return ColumnStore.build(location, datapoints)
+        # Days after the end of the index may still be read with a previous index: the tickers moved are written after the end of the blocks
+        end = max([(os.path.getsize(path) - _BUILD_SIZE) // _VALUE_SIZE for path in paths.values()])
+        if end > 2 * int(index['capacity'].sum()): return ColumnStore.build(location, datapoints)
+        previous = {str(entry['code']):entry for entry in index}
+        codes = sorted([f.name for f in os.scandir(location) if f.is_dir()])
+        entries = []
+        files = {datapoint:open(path, 'r+b') for (datapoint, path) in paths.items()}
+        try:
+            def write(datapoint:str, position:int, values:ndarray):
+                files[datapoint].seek(_BUILD_SIZE + position * _VALUE_SIZE)
+                files[datapoint].write(values.tobytes())
+            for code in codes:
+                entry = previous.get(code)
+                if (entry is not None) and (code not in changes):
+                    entries.append((code, int(entry['offset']), entry['base_date'], entry['last_date'], bool(entry['forward_filled']), int(entry['capacity'])))
+                    continue
+                ticker = _read_ticker(os.path.join(location, code), datapoints)
+                if ticker is None: continue
+                (series, base_date, last_date, forward_filled) = ticker
+                days = (last_date - base_date).days + 1
+                from_date = changes.get(code)
+                if (entry is not None) and (from_date is not None) and (entry['base_date'] == np.datetime64(base_date)) and (bool(entry['forward_filled']) == forward_filled) and (days <= entry['capacity']):
+                    # The values stored after the last date of the ticker are zero: they are read again too
+                    (offset, capacity) = (int(entry['offset']), int(entry['capacity']))
+                    start = max(min(from_date, entry['last_date'].item() + timedelta(days=1)), base_date)
+                    first = (start - base_date).days
+                    for datapoint in datapoints:
+                        seed = None
+                        if forward_filled:
+                            seed = 0.0
+                            if first > 0:
+                                files[datapoint].seek(_BUILD_SIZE + (offset + first - 1) * _VALUE_SIZE)
+                                seed = np.frombuffer(files[datapoint].read(_VALUE_SIZE), dtype=np.float32)[0]
+                        write(datapoint, offset + first, _align(series, datapoint, start, last_date, days - first, seed))
+                else:
+                    (offset, capacity) = (end, _get_capacity(days))
+                    for datapoint in datapoints:
+                        write(datapoint, offset, _align(series, datapoint, base_date, last_date, capacity, 0.0 if forward_filled else None))
+                    end += capacity
+                entries.append((code, offset, base_date, last_date, forward_filled, capacity))
+        finally:
+            for f in files.values(): f.close()
+        tmp = ".{pid}.tmp".format(pid=os.getpid())
+        _write_index(location, entries, np.array([build], dtype=np.int64), tmp)
+        os.replace(os.path.join(location, _INDEX_FILE+tmp), os.path.join(location, _INDEX_FILE))
+        for path in changes_files: os.remove(path)
+        return len(entries)
+
+
+class UnitTestColumnStore(unittest.TestCase):
+    def test_build(self):
+        location = tempfile.mkdtemp()
+        try:
+            for (code, start, end, values) in [('MSFT', '2022-01-01', '2022-01-04', [1,2,0,4]), ('CSCO', '2022-01-03', '2022-01-04', [5,6])]:
+                os.mkdir(os.path.join(location, code))
+                for datapoint in ['open', 'close']:
+                    np.save(os.path.join(location, code, datapoint+".npy"), np.array(values, dtype=np.float32))
+                    with open(os.path.join(location, code, datapoint+".meta"), 'w') as metafile:
+                        json.dump({"base_date":start, "last_date":end, "name":datapoint}, metafile)
+            # The open prices of GOOG end earlier, they are filled to the last date of the ticker
+            os.mkdir(os.path.join(location, 'GOOG'))
+            for (datapoint, end, values) in [('open', '2022-01-02', [7,0]), ('close', '2022-01-03', [8,0,9])]:
+                np.save(os.path.join(location, 'GOOG', datapoint+".npy"), np.array(values, dtype=np.float32))
+                with open(os.path.join(location, 'GOOG', datapoint+".meta"), 'w') as metafile:
+                    json.dump({"base_date":'2022-01-01', "last_date":end, "name":datapoint, FORWARD_FILLED:True}, metafile)
+            self.assertFalse(ColumnStore.exists(location))
+            self.assertEqual(ColumnStore.build(location, ['open', 'close']), 3)
+            store = ColumnStore(location)
+            self.assertEqual(len(store), 3)
+            self.assertTrue('CSCO' in store)
+            self.assertFalse('GT' in store)
+            (a, base_date, last_date) = store.get('MSFT', 'close')
+            self.assertTrue(np.array_equal(a, [1,2,0,4]))
+            self.assertEqual((base_date, last_date), (date(2022,1,1), date(2022,1,4)))
+            (a, base_date, _) = store.get('CSCO', 'open')
+            self.assertTrue(np.array_equal(a, [5,6]))
+            self.assertEqual(base_date, date(2022,1,3))
+            self.assertIsNone(store.get('GT', 'open'))
+            self.assertIsNone(store.get('MSFT', 'volume'))
+            self.assertFalse(store.is_forward_filled('MSFT'))
+            self.assertTrue(store.is_forward_filled('GOOG'))
+            self.assertFalse(store.is_forward_filled('GT'))
+            self.assertTrue(np.array_equal(store.get('GOOG', 'open')[0], [7,7,7]))
+        finally:
+            shutil.rmtree(location)
+
+    def test_rebuild(self):
+        location = tempfile.mkdtemp()
+        try:
+            def write(code, values):
+                os.makedirs(os.path.join(location, code), exist_ok=True)
+                for datapoint in ['open', 'close']:
+                    np.save(os.path.join(location, code, datapoint+".npy"), np.array(values, dtype=np.float32))
+                    with open(os.path.join(location, code, datapoint+".meta"), 'w') as metafile:
+                        json.dump({"base_date":'2022-01-01', "last_date":str(date(2022,1,len(values))), "name":datapoint}, metafile)
+            write('MSFT', [1,2,3])
+            ColumnStore.build(location, ['open', 'close'])
+            store = ColumnStore(location)
+            (a, _, _) = store.get('MSFT', 'open')
+            # A ticker inserted before MSFT shifts its offset in the blocks of the new build
+            write('AAPL', [5,6,7,8])
+            write('MSFT', [1,2,3,4])
+            ColumnStore.build(location, ['open', 'close'])
+            self.assertTrue(np.array_equal(a, [1,2,3]))
+            (b, _, last_date) = store.get('MSFT', 'close')
+            self.assertTrue(np.array_equal(b, [1,2,3,4]))
+            self.assertEqual(last_date, date(2022,1,4))
+            self.assertTrue('AAPL' in store)
+            self.assertTrue(np.array_equal(store.get('MSFT', 'open')[0], [1,2,3,4]))
+        finally:
+            shutil.rmtree(location)
+
+    def test_update(self):
+        location = tempfile.mkdtemp()
+        try:
+            def write(code, values, filled:bool=False):
+                os.makedirs(os.path.join(location, code), exist_ok=True)
+                for datapoint in ['open', 'close']:
+                    np.save(os.path.join(location, code, datapoint+".npy"), np.array(values, dtype=np.float32))
+                    with open(os.path.join(location, code, datapoint+".meta"), 'w') as metafile:
+                        json.dump({"base_date":'2022-01-01', "last_date":str(date(2022,1,1) + timedelta(days=len(values)-1)), "name":datapoint, FORWARD_FILLED:filled}, metafile)
+            write('MSFT', [1,2,3])
+            write('CSCO', [5,6])
+            write('GOOG', [7,8], True)
+            self.assertEqual(ColumnStore.update(location, ['open', 'close']), 3)
+            store = ColumnStore(location)
+            size = os.path.getsize(os.path.join(location, _DATA_FILE.format(datapoint='open')))
+            offset = store._index[store._find('MSFT')]['offset']
+            # The new days are written in place, the tickers not recorded as changed are not read again
+            ColumnStore.record_change(location, 'MSFT', '2022-01-04')
+            write('MSFT', [1,2,3,0,5])
+            ColumnStore.record_change(location, 'GOOG', '2022-01-04')
+            write('GOOG', [7,8,0,10], True)
+            write('CSCO', [0,0])
+            ColumnStore.record_change(location, 'AAPL', None)
+            write('AAPL', [9])
+            self.assertEqual(ColumnStore.update(location, ['open', 'close']), 4)
+            self.assertEqual([f for f in os.listdir(location) if f.startswith("prices.changes.")], [])
+            self.assertEqual(os.path.getsize(os.path.join(location, _DATA_FILE.format(datapoint='open'))), size + _get_capacity(1) * _VALUE_SIZE)
+            self.assertTrue(np.array_equal(store.get('MSFT', 'close')[0], [1,2,3]))
+            updated = ColumnStore(location)
+            self.assertEqual(updated._index[updated._find('MSFT')]['offset'], offset)
+            self.assertTrue(np.array_equal(updated.get('MSFT', 'close')[0], [1,2,3,0,5]))
+            self.assertTrue(np.array_equal(updated.get('GOOG', 'open')[0], [7,8,8,10]))
+            self.assertTrue(np.array_equal(updated.get('CSCO', 'open')[0], [5,6]))
+            self.assertTrue(np.array_equal(updated.get('AAPL', 'open')[0], [9]))
+            # A ticker outgrowing its reserved days is moved after the end of the blocks
+            ColumnStore.record_change(location, 'MSFT', '2022-01-06')
+            write('MSFT', list(range(1, 101)))
+            ColumnStore.update(location, ['open', 'close'])
+            updated = ColumnStore(location)
+            self.assertTrue(updated._index[updated._find('MSFT')]['offset'] > offset)
+            self.assertTrue(np.array_equal(updated.get('MSFT', 'open')[0], range(1, 101)))
+            self.assertTrue(np.array_equal(store.get('MSFT', 'open')[0], [1,2,3]))
+        finally:
+            shutil.rmtree(location)
+
+
+if __name__ == '__main__':
+    unittest.main()
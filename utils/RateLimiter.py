@@ -0,0 +1,52 @@
+import threading
+import time
+import unittest
+
+
+class RateLimiter:
+    '''
+    Thread safe token bucket limiting the rate of calls to an API.
+    The bucket holds up to burst tokens and is refilled at rate tokens per second. Each call to acquire() takes one token,
+    waiting for the bucket to be refilled if it is empty.
+    A rate of 0 (or less) means no limit.
+    '''
+    def __init__(self, rate:float, burst:int=1) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0: return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class UnitTestRateLimiter(unittest.TestCase):
+    def test_rate(self):
+        limiter = RateLimiter(100, burst=5)
+        start = time.monotonic()
+        for _ in range(25):
+            limiter.acquire()
+        # 5 tokens are available immediately, the 20 others come at 100 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    def test_unlimited(self):
+        limiter = RateLimiter(0)
+        start = time.monotonic()
+        for _ in range(1000):
+            limiter.acquire()
+        self.assertLess(time.monotonic() - start, 0.1)
+
+
+if __name__ == '__main__':
+    unittest.main()
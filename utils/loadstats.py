@@ -0,0 +1,146 @@
+'''
+Local SQLite store of the feeder load statistics, following the ExchangeLoad and TickerLoad tables of the PMFeeder database:
+. BatchLoad: one row per run of a batch, with its predicted and actual durations
+. ExchangeLoad: one row per load of an exchange part, with its predicted and actual durations
+. TickerLoad: one row per ticker loaded, with the number of days and bytes written and the time taken to fetch and write them
+The durations of the past loads are the cost model of the batch planner (controlFeedConfig).
+'''
+import heapq
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import unittest
+from datetime import datetime
+
+__SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS BatchLoad (id INTEGER PRIMARY KEY AUTOINCREMENT, batch_name TEXT NOT NULL, load_time TEXT NOT NULL,
+        predicted_seconds REAL, duration_seconds REAL)''',
+    '''CREATE TABLE IF NOT EXISTS ExchangeLoad (id INTEGER PRIMARY KEY AUTOINCREMENT, code TEXT NOT NULL, part INTEGER NOT NULL, load_time TEXT NOT NULL,
+        is_update INTEGER NOT NULL, predicted_seconds REAL, duration_seconds REAL)''',
+    '''CREATE TABLE IF NOT EXISTS TickerLoad (id INTEGER PRIMARY KEY AUTOINCREMENT, exchange_load_id INTEGER REFERENCES ExchangeLoad(id), ticker_code TEXT NOT NULL,
+        days INTEGER NOT NULL, bytes INTEGER NOT NULL, duration_seconds REAL NOT NULL, load_time TEXT NOT NULL)''',
+    '''CREATE INDEX IF NOT EXISTS IX_TickerLoad_ticker ON TickerLoad (ticker_code)''',
+]
+
+def connect(filename:str)->sqlite3.Connection:
+    '''
+    Opens the load statistics database, creating it if needed.
+    Several feeder processes may write in the database, writers wait for each other up to 60 seconds.
+    '''
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    conn = sqlite3.connect(filename, timeout=60)
+    for statement in __SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+def start_batch_load(conn:sqlite3.Connection, batch_name:str, predicted_seconds:float=None)->int:
+    with conn:
+        return conn.execute("INSERT INTO BatchLoad (batch_name, load_time, predicted_seconds) VALUES (?, ?, ?)", (batch_name, datetime.now().isoformat(), predicted_seconds)).lastrowid
+
+def end_batch_load(conn:sqlite3.Connection, batch_load_id:int, duration_seconds:float):
+    with conn:
+        conn.execute("UPDATE BatchLoad SET duration_seconds = ? WHERE id = ?", (duration_seconds, batch_load_id))
+
+def start_exchange_load(conn:sqlite3.Connection, code:str, part:int, update:bool, predicted_seconds:float=None)->int:
+    with conn:
+        return conn.execute("INSERT INTO ExchangeLoad (code, part, load_time, is_update, predicted_seconds) VALUES (?, ?, ?, ?, ?)",
+            (code, part, datetime.now().isoformat(), int(update), predicted_seconds)).lastrowid
+
+def end_exchange_load(conn:sqlite3.Connection, exchange_load_id:int, duration_seconds:float):
+    with conn:
+        conn.execute("UPDATE ExchangeLoad SET duration_seconds = ? WHERE id = ?", (duration_seconds, exchange_load_id))
+
+def record_ticker_loads(conn:sqlite3.Connection, exchange_load_id:int, loads:list):
+    '''
+    Records the loads of the tickers of an exchange load, loads being a list of (full ticker, days, bytes, duration in seconds)
+    '''
+    now = datetime.now().isoformat()
+    with conn:
+        conn.executemany("INSERT INTO TickerLoad (exchange_load_id, ticker_code, days, bytes, duration_seconds, load_time) VALUES (?, ?, ?, ?, ?, ?)",
+            [(exchange_load_id, ticker, days, size, duration, now) for (ticker, days, size, duration) in loads])
+
+def get_ticker_costs(conn:sqlite3.Connection, exchange_code:str, update:bool=False)->dict:
+    '''
+    Returns the cost of loading each ticker of the exchange as a dictionary of (ticker code, seconds), the cost being the duration of its last load
+    in the same mode (full load or update).
+    '''
+    rows = conn.execute('''SELECT t.ticker_code, t.duration_seconds FROM TickerLoad t JOIN ExchangeLoad e ON t.exchange_load_id = e.id
+        WHERE e.code = ? AND e.is_update = ? ORDER BY t.id''', (exchange_code, int(update))).fetchall()
+    # Later loads override the earlier ones
+    return {ticker.rsplit('.', 1)[0]:duration for (ticker, duration) in rows}
+
+def estimate_costs(codes:list, costs:dict, default:float=None)->list:
+    '''
+    Returns the cost of each ticker code, tickers without a recorded cost costing the median of the recorded costs (or default if there is none).
+    '''
+    if default == None: default = statistics.median(costs.values()) if len(costs) > 0 else 1.0
+    return [costs.get(code, default) for code in codes]
+
+def plan_batches(parts:list, batch_number:int)->list:
+    '''
+    Splits the exchange parts {Code, Part, Start, Size, Predicted_Seconds} in batch_number batches with runtimes as balanced as possible.
+    Longest processing time first: the parts are taken from the most to the least expensive, each one going to the batch with the smallest predicted runtime so far,
+    which keeps the longest batch within 4/3 of the optimal one.
+    Returns the list of the (non empty) batches {Batch_Name, Predicted_Seconds, Exchanges}.
+    '''
+    batches = [{'Batch_Name':'Batch_{n:02d}'.format(n=i+1), 'Predicted_Seconds':0.0, 'Exchanges':[]} for i in range(batch_number)]
+    loads = [(0.0, i) for i in range(batch_number)]
+    for part in sorted(parts, key=lambda part: part['Predicted_Seconds'], reverse=True):
+        (load, i) = heapq.heappop(loads)
+        batches[i]['Exchanges'].append(part)
+        batches[i]['Predicted_Seconds'] = load + part['Predicted_Seconds']
+        heapq.heappush(loads, (batches[i]['Predicted_Seconds'], i))
+    return [batch for batch in batches if len(batch['Exchanges']) > 0]
+
+def get_batch_loads(conn:sqlite3.Connection, batch_name:str=None)->list:
+    '''
+    Returns the last run of each batch (or of the batch named batch_name) as a list of (batch name, load time, predicted seconds, actual seconds)
+    '''
+    query = '''SELECT batch_name, load_time, predicted_seconds, duration_seconds FROM BatchLoad
+        WHERE id IN (SELECT MAX(id) FROM BatchLoad GROUP BY batch_name)'''
+    if batch_name == None: return conn.execute(query+" ORDER BY batch_name").fetchall()
+    return conn.execute(query+" AND batch_name = ?", (batch_name,)).fetchall()
+
+
+class UnitTestLoadStats(unittest.TestCase):
+    def test_costs(self):
+        location = tempfile.mkdtemp()
+        try:
+            conn = connect(os.path.join(location, "stats", "loadstats.db"))
+            batch = start_batch_load(conn, "Batch_01", 10.0)
+            exchange_load = start_exchange_load(conn, "US", 1, False, 8.0)
+            record_ticker_loads(conn, exchange_load, [("A.US", 100, 2400, 1.5), ("B.US", 10, 240, 0.5)])
+            end_exchange_load(conn, exchange_load, 2.5)
+            exchange_load = start_exchange_load(conn, "US", 1, False)
+            record_ticker_loads(conn, exchange_load, [("A.US", 100, 2400, 2.5), ("C.US", 10, 240, 0.25)])
+            update_load = start_exchange_load(conn, "US", 1, True)
+            record_ticker_loads(conn, update_load, [("A.US", 1, 24, 0.1)])
+            end_batch_load(conn, batch, 12.0)
+            conn.close()
+            conn = connect(os.path.join(location, "stats", "loadstats.db"))
+            costs = get_ticker_costs(conn, "US")
+            self.assertEqual(costs, {"A":2.5, "B":0.5, "C":0.25})
+            self.assertEqual(get_ticker_costs(conn, "US", True), {"A":0.1})
+            self.assertEqual(get_ticker_costs(conn, "LSE"), {})
+            self.assertEqual(estimate_costs(["A", "D"], costs), [2.5, 0.5])
+            self.assertEqual(estimate_costs(["A"], {}), [1.0])
+            self.assertEqual([(b[0], b[2], b[3]) for b in get_batch_loads(conn)], [("Batch_01", 10.0, 12.0)])
+            conn.close()
+        finally:
+            shutil.rmtree(location)
+
+    def test_plan_batches(self):
+        parts = [{'Code':code, 'Predicted_Seconds':seconds} for (code, seconds) in [('A', 5), ('B', 5), ('C', 4), ('D', 4), ('E', 3), ('F', 3), ('G', 3)]]
+        batches = plan_batches(parts, 3)
+        self.assertEqual([batch['Batch_Name'] for batch in batches], ['Batch_01', 'Batch_02', 'Batch_03'])
+        # Worst case of the heuristic: the optimal longest batch takes 9 seconds (5+4, 5+4, 3+3+3)
+        self.assertEqual(sorted([batch['Predicted_Seconds'] for batch in batches]), [8, 8, 11])
+        self.assertEqual(sorted([part['Code'] for batch in batches for part in batch['Exchanges']]), ['A', 'B', 'C', 'D', 'E', 'F', 'G'])
+        self.assertEqual(len(plan_batches(parts[:2], 3)), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import glob
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+# Meta data of all the data points of a ticker, in the ticker directory
+META_FILE = "meta.json"
+# Last coverage date of all the tickers of an exchange, in the exchange directory
+COVERAGE_FILE = "coverage.json"
+# Meta data flag of a data point whose missing values were forward filled when written (FEEDER_FILL_GAPS)
+FORWARD_FILLED = "forward_filled"
+
+def write_atomically(filename:str, content):
+    '''
+    Writes content as JSON to a temporary file renamed to filename, so readers see either the previous or the new file.
+    The temporary file is specific to the process so concurrent feeders do not write in the same one.
+    '''
+    tmp = "{filename}.{pid}.tmp".format(filename=filename, pid=os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(content, f)
+    os.replace(tmp, filename)
+
+def read_ticker_meta(ticker_loc:str)->dict:
+    '''
+    Returns the meta data of the data points of the ticker located at ticker_loc as a dictionary of (data point name, {base_date, last_date, name}).
+    Databases written before the consolidated meta file have one .meta file per data point, read if there is no meta file.
+    Returns an empty dictionary if the ticker has no meta data.
+    '''
+    try:
+        with open(os.path.join(ticker_loc, META_FILE)) as metafile:
+            return json.load(metafile)
+    except FileNotFoundError:
+        toreturn = {}
+        for filename in glob.glob(os.path.join(ticker_loc, "*.meta")):
+            with open(filename) as metafile:
+                meta = json.load(metafile)
+            toreturn[meta["name"]] = meta
+        return toreturn
+
+def write_ticker_meta(ticker_loc:str, meta:dict):
+    '''
+    Commits the meta data of the data points of the ticker, and removes the legacy .meta files it replaces.
+    '''
+    write_atomically(os.path.join(ticker_loc, META_FILE), meta)
+    for filename in glob.glob(os.path.join(ticker_loc, "*.meta")):
+        os.remove(filename)
+
+def get_last_coverage_date(meta:dict)->str:
+    '''
+    Returns the oldest last date of the data points in the meta data of a ticker, or None if it has no data point.
+    '''
+    return min([dp["last_date"] for dp in meta.values()], default=None)
+
+def read_coverage(exchange_loc:str)->dict:
+    '''
+    Returns the last coverage dates of the tickers of the exchange as a dictionary of (ticker code, date string), empty if there is no coverage file.
+    '''
+    try:
+        with open(os.path.join(exchange_loc, COVERAGE_FILE)) as coveragefile:
+            return json.load(coveragefile)
+    except FileNotFoundError:
+        return {}
+
+def update_coverage(exchange_loc:str, last_dates:dict):
+    '''
+    Merges the last coverage dates of (some) tickers of the exchange into its coverage file.
+    '''
+    coverage = read_coverage(exchange_loc)
+    coverage.update(last_dates)
+    write_atomically(os.path.join(exchange_loc, COVERAGE_FILE), coverage)
+
+
+class UnitTestTickerMeta(unittest.TestCase):
+    def test_ticker_meta(self):
+        location = tempfile.mkdtemp()
+        try:
+            for (name, last_date) in [("open", "2022-01-04"), ("close", "2022-01-03")]:
+                with open(os.path.join(location, name+".meta"), 'w') as metafile:
+                    json.dump({"base_date":"2022-01-01", "last_date":last_date, "name":name}, metafile)
+            meta = read_ticker_meta(location)
+            self.assertEqual(sorted(meta.keys()), ["close", "open"])
+            self.assertEqual(get_last_coverage_date(meta), "2022-01-03")
+            meta["close"]["last_date"] = "2022-01-05"
+            write_ticker_meta(location, meta)
+            self.assertEqual(os.listdir(location), [META_FILE])
+            self.assertEqual(get_last_coverage_date(read_ticker_meta(location)), "2022-01-04")
+            self.assertEqual(get_last_coverage_date({}), None)
+        finally:
+            shutil.rmtree(location)
+
+    def test_coverage(self):
+        location = tempfile.mkdtemp()
+        try:
+            self.assertEqual(read_coverage(location), {})
+            update_coverage(location, {"A":"2022-01-03", "B":"2022-01-04"})
+            update_coverage(location, {"A":"2022-01-05"})
+            self.assertEqual(read_coverage(location), {"A":"2022-01-05", "B":"2022-01-04"})
+        finally:
+            shutil.rmtree(location)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+# Universe of an exchange as id file structures, written by the indexer
+UNIVERSE_JSON_FILE = "universe.json"
+# Same universe stored by column: for each field of the id files, the UTF-8 values separated by a null character and the mask of the missing values
+UNIVERSE_FILE = "universe.npz"
+__SEPARATOR = '\x00'
+
+def write_universe(directory:str, universe:list):
+    '''
+    Writes the columnar universe file of the list of id file structures, through a temporary file renamed once complete.
+    '''
+    fields = list(dict.fromkeys([field for entry in universe for field in entry.keys()]))
+    arrays = {"__count":np.array([len(universe)], dtype=np.int64), "__fields":np.frombuffer(__SEPARATOR.join(fields).encode('utf-8'), dtype=np.uint8)}
+    for i, field in enumerate(fields):
+        values = [entry.get(field) for entry in universe]
+        arrays["values_{i}".format(i=i)] = np.frombuffer(__SEPARATOR.join(["" if value is None else str(value) for value in values]).encode('utf-8'), dtype=np.uint8)
+        arrays["missing_{i}".format(i=i)] = np.array([value is None for value in values], dtype=bool)
+    filename = os.path.join(directory, UNIVERSE_FILE)
+    tmp = "{filename}.{pid}.tmp".format(filename=filename, pid=os.getpid())
+    with open(tmp, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, filename)
+
+def __split(blob:np.ndarray, count:int)->list:
+    if count == 0: return []
+    return blob.tobytes().decode('utf-8').split(__SEPARATOR)
+
+def __read_columns(filename:str)->dict:
+    with np.load(filename) as npz:
+        count = int(npz["__count"][0])
+        toreturn = {}
+        for i, field in enumerate(__split(npz["__fields"], 1) if npz["__fields"].size > 0 else []):
+            values = __split(npz["values_{i}".format(i=i)], count)
+            for j in np.flatnonzero(npz["missing_{i}".format(i=i)]).tolist():
+                values[j] = None
+            toreturn[field] = values
+        return toreturn
+
+def read_universe(directory:str)->dict:
+    '''
+    Returns the universe of the exchange located in directory as a dictionary of (id file field, list of values).
+    The columnar file is read unless the JSON universe file is more recent (written by an older indexer).
+    '''
+    try:
+        columnar_time = os.stat(os.path.join(directory, UNIVERSE_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        columnar_time = None
+    try:
+        json_time = os.stat(os.path.join(directory, UNIVERSE_JSON_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        json_time = None
+    if (columnar_time != None) and ((json_time == None) or (columnar_time >= json_time)):
+        return __read_columns(os.path.join(directory, UNIVERSE_FILE))
+    with open(os.path.join(directory, UNIVERSE_JSON_FILE)) as universefile:
+        universe = json.load(universefile)
+    fields = dict.fromkeys([field for entry in universe for field in entry.keys()])
+    return {field:[entry.get(field) for entry in universe] for field in fields}
+
+
+class UnitTestUniverseFile(unittest.TestCase):
+    def test_universe(self):
+        location = tempfile.mkdtemp()
+        try:
+            universe = [{"Code":"MSFT", "Name":"Microsoft Corporation", "Isin":"US5949181045", "Currency":"USD"},
+                        {"Code":"NESN", "Name":"Nestlé S.A.", "Isin":None, "Currency":"CHF"},
+                        {"Code":"X", "Name":"", "Isin":"", "Currency":"USD", "Type":"ETF"}]
+            with open(os.path.join(location, UNIVERSE_JSON_FILE), 'w') as universefile:
+                json.dump(universe, universefile)
+            expected = {"Code":["MSFT", "NESN", "X"], "Name":["Microsoft Corporation", "Nestlé S.A.", ""], "Isin":["US5949181045", None, ""],
+                        "Currency":["USD", "CHF", "USD"], "Type":[None, None, "ETF"]}
+            self.assertEqual(read_universe(location), expected)
+            write_universe(location, universe)
+            self.assertEqual(read_universe(location), expected)
+            self.assertEqual(os.listdir(location).count(UNIVERSE_FILE), 1)
+            write_universe(location, [])
+            self.assertEqual(read_universe(location), {})
+            # A JSON universe written after the columnar one wins
+            os.utime(os.path.join(location, UNIVERSE_JSON_FILE), ns=(0, os.stat(os.path.join(location, UNIVERSE_FILE)).st_mtime_ns + 1))
+            self.assertEqual(read_universe(location), expected)
+        finally:
+            shutil.rmtree(location)
+
+
+if __name__ == '__main__':
+    unittest.main()